@@ -0,0 +1,63 @@
+'''
+Compare per-frame latency of face detection, before and after feeding detected face to landmark predictor.
+
+Usage:
+
+    python benchmarks/bench_detect_face.py photo1.jpg photo2.jpg ... [--rounds 20]
+
+The photos should be webcam-sized (640x480) and contain faces.
+'''
+
+import time
+import argparse
+import statistics
+from typing import List, Callable
+
+import numpy as np
+import face_recognition
+from PIL import Image
+
+from tumtum.models import DetectionSetting
+from tumtum.detectors import DlibHogDetector
+
+
+def legacy_detect(nimp: np.ndarray):
+    # What tasks.detect_face did: HOG detector runs twice, landmarks are computed for all faces.
+    faces = face_recognition.face_locations(nimp)
+    if not faces:
+        return None
+    landmarks = face_recognition.face_landmarks(nimp)
+    return faces[0], landmarks[0]['nose_bridge'], landmarks[0]['nose_tip']
+
+
+def measure(func: Callable, frames: List[np.ndarray], rounds: int) -> List[float]:
+    durations = []
+    for _i in range(rounds):
+        for f in frames:
+            start = time.perf_counter()
+            func(f)
+            durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(name: str, durations: List[float]):
+    print(f'{name:>12}: mean {statistics.mean(durations):7.2f} ms, '
+          f'median {statistics.median(durations):7.2f} ms, max {max(durations):7.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    frames = [np.asarray(Image.open(p).convert('RGB')) for p in args.images]
+    detector = DlibHogDetector(DetectionSetting())
+    # Warm up
+    legacy_detect(frames[0])
+    detector.detect(frames[0])
+    report('two-pass', measure(legacy_detect, frames, args.rounds))
+    report('single-pass', measure(detector.detect, frames, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
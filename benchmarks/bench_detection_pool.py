@@ -0,0 +1,99 @@
+'''
+Compare process pool and thread pool for face detection: memory footprint and throughput.
+
+Usage:
+
+    python benchmarks/bench_detection_pool.py frames/*.jpg [--workers 4] [--frames 200] [--engine dlib_hog]
+
+For each mode, the pool is warmed up, then frames are pushed through shared memory,
+keeping all workers busy, like the app does. Memory is the proportional set size (PSS)
+of the main process and worker processes, so pages shared after fork are not counted twice.
+'''
+
+import os
+import time
+import argparse
+from itertools import cycle
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import List, Dict, Any
+
+import numpy as np
+from PIL import Image
+
+from tumtum.models import DetectionSetting
+from tumtum.framering import FrameRing
+from tumtum.workers import DetectionPool
+from tumtum.tasks import inspect_frame
+
+
+def read_pss(pid: int) -> int:
+    # In kB
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    return 0
+
+
+def load_frame(path: str, setting: DetectionSetting) -> np.ndarray:
+    img = Image.open(path).convert('L' if setting.grayscale else 'RGB')
+    if setting.width and img.width != setting.width:
+        img = img.resize((setting.width, round(img.height * setting.width / img.width)))
+    return np.asarray(img)
+
+
+def run_mode(mode: str, frames: List[np.ndarray], workers: int, count: int, engine: str) -> Dict[str, Any]:
+    pool = DetectionPool(workers, engine, mode)
+    pool.warm_up()
+    if not pool.wait_ready(120):
+        pool.shutdown()
+        raise RuntimeError(f'Workers are not healthy: {pool.errors}')
+    ring = FrameRing(workers + 1, max(f.nbytes for f in frames))
+    pending = {}
+    source = cycle(frames)
+    started_at = time.perf_counter()
+    done = 0
+    while done < count:
+        while len(pending) < workers and done + len(pending) < count:
+            f = next(source)
+            ref = ring.write(f.data, f.shape)
+            pending[pool.executor.submit(inspect_frame, ref, None, 0, engine)] = ref
+        finished, _not = wait(tuple(pending), return_when=FIRST_COMPLETED)
+        for future in finished:
+            ring.release(pending.pop(future))
+            future.result()
+            done += 1
+    elapsed = time.perf_counter() - started_at
+    pids = {pid for pid, _thread in pool.workers}
+    pids.add(os.getpid())
+    memory = sum(read_pss(pid) for pid in pids)
+    pool.shutdown()
+    ring.close()
+    return {
+        'mode': mode,
+        'frames_per_second': count / elapsed,
+        'pss_mb': memory / 1024,
+        'processes': len(pids),
+        'warmup_seconds': pool.warmup_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', nargs='+')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--frames', dest='count', type=int, default=200, help='Number of frames to detect')
+    parser.add_argument('--engine', default='dlib_hog')
+    args = parser.parse_args()
+    setting = DetectionSetting()
+    frames = [load_frame(p, setting) for p in args.frames]
+    print(f"{'mode':>8} {'workers':>8} {'frames/s':>9} {'PSS (MB)':>9} {'warm-up (s)':>12}")
+    # Process mode first, so that the forked workers don't inherit models loaded in the main process
+    for mode in ('process', 'thread'):
+        r = run_mode(mode, frames, args.workers, args.count, args.engine)
+        print(f"{r['mode']:>8} {args.workers:>8} {r['frames_per_second']:9.1f} {r['pss_mb']:9.1f} "
+              f"{r['warmup_seconds']:12.2f}")
+
+
+if __name__ == '__main__':
+    main()
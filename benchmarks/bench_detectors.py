@@ -0,0 +1,98 @@
+'''
+Compare face detection engines on recorded frames: latency, detection rate, and agreement
+with the reference engine (IoU of face box, distance of nose tip).
+
+Usage:
+
+    python benchmarks/bench_detectors.py frames/*.jpg [--engines dlib_hog opencv_haar] [--rounds 5]
+
+Frames are scaled and converted like the app does before detection (see [detection] settings).
+Engines which cannot be loaded (missing package or model file) are skipped.
+'''
+
+import time
+import argparse
+import statistics
+from typing import List, Optional, Dict
+
+import numpy as np
+from PIL import Image
+
+from tumtum.models import CompactDrawData, DetectionSetting
+from tumtum.resources import load_config
+from tumtum.detectors import DETECTORS, Detector
+
+
+def load_frame(path: str, setting: DetectionSetting) -> np.ndarray:
+    img = Image.open(path).convert('L' if setting.grayscale else 'RGB')
+    if setting.width and img.width != setting.width:
+        height = round(img.height * setting.width / img.width)
+        img = img.resize((setting.width, height))
+    return np.asarray(img)
+
+
+def iou(a: CompactDrawData, b: CompactDrawData) -> float:
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a[0], b[0]
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def nose_distance(a: CompactDrawData, b: CompactDrawData) -> float:
+    # Distance between centers of nose tip points
+    return float(np.linalg.norm(np.mean(a[2], axis=0) - np.mean(b[2], axis=0)))
+
+
+def run_engine(detector: Detector, frames: List[np.ndarray], rounds: int):
+    durations = []
+    results: List[Optional[CompactDrawData]] = []
+    # Warm up
+    detector.detect(frames[0])
+    for r in range(rounds):
+        for f in frames:
+            start = time.perf_counter()
+            result = detector.detect(f)
+            durations.append((time.perf_counter() - start) * 1000)
+            if not r:
+                results.append(result)
+    return durations, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', nargs='+')
+    parser.add_argument('--engines', nargs='+', choices=tuple(DETECTORS), default=tuple(DETECTORS))
+    parser.add_argument('--reference', choices=tuple(DETECTORS), default='dlib_hog')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    setting = load_config().detection
+    frames = [load_frame(p, setting) for p in args.frames]
+    engines = list(args.engines)
+    if args.reference not in engines:
+        engines.insert(0, args.reference)
+    outcomes: Dict[str, List[Optional[CompactDrawData]]] = {}
+    print(f"{'engine':>15} {'mean':>8} {'median':>8} {'max':>8}  (ms) {'found':>7} {'IoU':>6} {'nose px':>8}")
+    for name in engines:
+        try:
+            detector = DETECTORS[name](setting)
+            durations, results = run_engine(detector, frames, args.rounds)
+        except (ImportError, ValueError) as e:
+            print(f'{name:>15} skipped: {e}')
+            continue
+        outcomes[name] = results
+        found = sum(r is not None for r in results)
+        line = (f'{name:>15} {statistics.mean(durations):8.2f} {statistics.median(durations):8.2f} '
+                f'{max(durations):8.2f}       {found:>3}/{len(frames):<3}')
+        reference = outcomes.get(args.reference)
+        pairs = [(r, ref) for r, ref in zip(results, reference or ()) if r and ref]
+        if name != args.reference and pairs:
+            line += (f' {statistics.mean(iou(r, ref) for r, ref in pairs):6.2f}'
+                     f' {statistics.mean(nose_distance(r, ref) for r, ref in pairs):8.1f}')
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
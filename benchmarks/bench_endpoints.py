@@ -0,0 +1,52 @@
+'''
+Compare the cost of getting frame submission URL, when built on every frame and when resolved once per challenge.
+
+Usage:
+
+    python benchmarks/bench_endpoints.py [--number 100000]
+'''
+
+import timeit
+import argparse
+from uuid import uuid4
+
+import yarl
+
+from tumtum.backends import AWSBackend, SSTBackend
+from tumtum.models import SSTSetting
+
+
+def legacy_aws_url(backend: AWSBackend, challenge_id: str) -> str:
+    # What AWSBackend.get_submit_frame_url did before base URL was cached
+    url = yarl.URL(backend._base_url).with_host(backend.domain).join(yarl.URL(f'{challenge_id}/frames'))
+    return str(url)
+
+
+def legacy_sst_url(backend: SSTBackend, challenge_id: str) -> str:
+    return str(yarl.URL(backend._base_url).join(yarl.URL(f'{challenge_id}/frames')))
+
+
+def report(name: str, seconds: float, number: int):
+    print(f'{name:>28}: {seconds / number * 1e6:8.3f} µs per frame')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+    number = args.number
+    challenge_id = str(uuid4())
+    aws = AWSBackend(domain='69hes0gg2k.execute-api.ap-southeast-1.amazonaws.com')
+    sst = SSTBackend.from_settings(SSTSetting(username='', password='',
+                                              base_url='http://localhost:8000/liveness-challenge/'))
+    for name, backend, legacy in (('AWS', aws, legacy_aws_url), ('SST', sst, legacy_sst_url)):
+        endpoints = backend.get_endpoints(challenge_id)
+        report(f'{name} build URL per frame', timeit.timeit(lambda: legacy(backend, challenge_id), number=number),
+               number)
+        report(f'{name} get_submit_frame_url', timeit.timeit(lambda: backend.get_submit_frame_url(challenge_id),
+                                                             number=number), number)
+        report(f'{name} per-challenge endpoints', timeit.timeit(lambda: endpoints.frames, number=number), number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Measure the per-frame cost of drawing challenge guides in the cairooverlay draw callback.
+
+Usage:
+
+    python benchmarks/bench_overlay_draw.py [--frames 5000] [--verbose]
+
+It compares the old callback, which reads ChallengeInfo, checks containment and logs on every frame,
+with OverlayPainter, which replays paths prepared when the challenge arrives.
+With --verbose, log messages are formatted, as when the app runs with -v.
+'''
+
+import io
+import time
+import argparse
+import statistics
+from uuid import uuid4
+from typing import List, Callable
+
+import cairo
+import logbook
+from logbook import Logger, StreamHandler
+
+from tumtum.models import ChallengeInfo, OverlayDrawData, Rectangle
+from tumtum.overlay import OverlayPainter
+
+
+logger = Logger(__name__)
+
+
+def make_challenge() -> ChallengeInfo:
+    return ChallengeInfo(id=uuid4(), user_id=uuid4(), image_width=640, image_height=480,
+                         area_left=128, area_top=48, area_width=384, area_height=384, min_face_area_percent=50,
+                         nose_left=300, nose_top=220, nose_width=64, nose_height=48)
+
+
+def legacy_draw(context: cairo.Context, info: ChallengeInfo, found_face: OverlayDrawData):
+    # What on_overlay_draw did, apart from state transitions
+    w, h, x, y = info.area_width, info.area_height, info.area_left, info.area_top
+    logger.debug('To draw area where face is expected: {}', (x, y, w, h))
+    context.rectangle(x, y, w, h)
+    fx, fy, fw, fh = found_face.face_box
+    face_inside = fx >= x and fy >= y and fx + fw <= x + w and fy + fh <= y + h
+    context.set_source_rgba(*((0, 0.9, 0, 0.6) if face_inside else (0.9, 0, 0, 0.6)))
+    context.set_line_width(4)
+    context.stroke()
+    w, h, x, y = info.nose_width, info.nose_height, info.nose_left, info.nose_top
+    logger.debug('To draw area where nose is expected: {}', (x, y, w, h))
+    context.rectangle(x, y, w, h)
+    context.set_source_rgba(0.8, 0.8, 0, 0.6)
+    context.set_line_width(4)
+    context.stroke()
+    nose_tip = found_face.nose_tip
+    context.move_to(*nose_tip[0])
+    context.set_source_rgba(1, 0.6, 0, 0.6)
+    context.set_line_width(2)
+    for nx, ny in nose_tip[1:]:
+        context.line_to(nx, ny)
+    context.stroke()
+    logger.debug('Detected nose at: {}', nose_tip)
+    all((x <= nx <= x + w and y <= ny <= y + h) for nx, ny in nose_tip)
+
+
+def measure(draw: Callable[[cairo.Context], None], count: int) -> List[float]:
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 640, 480)
+    context = cairo.Context(surface)
+    durations = []
+    for _i in range(count):
+        start = time.perf_counter()
+        draw(context)
+        durations.append((time.perf_counter() - start) * 1e6)
+    return durations
+
+
+def report(name: str, durations: List[float]):
+    durations.sort()
+    print(f'{name:>8}: mean {statistics.mean(durations):7.1f} µs, median {statistics.median(durations):7.1f} µs, '
+          f'p99 {durations[int(len(durations) * 0.99)]:7.1f} µs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--verbose', action='store_true', help='Format debug messages, like app with -v')
+    args = parser.parse_args()
+    info = make_challenge()
+    found_face = OverlayDrawData(face_box=Rectangle(200, 100, 200, 240),
+                                 nose_tip=[(310, 230), (320, 232), (330, 234), (340, 232), (350, 230)])
+    painter = OverlayPainter.from_info(info)
+    frame = painter.geometry.judge(found_face)
+    with StreamHandler(io.StringIO(), level=logbook.DEBUG if args.verbose else logbook.INFO).applicationbound():
+        report('legacy', measure(lambda c: legacy_draw(c, info, found_face), args.frames))
+        report('painter', measure(lambda c: painter.paint(c, frame, True), args.frames))
+
+
+if __name__ == '__main__':
+    main()
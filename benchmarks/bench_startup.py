@@ -0,0 +1,78 @@
+'''
+Measure GUI startup time: from process start to the first window.present() in do_activate.
+
+Usage:
+
+    python benchmarks/bench_startup.py [--rounds 5] [--budget 1.5]
+
+Each round runs the app in a fresh process, which quits as soon as the window is presented.
+Exit with non-zero status if the median time exceeds the budget (in seconds),
+or if heavy modules, which only face detection workers need, are loaded in the main process
+(which is expected with detection.pool = "thread").
+'''
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+
+HEAVY_MODULES = ('numpy', 'dlib', 'face_recognition', 'cv2', 'onnxruntime', 'PIL')
+ENV_STARTED_AT = 'TUMTUM_BENCH_STARTED_AT'
+
+
+def run_child():
+    # Time is passed from parent, to include interpreter startup
+    started_at = float(os.environ[ENV_STARTED_AT])
+    from tumtum.app import TumTumApplication
+    from gi.repository import GLib
+    imported_at = time.time()
+
+    class ProbedApplication(TumTumApplication):
+        def do_activate(self):
+            super().do_activate()
+            presented_at = time.time()
+            heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+            print(f'{imported_at - started_at:.4f} {presented_at - started_at:.4f} {",".join(heavy)}', flush=True)
+            GLib.idle_add(self.quit)
+
+    app = ProbedApplication()
+    app.run([sys.argv[0]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.5, help='Maximum median time to present window, in seconds')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child()
+        return
+    import_times, present_times = [], []
+    heavy = set()
+    for _i in range(args.rounds):
+        env = dict(os.environ, **{ENV_STARTED_AT: str(time.time())})
+        output = subprocess.run([sys.executable, __file__, '--child'], env=env, check=True,
+                                stdout=subprocess.PIPE, text=True).stdout
+        imported, presented, modules = (output.strip().splitlines()[-1].split(' ') + [''])[:3]
+        import_times.append(float(imported))
+        present_times.append(float(presented))
+        heavy.update(m for m in modules.split(',') if m)
+    median = statistics.median(present_times)
+    print(f'import tumtum.app: median {statistics.median(import_times):.3f}s')
+    print(f'window.present():  median {median:.3f}s, max {max(present_times):.3f}s (budget {args.budget:.3f}s)')
+    failed = False
+    if heavy:
+        print(f'Heavy modules loaded in main process: {", ".join(sorted(heavy))}')
+        failed = True
+    if median > args.budget:
+        print('Startup is over budget')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import pytest
+
+from tumtum.models import Rectangle, FrameSubmitRequest, build_frame_headers
+from tumtum.geometry import expand_box, align_crop, fit_dimension
+
+
+def test_expand_box():
+    assert expand_box(Rectangle(100, 100, 40, 60), 0.25) == Rectangle(90, 85, 60, 90)
+    assert expand_box(Rectangle(100, 100, 40, 60), 0) == Rectangle(100, 100, 40, 60)
+
+
+@pytest.mark.parametrize('rect, expected', (
+    # Grow outward to the grid
+    (Rectangle(20, 20, 40, 40), Rectangle(16, 16, 48, 48)),
+    (Rectangle(32, 48, 64, 16), Rectangle(32, 48, 64, 16)),
+    # Clamp inside the frame
+    (Rectangle(-10, -10, 40, 40), Rectangle(0, 0, 32, 32)),
+    (Rectangle(500, 460, 100, 100), Rectangle(496, 448, 112, 32)),
+    # Frame edge is not on the grid
+    (Rectangle(600, 0, 100, 30), Rectangle(592, 0, 44, 32)),
+))
+def test_align_crop(rect, expected):
+    assert align_crop(rect, (636, 480)) == expected
+
+
+def test_fit_dimension():
+    assert fit_dimension((640, 480), 0) == (640, 480)
+    assert fit_dimension((640, 480), 640) == (640, 480)
+    assert fit_dimension((640, 480), 320) == (320, 240)
+    # Even size, for JPEG chroma subsampling
+    assert fit_dimension((100, 75), 50) == (50, 38)
+    assert fit_dimension((1000, 3), 100) == (100, 2)
+
+
+def test_submit_request_without_crop():
+    request = FrameSubmitRequest(frame_base64='AAAA', token='abc')
+    request.set_crop(None)
+    assert request.request_for_sst() == {'content': 'AAAA'}
+    aws = request.request_for_aws()
+    assert aws['frameBase64'] == 'AAAA'
+    assert aws['token'] == 'abc'
+    assert not any(k.startswith('crop') for k in aws)
+    assert build_frame_headers(None) == {}
+
+
+def test_submit_request_with_crop():
+    request = FrameSubmitRequest(frame_base64='AAAA')
+    request.set_crop(Rectangle(16, 32, 320, 240))
+    assert request.request_for_sst() == {'content': 'AAAA', 'crop_left': 16, 'crop_top': 32,
+                                         'crop_width': 320, 'crop_height': 240}
+    aws = request.request_for_aws()
+    assert (aws['cropLeft'], aws['cropTop'], aws['cropWidth'], aws['cropHeight']) == (16, 32, 320, 240)
+    assert build_frame_headers(Rectangle(16, 32, 320, 240)) == {
+        'X-Crop-Left': '16', 'X-Crop-Top': '32', 'X-Crop-Width': '320', 'X-Crop-Height': '240',
+    }
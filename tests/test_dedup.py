@@ -0,0 +1,80 @@
+import pytest
+
+from tumtum.dedup import DetectionCache, frame_signature, signature_distance
+
+
+RESULT = ((10, 10, 50, 50), ((30, 20),), ((30, 40),))
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tumtum.dedup.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_signature_of_gray_frame():
+    data = bytes(range(16)) * 4
+    # Every other column, of every other row starting from the middle of the first cell
+    assert frame_signature(data, (4, 16), grid=(8, 2)) == bytes(range(0, 16, 2)) * 2
+
+
+def test_signature_takes_first_channel():
+    data = bytes([1, 2, 3] * 4 + [4, 5, 6] * 4)
+    assert frame_signature(data, (2, 4, 3), grid=(2, 2)) == bytes([1, 1, 4, 4])
+
+
+def test_signature_skips_row_padding():
+    padded = bytes([1, 2, 3, 0xff, 4, 5, 6, 0xff])
+    assert frame_signature(padded, (2, 3), stride=4, grid=(3, 2)) == bytes([1, 2, 3, 4, 5, 6])
+    assert frame_signature(memoryview(padded), (2, 3), stride=4, grid=(3, 2)) == bytes([1, 2, 3, 4, 5, 6])
+
+
+def test_signature_distance():
+    assert signature_distance(b'\x00\x10', b'\x00\x10') == 0
+    assert signature_distance(b'\x00\x10', b'\x10\x00') == 16
+    assert signature_distance(b'\x00', b'\x00\x00') == 255
+    assert signature_distance(b'', b'') == 0
+
+
+def test_lookup(now):
+    cache = DetectionCache(threshold=2, max_age=1, size=4)
+    cache.add(b'\x10\x10', RESULT)
+    assert cache.lookup(b'\x11\x12').result == RESULT
+    assert cache.lookup(b'\x20\x20') is None
+    assert cache.stats() == {'lookups': 2, 'hits': 1, 'hit_rate': 0.5, 'expired': 0, 'size': 1}
+
+
+def test_lookup_newest_first(now):
+    cache = DetectionCache(threshold=2, max_age=1, size=4)
+    cache.add(b'\x10', None)
+    cache.add(b'\x10', RESULT)
+    assert cache.lookup(b'\x10').result == RESULT
+
+
+def test_expiry(now):
+    cache = DetectionCache(threshold=2, max_age=1, size=4)
+    cache.add(b'\x10', RESULT)
+    now[0] += 1.5
+    assert cache.lookup(b'\x10') is None
+    assert cache.stats()['expired'] == 1
+    assert cache.stats()['size'] == 0
+
+
+def test_size_limit(now):
+    cache = DetectionCache(threshold=0, max_age=1, size=2)
+    for i in range(3):
+        cache.add(bytes([i]), RESULT)
+    assert cache.lookup(b'\x00') is None
+    assert cache.lookup(b'\x02')
+    cache.clear()
+    assert cache.lookup(b'\x02') is None
+
+
+def test_lookup_with_quality(now):
+    cache = DetectionCache(threshold=2, max_age=1, size=4)
+    cache.add(b'\x10', RESULT)
+    # Entry without quality cannot serve frames which need quality measured
+    assert cache.lookup(b'\x10', with_quality=True) is None
+    cache.add(b'\x10', RESULT, quality='measured')
+    assert cache.lookup(b'\x10', with_quality=True).quality == 'measured'
@@ -0,0 +1,48 @@
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+detectors = pytest.importorskip('tumtum.detectors')
+
+
+@pytest.fixture
+def fake_dlib(monkeypatch):
+    # Loading the predictor is slow, so that threads asking at the same time really overlap
+    loaded = []
+
+    def shape_predictor(path):
+        time.sleep(0.05)
+        loaded.append(path)
+        return object()
+
+    def get_frontal_face_detector():
+        loaded.append('face_detector')
+        return object()
+
+    dlib = types.SimpleNamespace(shape_predictor=shape_predictor, get_frontal_face_detector=get_frontal_face_detector)
+    monkeypatch.setitem(sys.modules, 'dlib', dlib)
+    monkeypatch.setitem(sys.modules, 'face_recognition_models',
+                        types.SimpleNamespace(pose_predictor_model_location=lambda: 'predictor.dat'))
+    monkeypatch.setattr(detectors, '_shape_predictor', None)
+    monkeypatch.setattr(detectors, '_detectors', {})
+    return loaded
+
+
+def test_shape_predictor_is_loaded_once(fake_dlib):
+    with ThreadPoolExecutor(4) as executor:
+        predictors = list(executor.map(lambda _i: detectors.get_shape_predictor(), range(8)))
+    assert fake_dlib == ['predictor.dat']
+    assert all(p is predictors[0] for p in predictors)
+
+
+def test_warm_up_in_worker_initializer(fake_dlib):
+    from tumtum.models import DetectionSetting
+    from tumtum.workers import init_worker, probe_worker
+    with ThreadPoolExecutor(2, initializer=init_worker, initargs=('dlib_hog', DetectionSetting())) as executor:
+        statuses = list(executor.map(probe_worker, (0.05, 0.05)))
+    assert [s.error for s in statuses] == ['', '']
+    # Loaded before any frame with a face comes, face detector for each worker thread
+    assert sorted(fake_dlib) == ['face_detector', 'face_detector', 'predictor.dat']
@@ -0,0 +1,48 @@
+import pytest
+
+from tumtum.consts import STREAM_MAX_UNACKED, STREAM_ACK_TIMEOUT
+
+net = pytest.importorskip('tumtum.net')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.messages = []
+
+    def get_state(self):
+        return net.Soup.WebsocketState.OPEN
+
+    def send_binary(self, data):
+        self.messages.append(data)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(net.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def stream():
+    stream = net.FrameStream(None, 'ws://localhost/stream')
+    stream.connection = FakeConnection()
+    return stream
+
+
+def test_drop_when_acks_are_pending(stream, clock):
+    for _i in range(STREAM_MAX_UNACKED + 1):
+        assert stream.send(b'jpeg')
+    assert stream.sent == STREAM_MAX_UNACKED
+    assert stream.dropped == 1
+
+
+def test_lost_acks_expire(stream, clock):
+    for _i in range(STREAM_MAX_UNACKED):
+        stream.send(b'jpeg')
+    # Server never acks these frames, the stream must not be stuck
+    clock[0] += STREAM_ACK_TIMEOUT
+    assert stream.send(b'jpeg')
+    assert stream.sent == STREAM_MAX_UNACKED + 1
+    assert stream.stats()['expired'] == STREAM_MAX_UNACKED
+    assert list(stream.unacked) == [STREAM_MAX_UNACKED]
@@ -0,0 +1,60 @@
+import pytest
+
+from tumtum.framerate import FrameRateController
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tumtum.framerate.time.monotonic', lambda: now[0])
+    return now
+
+
+def make_controller(fps=10, workers=1) -> FrameRateController:
+    return FrameRateController(fps, min_fps=2, max_fps=15, workers=workers, interval=1, headroom=0.8)
+
+
+def test_clamp_initial_fps():
+    assert make_controller(fps=30).fps == 15
+    assert make_controller(fps=1).fps == 2
+
+
+def test_wait_for_interval(now):
+    controller = make_controller()
+    controller.record(10, 1)
+    assert controller.update(0) is None
+    now[0] += 1
+    # Fast detection, frame rate goes up one step at a time
+    assert controller.update(0) == 11
+    # No samples in new window
+    now[0] += 1
+    assert controller.update(0) is None
+
+
+def test_go_down_to_capacity(now):
+    controller = make_controller()
+    now[0] += 1
+    # One worker, 200 ms each, can take 5 fps. With headroom, 4.
+    controller.record(200, 1)
+    assert controller.update(0) == 4
+    assert controller.fps == 4
+    assert controller.changes[-1]['fps'] == 4
+
+
+def test_step_down_when_saturated(now):
+    controller = make_controller(workers=4)
+    now[0] += 1
+    controller.record(10, 4)
+    assert controller.update(dropped_busy=3) == 9
+    now[0] += 1
+    controller.record(10, 4)
+    # No more drops since last window
+    assert controller.update(dropped_busy=3) == 10
+
+
+def test_stay_within_limits(now):
+    controller = make_controller(fps=15)
+    now[0] += 1
+    controller.record(1, 1)
+    assert controller.update(0) is None
+    assert controller.fps == 15
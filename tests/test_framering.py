@@ -0,0 +1,94 @@
+import pytest
+
+from tumtum.framering import FrameRing
+from tumtum.tasks import attach_frame
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(2, 12)
+    yield ring
+    ring.close()
+
+
+def test_write_and_view(ring):
+    ref = ring.write(bytes(range(12)), (2, 2, 3))
+    assert ref.ring == ring.name
+    assert ref.nbytes == 12
+    assert bytes(ring.view(ref)) == bytes(range(12))
+
+
+def test_no_free_slot(ring):
+    first = ring.write(b'a' * 12, (2, 2, 3))
+    assert ring.write(b'b' * 12, (2, 2, 3)) is not None
+    assert ring.write(b'c' * 12, (2, 2, 3)) is None
+    ring.release(first)
+    assert ring.write(b'c' * 12, (2, 2, 3)).slot == first.slot
+
+
+def test_frame_too_big(ring):
+    with pytest.raises(ValueError):
+        ring.write(b'a' * 13, (13,))
+
+
+def test_release_from_other_ring(ring):
+    other = FrameRing(1, 12)
+    try:
+        ref = other.write(b'a' * 12, (2, 2, 3))
+        ring.release(ref)
+        assert ring.idle
+    finally:
+        other.close()
+
+
+def test_retire_waits_for_frames(ring):
+    ref = ring.write(b'a' * 12, (2, 2, 3))
+    ring.retire()
+    assert not ring.closed
+    # Frame can still be read, as a worker which has not attached yet would
+    assert bytes(ring.view(ref)) == b'a' * 12
+    ring.release(ref)
+    assert ring.closed
+
+
+def test_retire_idle_ring(ring):
+    ring.retire()
+    assert ring.closed
+
+
+def test_attach_frame(ring):
+    np = pytest.importorskip('numpy')
+    ring.write(b'x' * 12, (2, 2, 3))
+    ref = ring.write(bytes(range(12)), (2, 2, 3))
+    nimp = attach_frame(ref)
+    assert nimp.shape == (2, 2, 3)
+    assert nimp.dtype == np.uint8
+    assert nimp.tolist() == [[[0, 1, 2], [3, 4, 5]], [[6, 7, 8], [9, 10, 11]]]
+    del nimp
+
+
+def test_attach_padded_frame():
+    pytest.importorskip('numpy')
+    # 3x2 RGB frame, each row of 9 bytes padded to 12
+    rows = [bytes(range(r * 9, r * 9 + 9)) + b'\xff' * 3 for r in range(2)]
+    ring = FrameRing(1, 24)
+    try:
+        ref = ring.write(b''.join(rows), (2, 3, 3), 12)
+        assert ref.padded
+        assert ref.nbytes == 24
+        nimp = attach_frame(ref)
+        assert nimp.flags['C_CONTIGUOUS']
+        assert nimp.reshape(-1).tolist() == list(range(18))
+        del nimp
+    finally:
+        ring.close()
+
+
+def test_packed_stride():
+    ring = FrameRing(1, 12)
+    try:
+        ref = ring.write(b'a' * 12, (2, 2, 3), 6)
+        assert not ref.padded
+        assert ref.nbytes == 12
+    finally:
+        ring.close()
@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+import pytest
+
+from tumtum.models import ChallengeInfo, OverlayDrawData, Rectangle
+from tumtum.geometry import ChallengeGeometry
+
+
+@pytest.fixture
+def geometry() -> ChallengeGeometry:
+    info = ChallengeInfo(id=uuid4(), user_id=uuid4(), image_width=640, image_height=480,
+                         area_left=128, area_top=48, area_width=384, area_height=384, min_face_area_percent=50,
+                         nose_left=300, nose_top=220, nose_width=64, nose_height=48)
+    return ChallengeGeometry.from_info(info)
+
+
+def test_face_inside(geometry):
+    assert geometry.is_face_inside(Rectangle(200, 100, 200, 240))
+    # Touching the edges is still inside
+    assert geometry.is_face_inside(Rectangle(128, 48, 384, 384))
+    assert not geometry.is_face_inside(Rectangle(100, 100, 200, 240))
+    assert not geometry.is_face_inside(Rectangle(200, 100, 200, 340))
+
+
+def test_nose_positioned(geometry):
+    assert geometry.is_nose_positioned([(300, 220), (364, 268)])
+    assert not geometry.is_nose_positioned([(310, 230), (365, 230)])
+
+
+def test_judge(geometry):
+    data = OverlayDrawData(face_box=Rectangle(200, 100, 200, 240), nose_tip=[(310, 230), (320, 232)])
+    frame = geometry.judge(data)
+    assert frame.face_inside
+    assert frame.nose_positioned
+    assert frame.nose_tip == ((310, 230), (320, 232))
+
+
+def test_judge_without_nose(geometry):
+    frame = geometry.judge(OverlayDrawData(face_box=Rectangle(0, 0, 100, 100), nose_tip=[]))
+    assert not frame.face_inside
+    assert not frame.nose_positioned
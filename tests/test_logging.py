@@ -0,0 +1,29 @@
+import os
+
+import logbook
+import pytest
+
+tumtum_logging = pytest.importorskip('tumtum.logging')
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Needs fork')
+def test_log_from_forked_child(tmp_path, monkeypatch):
+    output = tmp_path / 'log.txt'
+
+    def write(level, message):
+        with open(output, 'a') as f:
+            f.write(f'{os.getpid()} {message}\n')
+
+    monkeypatch.setattr(tumtum_logging, '_log', write)
+    handler = tumtum_logging.QueuedGLibLogHandler(level=logbook.INFO, format_string='{record.message}')
+    with handler.applicationbound():
+        pid = os.fork()
+        if not pid:
+            # Like a detection worker, which logs and then exits
+            logbook.Logger('worker').info('From child')
+            handler.close()
+            os._exit(0)
+        _pid, status = os.waitpid(pid, 0)
+    handler.close()
+    assert status == 0
+    assert output.read_text() == f'{pid} From child\n'
@@ -0,0 +1,23 @@
+from tumtum.ptsmap import PtsMap
+
+
+def test_pop():
+    frames = PtsMap()
+    frames.put(1000, 'a')
+    frames.put(2000, 'b')
+    assert frames.pop(2000) == 'b'
+    assert frames.pop(2000) is None
+    assert len(frames) == 1
+
+
+def test_keep_latest():
+    # Frames dropped after the entry is put are never popped, they must not pile up
+    frames = PtsMap(maxlen=3)
+    for pts in range(10):
+        frames.put(pts, pts * 10)
+    assert len(frames) == 3
+    assert frames.pop(6) is None
+    assert frames.pop(7) == 70
+    assert frames.pop(9) == 90
+    frames.clear()
+    assert frames.pop(8) is None
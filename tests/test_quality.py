@@ -0,0 +1,85 @@
+import pytest
+
+from tumtum.models import QualitySetting
+from tumtum.quality import FrameQuality, QualityGate, measure_quality
+
+
+GOOD = FrameQuality(sharpness=100, brightness=120, clipped=0.01, face_ratio=0.2)
+
+
+@pytest.fixture
+def gate() -> QualityGate:
+    return QualityGate(QualitySetting())
+
+
+@pytest.mark.parametrize('quality, reason', (
+    (GOOD, None),
+    (GOOD._replace(face_ratio=0), 'no_face'),
+    (GOOD._replace(face_ratio=0.01), 'small_face'),
+    (GOOD._replace(sharpness=10), 'blurry'),
+    (GOOD._replace(brightness=20), 'dark'),
+    (GOOD._replace(brightness=240), 'bright'),
+    (GOOD._replace(clipped=0.5), 'clipped'),
+))
+def test_judge(gate, quality, reason):
+    assert gate.judge(quality) == reason
+
+
+def test_check(gate):
+    assert not gate.passing
+    assert gate.check(GOOD)
+    assert gate.passing
+    assert not gate.check(GOOD._replace(sharpness=0))
+    assert not gate.passing
+    assert gate.stats() == {'accepted': 1, 'forced': 0, 'rejected': 1,
+                            'rejected_by': {'no_face': 0, 'small_face': 0, 'blurry': 1, 'dark': 0, 'bright': 0,
+                                            'clipped': 0}}
+    gate.check(GOOD)
+    gate.reset()
+    assert not gate.passing
+
+
+def test_measure_quality():
+    np = pytest.importorskip('numpy')
+    flat = np.full((40, 40), 128, np.uint8)
+    quality = measure_quality(flat, (10, 10, 20, 20))
+    assert quality.sharpness == 0
+    assert quality.brightness == 128
+    assert quality.clipped == 0
+    assert quality.face_ratio == 0.25
+    # Black and white checkerboard is as sharp as it gets, and all clipped
+    board = (np.indices((40, 40)).sum(axis=0) % 2 * 255).astype(np.uint8)
+    board = np.dstack((board, board, board))
+    quality = measure_quality(board, None)
+    assert quality.sharpness > 1000
+    assert quality.clipped == pytest.approx(1)
+    assert quality.face_ratio == 0
+
+
+def test_measure_tiny_face():
+    np = pytest.importorskip('numpy')
+    quality = measure_quality(np.zeros((40, 40), np.uint8), (0, 0, 2, 2))
+    assert quality == FrameQuality(0, 0, 1, 4 / 1600)
+
+
+def test_disabled_by_default():
+    assert not QualitySetting().enabled
+
+
+def test_let_frame_through_after_max_rejections():
+    gate = QualityGate(QualitySetting(max_rejections=2))
+    dark = GOOD._replace(brightness=20)
+    assert [gate.check(dark) for _i in range(6)] == [False, False, True, False, False, True]
+    stats = gate.stats()
+    assert stats['forced'] == 2
+    assert stats['rejected'] == 4
+    # A good frame starts the count over
+    gate.check(dark)
+    gate.check(GOOD)
+    assert not gate.check(dark)
+    assert not gate.check(dark)
+
+
+def test_no_rejection_limit():
+    gate = QualityGate(QualitySetting(max_rejections=0))
+    assert not any(gate.check(GOOD._replace(sharpness=0)) for _i in range(20))
@@ -0,0 +1,48 @@
+import logbook
+from logbook import LogRecord
+
+from tumtum.ratelimit import CallSiteRateLimiter
+
+
+def make_record(msg: str = 'Frame {}', channel: str = 'tumtum.app') -> LogRecord:
+    return LogRecord(channel, logbook.DEBUG, msg)
+
+
+def test_burst_per_call_site():
+    limiter = CallSiteRateLimiter(interval=60, burst=2)
+    record = make_record()
+    assert [limiter.allow(record) for _i in range(4)] == [True, True, False, False]
+    # Other call sites have their own budget
+    assert limiter.allow(make_record('Face: {}'))
+    assert limiter.allow(make_record(channel='tumtum.net'))
+
+
+def test_pop_suppressed():
+    limiter = CallSiteRateLimiter(interval=60, burst=1)
+    record = make_record()
+    for _i in range(4):
+        limiter.allow(record)
+    assert limiter.pop_suppressed(record) == 3
+    assert limiter.pop_suppressed(record) == 0
+    assert limiter.pop_suppressed(make_record('Unknown')) == 0
+
+
+def test_new_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tumtum.ratelimit.time.monotonic', lambda: now[0])
+    limiter = CallSiteRateLimiter(interval=1, burst=1)
+    record = make_record()
+    assert limiter.allow(record)
+    assert not limiter.allow(record)
+    now[0] += 1
+    assert limiter.allow(record)
+
+
+def test_reset_after_fork():
+    limiter = CallSiteRateLimiter(interval=60, burst=1)
+    record = make_record()
+    limiter.allow(record)
+    # Lock is left taken, like by a thread which the child process doesn't have
+    limiter._lock.acquire()
+    limiter.reset_after_fork()
+    assert limiter.allow(record)
@@ -0,0 +1,54 @@
+import pytest
+
+Gst = pytest.importorskip('gi.repository.Gst')
+prep = pytest.importorskip('tumtum.prep')
+
+
+FRAME_COUNT = 20
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    # Short image sequence, as replayed by tumtum-replay "frames/%04d.jpg"
+    Gst.init(None)
+    folder = tmp_path_factory.mktemp('frames')
+    pipeline = Gst.parse_launch(f'videotestsrc num-buffers={FRAME_COUNT} ! video/x-raw,width=320,height=240 ! '
+                                f'jpegenc ! multifilesink location="{folder}/%04d.jpg"')
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if not message or message.type != Gst.MessageType.EOS:
+        pytest.skip('Cannot make test frames with this GStreamer')
+    return f'{folder}/%04d.jpg'
+
+
+def test_upload_from_file_source(frames):
+    # Like ReplayRunner: the valve is opened from the detection appsink callback,
+    # which only runs if the pipeline gets to PLAYING with the valve still closed.
+    path, src_type = prep.get_replay_source(frames)
+    source = prep.build_replay_source(src_type, path, 'replay_source', 30)
+    command = (f'{source} ! tee name=t '
+               f't. ! {prep.build_appsink_branch("app_sink", 30)} '
+               f't. ! {prep.build_upload_branch("upload_sink", "upload_valve", 30, 75)}')
+    pipeline = Gst.parse_launch(command)
+    uploaded = []
+
+    def on_detection_sample(appsink):
+        appsink.pull_sample()
+        pipeline.get_by_name('upload_valve').set_property('drop', False)
+        return Gst.FlowReturn.OK
+
+    def on_upload_sample(appsink):
+        uploaded.append(appsink.pull_sample().get_buffer().get_size())
+        return Gst.FlowReturn.OK
+
+    for name, handler in (('app_sink', on_detection_sample), ('upload_sink', on_upload_sample)):
+        appsink = pipeline.get_by_name(name)
+        appsink.set_emit_signals(True)
+        appsink.connect('new-sample', handler)
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    assert message and message.type == Gst.MessageType.EOS
+    assert uploaded
+    assert all(uploaded)
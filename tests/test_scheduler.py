@@ -0,0 +1,108 @@
+from concurrent.futures import Executor, Future
+
+import pytest
+
+from tumtum.framering import FrameRef
+from tumtum.scheduler import DetectionScheduler
+
+
+class ManualExecutor(Executor):
+    # Futures are resolved by the test, in any order
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+@pytest.fixture
+def executor():
+    return ManualExecutor()
+
+
+@pytest.fixture
+def results():
+    return []
+
+
+@pytest.fixture
+def scheduler(executor, results):
+    return DetectionScheduler(executor, lambda job, future, fresh: results.append((job.seq, fresh)), 2)
+
+
+def make_frame(slot: int = 0) -> FrameRef:
+    return FrameRef('ring', slot, 12, (2, 2, 3))
+
+
+def test_drop_when_busy(scheduler):
+    assert scheduler.has_capacity()
+    scheduler.submit(print, make_frame(0))
+    scheduler.submit(print, make_frame(1))
+    assert not scheduler.has_capacity()
+    assert scheduler.stats()['dropped_busy'] == 1
+    assert scheduler.stats()['in_flight'] == 2
+
+
+def test_results_in_order(scheduler, executor, results):
+    scheduler.submit(print, make_frame(0))
+    scheduler.submit(print, make_frame(1))
+    executor.futures[0].set_result(None)
+    executor.futures[1].set_result(None)
+    assert results == [(0, True), (1, True)]
+    assert scheduler.stats()['accepted'] == 2
+    assert scheduler.stats()['dropped_stale'] == 0
+
+
+def test_drop_stale_result(scheduler, executor, results):
+    scheduler.submit(print, make_frame(0))
+    scheduler.submit(print, make_frame(1))
+    # Newer frame finishes first, the older result must not overwrite it
+    executor.futures[1].set_result(None)
+    executor.futures[0].set_result(None)
+    assert results == [(1, True), (0, False)]
+    stats = scheduler.stats()
+    assert stats['accepted'] == 1
+    assert stats['dropped_stale'] == 1
+    assert stats['in_flight'] == 0
+
+
+def test_cancel_all(scheduler, executor, results):
+    scheduler.submit(print, make_frame(0))
+    scheduler.cancel_all()
+    assert executor.futures[0].cancelled()
+    # Cancelled jobs still reach the callback, so that their frame slots are released
+    assert results == [(0, False)]
+    stats = scheduler.stats()
+    assert stats['dropped_stale'] == 0
+    assert stats['in_flight'] == 0
+
+
+def test_set_executor(scheduler, executor, results):
+    scheduler.submit(print, make_frame(0))
+    new_executor = ManualExecutor()
+    scheduler.set_executor(new_executor)
+    scheduler.submit(print, make_frame(1))
+    assert len(executor.futures) == 1
+    assert len(new_executor.futures) == 1
+    # Job left on the old executor is still handled, in order
+    executor.futures[0].set_result(None)
+    new_executor.futures[0].set_result(None)
+    assert results == [(0, True), (1, True)]
+
+
+def test_cached_result_is_newer_than_in_flight(scheduler, executor, results):
+    scheduler.submit(print, make_frame(0))
+    # Next frame is answered from cache while the first one is still detected
+    assert scheduler.accept_cached()
+    executor.futures[0].set_result(None)
+    assert results == [(0, False)]
+    stats = scheduler.stats()
+    assert stats['cached'] == 1
+    assert stats['accepted'] == 0
+    assert stats['dropped_stale'] == 1
+    # Frames after it are accepted as usual
+    scheduler.submit(print, make_frame(1))
+    executor.futures[1].set_result(None)
+    assert results[-1] == (2, True)
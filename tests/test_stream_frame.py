@@ -0,0 +1,40 @@
+import struct
+
+import pytest
+
+from tumtum.models import Rectangle, SSTSetting, STREAM_FRAME_HEADER, pack_stream_frame, unpack_stream_frame
+from tumtum.backends import SSTBackend
+
+
+JPEG = b'\xff\xd8 frame \xff\xd9'
+
+
+def test_round_trip_without_crop():
+    data = pack_stream_frame(7, JPEG)
+    assert len(data) == STREAM_FRAME_HEADER.size + len(JPEG)
+    assert unpack_stream_frame(data) == (7, None, JPEG)
+
+
+def test_round_trip_with_crop():
+    crop = Rectangle(16, 32, 320, 240)
+    assert unpack_stream_frame(pack_stream_frame(2 ** 32 - 1, JPEG, crop)) == (2 ** 32 - 1, crop, JPEG)
+
+
+def test_unpack_short_message():
+    with pytest.raises(struct.error):
+        unpack_stream_frame(b'\x00' * (STREAM_FRAME_HEADER.size - 1))
+
+
+@pytest.mark.parametrize('base_url, expected', (
+    ('http://localhost:8000/liveness-challenge/', 'ws://localhost:8000/liveness-challenge/abc/stream'),
+    ('https://example.com/liveness-challenge/', 'wss://example.com/liveness-challenge/abc/stream'),
+))
+def test_stream_url(base_url, expected):
+    settings = SSTSetting(username='u', password='p', base_url=base_url, stream_frames=True)
+    endpoints = SSTBackend.from_settings(settings).get_endpoints('abc')
+    assert endpoints.stream == expected
+
+
+def test_no_stream_url_by_default():
+    settings = SSTSetting(username='u', password='p')
+    assert SSTBackend.from_settings(settings).get_endpoints('abc').stream is None
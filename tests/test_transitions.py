@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+
+from tumtum.transitions import ChallengeStateManager
+
+
+class FakeMachine:
+    # Events just move to the state of their name, unless told to fail
+    def __init__(self):
+        self.state = None
+        self.events = []
+        self.failing = set()
+
+    async def start(self):
+        self.events.append('start')
+        self.state = 'starting'
+
+    async def position_nose(self):
+        self.events.append('position_nose')
+        if 'position_nose' in self.failing:
+            raise RuntimeError('Cannot transition')
+        self.state = 'positioning_nose'
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def machine():
+    return FakeMachine()
+
+
+def make_manager(machine, loop, debounce=0) -> ChallengeStateManager:
+    return ChallengeStateManager(machine, loop, debounce)
+
+
+def flush(loop):
+    # Transitions, and callbacks of their futures, run on the loop thread before these
+    for _i in range(3):
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(timeout=1)
+
+
+def test_trigger_notifies_listeners(machine, loop):
+    manager = make_manager(machine, loop)
+    states = []
+    manager.listeners.append(states.append)
+    manager.trigger('start')
+    flush(loop)
+    assert manager.state == 'starting'
+    assert states == ['starting']
+
+
+def test_update_on_edge_only(machine, loop):
+    manager = make_manager(machine, loop)
+    assert manager.update('position_nose', True)
+    flush(loop)
+    # Condition stays true, no more requests
+    assert not manager.update('position_nose', True)
+    assert not manager.update('position_nose', False)
+    assert machine.events == ['position_nose']
+    # Becomes true again
+    assert manager.update('position_nose', True)
+    flush(loop)
+    assert machine.events == ['position_nose', 'position_nose']
+
+
+def test_debounce(machine, loop, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('tumtum.transitions.time.monotonic', lambda: now[0])
+    manager = make_manager(machine, loop, debounce=0.5)
+    assert manager.update('position_nose', True)
+    flush(loop)
+    manager.update('position_nose', False)
+    now[0] += 0.1
+    assert not manager.update('position_nose', True)
+    now[0] += 0.5
+    # Still true, and it is let through once the debounce period is over
+    assert manager.update('position_nose', True)
+
+
+def test_retry_after_failed_transition(machine, loop):
+    machine.failing.add('position_nose')
+    manager = make_manager(machine, loop)
+    assert manager.update('position_nose', True)
+    flush(loop)
+    assert manager.state is None
+    # Condition is still true, and the transition is requested again
+    machine.failing.clear()
+    assert manager.update('position_nose', True)
+    flush(loop)
+    assert manager.state == 'positioning_nose'
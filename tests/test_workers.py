@@ -0,0 +1,40 @@
+import pytest
+
+from tumtum import workers
+from tumtum.models import DetectionSetting
+from tumtum.workers import check_engine, engine_changed
+
+
+@pytest.fixture
+def installed(monkeypatch):
+    # Pretend that every module is installed, except those put in the returned set
+    missing = set()
+    monkeypatch.setattr(workers, 'find_spec', lambda name: None if name in missing else object())
+    return missing
+
+
+def test_engine_without_model_files(installed):
+    assert check_engine(DetectionSetting(engine='dlib_hog')) == []
+
+
+def test_missing_module(installed):
+    installed.add('onnxruntime')
+    problems = check_engine(DetectionSetting(engine='onnx_landmarks', onnx_model=''))
+    assert problems == ['onnxruntime is not installed', 'onnx_model is not set']
+
+
+def test_model_files(installed, tmp_path):
+    model = tmp_path / 'face.caffemodel'
+    model.write_bytes(b'model')
+    missing = tmp_path / 'deploy.prototxt'
+    setting = DetectionSetting(engine='opencv_dnn', dnn_model=str(model), dnn_config=str(missing))
+    assert check_engine(setting) == [f'dnn_config file {missing} does not exist']
+    missing.write_text('config')
+    assert check_engine(setting) == []
+
+
+def test_engine_changed():
+    old = DetectionSetting(engine='dlib_hog')
+    assert not engine_changed(old.copy(update={'workers': old.workers + 1}), old)
+    assert engine_changed(old.copy(update={'engine': 'opencv_haar'}), old)
+    assert engine_changed(old.copy(update={'onnx_model': '/tmp/other.onnx'}), old)
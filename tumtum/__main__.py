@@ -19,7 +19,7 @@ import gettext
 from .consts import SHORT_NAME
 from .app import TumTumApplication
 from .resources import get_locale_folder
-from .logging import GLibLogHandler
+from .logging import QueuedGLibLogHandler
 
 
 def main():
@@ -27,9 +27,13 @@ def main():
     gettext.bindtextdomain(SHORT_NAME, get_locale_folder())
     locale.textdomain(SHORT_NAME)
     gettext.textdomain(SHORT_NAME)
-    with GLibLogHandler().applicationbound():
+    handler = QueuedGLibLogHandler()
+    with handler.applicationbound():
         app = TumTumApplication()
-        return app.run(sys.argv)
+        app.log_handler = handler
+        status = app.run(sys.argv)
+    handler.close()
+    return status
 
 
 if __name__ == '__main__':
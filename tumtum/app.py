@@ -14,27 +14,24 @@
 
 
 import os
-import json
+import sys
+import time
 import asyncio
 import threading
 import concurrent.futures
-from io import BytesIO
 from threading import Event
-from base64 import b64encode
 from gettext import gettext as _
-from typing import Optional, Dict, Tuple, List, Deque, Callable, Any
+from typing import Optional, Dict, List, Deque
 from collections import deque
+from functools import partial
 from asyncio import AbstractEventLoop
-from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures import Future
 
 import gi
 import orjson
-import tomlkit
 import cairo
 import logbook
 from logbook import Logger
-from PIL import Image
-from kiss_headers import BasicAuthorization
 
 gi.require_version('GLib', '2.0')
 gi.require_version('Gtk', '3.0')
@@ -43,27 +40,28 @@ gi.require_version('Gio', '2.0')
 gi.require_version('Gst', '1.0')
 gi.require_version('GstBase', '1.0')
 gi.require_version('GstApp', '1.0')
-gi.require_version('Soup', '2.4')
 gi.require_foreign('cairo')
 
-from gi.repository import GLib, Gtk, Gdk, Gio, Gst, GstBase, GstApp, Soup
+from gi.repository import GLib, Gtk, Gdk, Gio, Gst, GstBase, GstApp
 
-from .consts import APP_ID, SHORT_NAME, FPS
+from .consts import APP_ID, SHORT_NAME, FPS, STATS_INTERVAL
 from . import __version__
 from . import ui
-from .resources import get_ui_filepath, get_config_path, load_config
+from .resources import get_ui_filepath, ConfigCache
 from .prep import get_device_path
 from .states import ChallengeLifeCycle, State, Pigeon
-from .models import (
-    OverlayDrawData, ChallengeStartRequest, ChallengeInfo,
-    FrameSubmitRequest, ChallengeVerifyRequest, AppSettings,
-)
+from .transitions import ChallengeStateManager
+from .models import ChallengeInfo, AppSettings
 from .backends import Backend, AWSBackend, SSTBackend
-from .tasks import detect_face
+from .scheduler import FrameStamp
+from .metrics import StageStats
+from .overlay import OverlayPainter
+from .geometry import OverlayFrame
+from .workers import DetectionPool, check_engine
+from .session import ChallengeSession
 
 
 logger = Logger(__name__)
-Gst.init(None)
 CONTROL_MASK = Gdk.ModifierType.CONTROL_MASK
 
 # Some Gstreamer CLI examples
@@ -76,7 +74,6 @@ CONTROL_MASK = Gdk.ModifierType.CONTROL_MASK
 
 class TumTumApplication(Gtk.Application):
     SINK_NAME = 'sink'
-    APPSINK_NAME = 'app_sink'
     GST_SOURCE_NAME = 'webcam_source'
     GST_OVERLAY_NAME = 'overlay_cairo'
     window: Optional[Gtk.Window] = None
@@ -99,16 +96,26 @@ class TumTumApplication(Gtk.Application):
     infobar: Optional[Gtk.InfoBar] = None
     pigeon: Optional[Pigeon] = None
     g_event_sources: Dict[str, int] = {}
-    frame_size: Optional[Tuple[int, int]] = None
-    overlay_queue: 'Deque[OverlayDrawData]' = deque(maxlen=1)
-    challenge_info: Optional[ChallengeInfo] = None
+    overlay_queue: 'Deque[OverlayFrame]' = deque(maxlen=1)
+    # Challenge guides, prepared when challenge info comes
+    overlay_painter: Optional[OverlayPainter] = None
     flag_submit_frame = Event()
     state_machine = ChallengeLifeCycle()
-    executor = ProcessPoolExecutor()
     loop: AbstractEventLoop
-    # Save the face detectiont task (which will run in multiprocessing basis)
-    # so that we can cancel them when quitting the app.
-    detection_tasks: Dict[Future, str] = {}
+    state_manager: ChallengeStateManager
+    # Frames, face detection and backend requests of challenges, created at startup
+    session: Optional[ChallengeSession] = None
+    config = ConfigCache()
+    # Handler which the app is run with, to enable debug messages with -v
+    log_handler: Optional[logbook.Handler] = None
+    # Per-stage latency stats, only collected with --stats option
+    stats: Optional[StageStats] = None
+    # Lines of stats to show in overlay
+    stats_hud: List[str] = []
+    # Stamp of the frame whose detection result is waiting to be drawn
+    overlay_stamp: Optional[FrameStamp] = None
+    # Backends constructed from settings, by codename
+    backends: Dict[str, Backend] = {}
 
     def __init__(self, *args, **kwargs):
         super().__init__(
@@ -118,32 +125,29 @@ class TumTumApplication(Gtk.Application):
             'verbose', ord('v'), GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
             "More detailed log", None
         )
+        self.add_main_option(
+            'stats', 0, GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
+            "Collect per-stage latency, show it in overlay and dump it periodically as JSON", None
+        )
         self.loop = asyncio.get_event_loop()
-
-    # Util to run an async function in our dedicated thread for asyncio event loop.
-    def run_await(self, function, *args) -> Future:
-        return asyncio.run_coroutine_threadsafe(function(*args), self.loop)
-
-    def request_http(self, method: str, url: str, data: Dict[str, Any], callback: Callable,
-                     backend: Backend, basic_auth=()):
-        session = Soup.Session.new()
-        message = Soup.Message.new(method, url)
-        if basic_auth:
-            logger.debug('Set auth')
-            auth = BasicAuthorization(*basic_auth)
-            headers = message.get_property('request-headers')
-            headers.append('Authorization', str(auth))
-        body = orjson.dumps(data)
-        message.set_request('application/json', Soup.MemoryUse.COPY, body)
-        session.queue_message(message, callback, backend)
+        # Transitions run in our dedicated thread for asyncio event loop
+        self.state_manager = ChallengeStateManager(self.state_machine, self.loop)
+        self.state_manager.listeners.append(self.on_challenge_state_changed)
 
     def do_startup(self):
         Gtk.Application.do_startup(self)
         self.setup_actions()
-        devmonitor = Gst.DeviceMonitor.new()
-        devmonitor.add_filter('Video/Source', Gst.Caps.from_string('video/x-raw'))
-        logger.debug('Monitor: {}', devmonitor)
-        self.devmonitor = devmonitor
+        self.config.listeners.append(self.backends.clear)
+        self.config.listeners.append(self.check_detection_setting)
+        self.config.watch()
+        detection = self.config.get().detection
+        session = ChallengeSession(self.state_manager, detection)
+        session.challenge_listeners.append(self.on_challenge_retrieved)
+        session.result_listeners.append(self.on_detection_result)
+        session.error_listeners.append(partial(GLib.idle_add, self.show_detection_error))
+        session.detection_pool.listeners.append(partial(GLib.idle_add, self.on_detection_pool_ready))
+        session.detection_pool.warm_up()
+        self.session = session
         # Run asyncio in a dedicated thread
         th_loop = threading.Thread(target=run_asyncio_loop, args=(self.loop,), daemon=True)
         th_loop.start()
@@ -158,13 +162,14 @@ class TumTumApplication(Gtk.Application):
 
     def build_gstreamer_pipeline(self, src_type: str = 'v4l2src'):
         # https://gstreamer.freedesktop.org/documentation/application-development/advanced/pipeline-manipulation.html?gi-language=c#grabbing-data-with-appsink
+        # Face detection runs on downscaled frames, while full-size frames are encoded to JPEG for uploading.
+        detection_branch, upload_branch = self.session.build_branches(self.config.get(), FPS)
         # Try GL backend first
         command = (f'{src_type} name={self.GST_SOURCE_NAME} ! tee name=t ! '
                    f'queue ! videoconvert ! cairooverlay name={self.GST_OVERLAY_NAME} ! '
                    f'glsinkbin sink="gtkglsink name={self.SINK_NAME}" name=sink_bin '
-                   't. ! queue leaky=2 ! videoconvert ! '
-                   f'videorate ! video/x-raw,format=RGB,framerate={FPS}/1 ! '
-                   f'appsink name={self.APPSINK_NAME} max-buffers=1 drop=true')
+                   f't. ! {detection_branch} '
+                   f't. ! {upload_branch}')
         logger.debug('To build pipeline: {}', command)
         try:
             pipeline = Gst.parse_launch(command)
@@ -176,9 +181,8 @@ class TumTumApplication(Gtk.Application):
             # Fallback to non-GL
             command = (f'{src_type} name={self.GST_SOURCE_NAME} ! videoconvert ! tee name=t ! '
                        f'queue ! cairooverlay name={self.GST_OVERLAY_NAME} ! gtksink name={self.SINK_NAME} '
-                       't. ! queue leaky=1 max-size-buffers=2 ! '
-                       f'videorate ! video/x-raw,format=RGB,framerate={FPS}/1 ! '
-                       f'appsink name={self.APPSINK_NAME}')
+                       f't. ! {detection_branch} '
+                       f't. ! {upload_branch}')
             logger.debug('To build pipeline: {}', command)
             try:
                 pipeline = Gst.parse_launch(command)
@@ -187,9 +191,7 @@ class TumTumApplication(Gtk.Application):
                 logger.error('Failed to create Gst Pipeline. Error: {}', e)
                 return
         logger.debug('Created {}', pipeline)
-        appsink: GstApp.AppSink = pipeline.get_by_name(self.APPSINK_NAME)
-        logger.debug('Appsink: {}', appsink)
-        appsink.connect('new-sample', self.on_new_webcam_sample)
+        self.session.attach_pipeline(pipeline)
         # Ref: https://gist.github.com/pmgration/273383a6e02e961b0af06e05fbf4349f
         gst_overlay = pipeline.get_by_name(self.GST_OVERLAY_NAME)
         logger.debug('Overlay: {}', gst_overlay)
@@ -209,8 +211,6 @@ class TumTumApplication(Gtk.Application):
         self.btn_play = builder.get_object('btn-play')
         self.btn_pause = builder.get_object('btn-pause')
         self.cont_webcam = builder.get_object('cont-webcam')
-        if self.gst_pipeline:
-            self.replace_webcam_placeholder_with_gstreamer_sink()
         self.webcam_store = builder.get_object('webcam-list')
         self.webcam_combobox = builder.get_object('webcam-combobox')
         self.backend_store = builder.get_object('backend-list')
@@ -241,6 +241,10 @@ class TumTumApplication(Gtk.Application):
         }
 
     def discover_webcam(self):
+        devmonitor = Gst.DeviceMonitor.new()
+        devmonitor.add_filter('Video/Source', Gst.Caps.from_string('video/x-raw'))
+        logger.debug('Monitor: {}', devmonitor)
+        self.devmonitor = devmonitor
         bus: Gst.Bus = self.devmonitor.get_bus()
         logger.debug('Bus: {}', bus)
         bus.add_watch(GLib.PRIORITY_DEFAULT, self.on_device_monitor_message, None)
@@ -259,21 +263,37 @@ class TumTumApplication(Gtk.Application):
 
     def do_activate(self):
         if not self.window:
-            self.build_gstreamer_pipeline()
             self.window = self.build_main_window()
-            self.discover_webcam()
+            # Loading GStreamer plugins and probing webcams are slow, let the window appear first
+            GLib.idle_add(self.setup_webcam)
         self.window.present()
         logger.debug("Window {} is shown", self.window)
+
+    def setup_webcam(self):
+        # GStreamer loads its plugin registry here, not on import
+        Gst.init(None)
+        if self.build_gstreamer_pipeline():
+            self.replace_webcam_placeholder_with_gstreamer_sink()
+        self.discover_webcam()
         if not self.backend_combobox.get_active_iter():
             self.backend_combobox.set_active(0)
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
 
     def do_command_line(self, command_line: Gio.ApplicationCommandLine):
         options = command_line.get_options_dict().end().unpack()
         if options.get('verbose'):
             logger.level = logbook.DEBUG
+            if self.log_handler:
+                self.log_handler.level = logbook.DEBUG
             displayed_apps = os.getenv('G_MESSAGES_DEBUG', '').split()
             displayed_apps.append(SHORT_NAME)
             GLib.setenv('G_MESSAGES_DEBUG', ' '.join(displayed_apps), True)
+        if options.get('stats'):
+            self.stats = StageStats()
+            self.session.stats = self.stats
+            GLib.timeout_add_seconds(1, self.update_stats_hud)
+            GLib.timeout_add_seconds(STATS_INTERVAL, self.dump_stats)
         self.activate()
         return 0
 
@@ -303,43 +323,35 @@ class TumTumApplication(Gtk.Application):
     def get_active_backend(self) -> Backend:
         liter = self.backend_combobox.get_active_iter()
         name, codename = self.backend_store[liter]
-        settings = load_config()
+        try:
+            return self.backends[codename]
+        except KeyError:
+            pass
+        settings = self.config.get()
         if codename == 'aws_demo':
-            return AWSBackend.from_settings(settings.aws_demo)
-        return SSTBackend.from_settings(settings.sst)
+            backend = AWSBackend.from_settings(settings.aws_demo)
+        else:
+            backend = SSTBackend.from_settings(settings.sst)
+        self.backends[codename] = backend
+        return backend
 
     def get_challenge(self):
         logger.debug('Event loop: {}', self.loop)
-        self.run_await(self.state_machine.start, self.pigeon)
-        backend = self.get_active_backend()
-        url = backend.start_url
-        w, h = self.frame_size
-        params = ChallengeStartRequest(image_width=w, image_height=h)
-        if isinstance(backend, SSTBackend):
-            auth = (backend.username, backend.password)
-            post_data = params.request_for_sst()
-        else:
-            auth = ()
-            post_data = params.request_for_aws()
-        logger.debug('To get challenge data from {}, with {}', url, params)
-        self.request_http('POST', url, post_data, self.cb_challenge_retrieved, backend, auth)
-
-    def cb_challenge_retrieved(self, session: Soup.Session, msg: Soup.Message, backend: Backend):
-        status = msg.get_property('status-code')
-        raw_body = msg.get_property('response-body-data').get_data()
-        if status < 200 or status >= 300:
-            logger.error('Server responded error: {}', raw_body)
+        self.state_manager.trigger('start', self.pigeon)
+        self.session.get_challenge(self.get_active_backend())
+
+    def on_challenge_retrieved(self, info: Optional[ChallengeInfo]):
+        if not info:
             return
-        logger.debug('Response: {}', raw_body)
-        if not raw_body:
+        # Guide areas are the same for the whole challenge, prepare them once
+        self.overlay_painter = OverlayPainter.from_info(info)
+        self.overlay_queue.clear()
+
+    def on_detection_result(self, judged: Optional[OverlayFrame], stamp: Optional[FrameStamp]):
+        if judged is None:
             return
-        body = orjson.loads(raw_body)
-        if isinstance(backend, SSTBackend):
-            body['user_id'] = body.pop('external_person_id')
-        self.challenge_info = ChallengeInfo.parse_obj(body)
-        logger.debug('Challenge info: {}', self.challenge_info)
-        logger.debug('State: {}', self.state_machine.state)
-        self.run_await(self.state_machine.center_face)
+        self.overlay_queue.append(judged)
+        self.overlay_stamp = stamp
 
     def on_device_monitor_message(self, bus: Gst.Bus, message: Gst.Message, user_data):
         logger.debug('Message: {}', message)
@@ -385,14 +397,14 @@ class TumTumApplication(Gtk.Application):
         liter = combo.get_active_iter()
         if not liter:
             return
-        self.run_await(self.state_machine.stop)
+        self.state_manager.trigger('stop')
         model = combo.get_model()
         path, name, source_type = model[liter]
         logger.debug('Picked {} {} ({})', path, name, source_type)
-        app_sink = self.gst_pipeline.get_by_name(self.APPSINK_NAME)
-        app_sink.set_emit_signals(False)
+        self.set_appsinks_emit_signals(False)
         self.detach_gstreamer_sink_from_window()
-        self.gst_pipeline.remove(app_sink)
+        for name in (ChallengeSession.APPSINK_NAME, ChallengeSession.UPLOAD_SINK_NAME):
+            self.gst_pipeline.remove(self.gst_pipeline.get_by_name(name))
         ppl_source = self.gst_pipeline.get_by_name(self.GST_SOURCE_NAME)
         ppl_source.set_state(Gst.State.NULL)
         self.gst_pipeline.remove(ppl_source)
@@ -410,105 +422,57 @@ class TumTumApplication(Gtk.Application):
         GLib.timeout_add_seconds(3, self.start_pipeline_and_challenge)
 
     def on_backend_combobox_changed(self, combo: Gtk.ComboBox):
-        app_sink = self.gst_pipeline.get_by_name(self.APPSINK_NAME)
-        app_sink.set_emit_signals(False)
+        self.set_appsinks_emit_signals(False)
+        # Have connection ready before the challenge starts
+        self.session.get_http_client(self.get_active_backend()).warm_up()
         self.gst_pipeline.set_state(Gst.State.NULL)
-        future = self.run_await(self.state_machine.stop)
+        future = self.state_manager.trigger('stop')
         future.add_done_callback(self.start_pipeline_and_challenge)
 
     def on_overlay_caps_changed(self, _overlay: GstBase.BaseTransform, caps: Gst.Caps):
         struct: Gst.Structure = caps[0]
         width = struct['width']
         height = struct['height']
-        self.frame_size = (width, height)
-        logger.debug('Frame size: {}', self.frame_size)
+        self.session.set_frame_size((width, height))
 
     def on_overlay_draw(self, _overlay: GstBase.BaseTransform, context: cairo.Context,
-                        _timestamp: int, _duration: int, user_data: 'Deque[OverlayDrawData]'):
-        if not self.challenge_info:
+                        _timestamp: int, _duration: int, user_data: 'Deque[OverlayFrame]'):
+        if not self.stats:
+            self.draw_overlay(context, user_data)
             return
-        w = self.challenge_info.area_width
-        h = self.challenge_info.area_height
-        x = self.challenge_info.area_left
-        y = self.challenge_info.area_top
-        logger.debug('To draw area where face is expected: {}', (x, y, w, h))
-        context.rectangle(x, y, w, h)
-        color = (0.9, 0, 0, 0.6)
-        try:
-            found_face: OverlayDrawData = user_data[-1]
-            fx, fy, fw, fh = found_face.face_box
-            face_inside = (fx >= x and fy >= y and fx + fw <= x + w and fy + fh <= y + h)
-        except IndexError:
-            found_face = None
-            face_inside = False
-        if face_inside:
-            color = (0, 0.9, 0, 0.6)
-        context.set_source_rgba(*color)
-        context.set_line_width(4)
-        context.stroke()
-        if self.state_machine.state in (State.starting, State.stopped, State.success, State.failed):
+        started_at = time.monotonic()
+        stamp = self.overlay_stamp
+        if stamp:
+            self.overlay_stamp = None
+            self.stats.record('appsink_to_overlay', (started_at - stamp.arrived_at) * 1000)
+        self.draw_overlay(context, user_data)
+        self.draw_stats_hud(context)
+        self.stats.record('on_overlay_draw', (time.monotonic() - started_at) * 1000)
+
+    def draw_stats_hud(self, context: cairo.Context):
+        lines = self.stats_hud
+        if not lines:
             return
-        if self.state_machine.state == State.centering_face and face_inside:
-            self.run_await(self.state_machine.position_nose)
+        context.set_source_rgba(0, 0, 0, 0.5)
+        context.rectangle(4, 4, 300, 14 * len(lines) + 8)
+        context.fill()
+        context.select_font_face('monospace', cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+        context.set_font_size(11)
+        context.set_source_rgba(1, 1, 1, 0.9)
+        for i, line in enumerate(lines):
+            context.move_to(8, 18 + 14 * i)
+            context.show_text(line)
+
+    def draw_overlay(self, context: cairo.Context, user_data: 'Deque[OverlayFrame]'):
+        # Runs for every rendered frame, so no logging or model access here
+        painter = self.overlay_painter
+        if not painter:
             return
-        if self.state_machine.state in (State.positioning_nose, State.verifying):
-            w = self.challenge_info.nose_width
-            h = self.challenge_info.nose_height
-            x = self.challenge_info.nose_left
-            y = self.challenge_info.nose_top
-            logger.debug('To draw area where nose is expected: {}', (x, y, w, h))
-            context.rectangle(x, y, w, h)
-            color = (0.8, 0.8, 0, 0.6)
-            context.set_source_rgba(*color)
-            context.set_line_width(4)
-            context.stroke()
-            if found_face:
-                nose_tip: List[Tuple[int, int]] = found_face.nose_tip
-                first_x, first_y = nose_tip[0]
-                context.move_to(first_x, first_y)
-                context.set_source_rgba(1, 0.6, 0, 0.6)
-                context.set_line_width(2)
-                for nx, ny in nose_tip[1:]:
-                    context.line_to(nx, ny)
-                context.stroke()
-                logger.debug('Detected nose at: {}', nose_tip)
-                nose_positioned = all((x <= n_x <= x + w and y <= n_y <= y + h) for n_x, n_y in nose_tip)
-                if nose_positioned:
-                    self.run_await(self.state_machine.verify)
-
-    def on_new_webcam_sample(self, appsink: GstApp.AppSink) -> Gst.FlowReturn:
-        if appsink.is_eos():
-            return Gst.FlowReturn.OK
-        if self.state_machine.state in (None, State.starting, State.stopped):
-            return Gst.FlowReturn.OK
-        sample: Gst.Sample = appsink.try_pull_sample(0.5)
-        buffer: Gst.Buffer = sample.get_buffer()
-        caps: Gst.Caps = sample.get_caps()
-        # This Pythonic usage is thank to python3-gst
-        struct: Gst.Structure = caps[0]
-        width = struct['width']
-        height = struct['height']
-        success: bool
-        mapinfo: Gst.MapInfo
-        success, mapinfo = buffer.map(Gst.MapFlags.READ)
-        if not success:
-            logger.error('Failed to get mapinfo.')
-            return Gst.FlowReturn.ERROR
-        # In Gstreamer 1.18, Gst.MapInfo.data is memoryview instead of bytes
-        imgdata = mapinfo.data.tobytes() if isinstance(mapinfo.data, memoryview) else mapinfo.data
-        img = Image.frombytes('RGB', (width, height), imgdata)
-        if self.state_machine.state == State.positioning_nose:
-            self.submit_frame(img)
-        if self.state_machine.state == State.verifying:
-            self.verify_challenge()
-            return Gst.FlowReturn.OK
         try:
-            future = self.executor.submit(detect_face, img)
-            future.add_done_callback(self.pass_face_detection_result)
-            self.detection_tasks[future] = ''
-        except RuntimeError:
-            logger.warning('Executor is already shutdown')
-        return Gst.FlowReturn.OK
+            frame: Optional[OverlayFrame] = user_data[-1]
+        except IndexError:
+            frame = None
+        painter.paint(context, frame, self.state_manager.state in (State.positioning_nose, State.verifying))
 
     def on_evbox_playpause_enter_notify_event(self, box: Gtk.EventBox, event: Gdk.EventCrossing):
         child: Gtk.Widget = box.get_child()
@@ -532,41 +496,64 @@ class TumTumApplication(Gtk.Application):
         source = get_ui_filepath('settings.glade')
         builder: Gtk.Builder = Gtk.Builder.new_from_file(str(source))
         dlg_settings: Gtk.Dialog = builder.get_object('dlg-settings')
-        settings = load_config()
+        settings = self.config.get()
         builder.get_object('sst-username').set_text(settings.sst.username)
         builder.get_object('sst-password').set_text(settings.sst.password)
         builder.get_object('sst-base-url').set_text(settings.sst.base_url)
         builder.get_object('aws-domain').set_text(settings.aws_demo.domain)
-        response = dlg_settings.run()
-        logger.debug('Dialog result {}', response)
-        if response == Gtk.ResponseType.OK:
-            settings_data = {
-                'sst': {
-                    'base_url': builder.get_object('sst-base-url').get_text(),
-                    'username': builder.get_object('sst-username').get_text(),
-                    'password': builder.get_object('sst-password').get_text(),
-                },
-                'aws_demo': {
-                    'domain': builder.get_object('aws-domain').get_text()
-                }
-            }
+        builder.get_object('detection-engine').set_active_id(settings.detection.engine)
+        for name in ('dnn_model', 'dnn_config', 'onnx_model'):
+            path = getattr(settings.detection, name)
+            if path:
+                builder.get_object(f'detection-{name.replace("_", "-")}').set_filename(path)
+        while True:
+            response = dlg_settings.run()
+            logger.debug('Dialog result {}', response)
+            if response != Gtk.ResponseType.OK:
+                break
+            # Sections not exposed in the dialog are kept as in the file
+            settings_data = settings.dict()
+            settings_data['sst'].update({
+                'base_url': builder.get_object('sst-base-url').get_text(),
+                'username': builder.get_object('sst-username').get_text(),
+                'password': builder.get_object('sst-password').get_text(),
+            })
+            settings_data['aws_demo'].update({
+                'domain': builder.get_object('aws-domain').get_text()
+            })
+            settings_data['detection']['engine'] = builder.get_object('detection-engine').get_active_id()
+            for name in ('dnn_model', 'dnn_config', 'onnx_model'):
+                chooser: Gtk.FileChooserButton = builder.get_object(f'detection-{name.replace("_", "-")}')
+                settings_data['detection'][name] = chooser.get_filename() or ''
             settings = AppSettings.parse_obj(settings_data)
+            problems = check_engine(settings.detection)
+            if problems:
+                # Keep the dialog open, so that user can fix it or cancel
+                self.show_dialog_error(dlg_settings, _('Cannot use this face detection engine'), '\n'.join(problems))
+                continue
             logger.debug('New settings: {}', settings)
-            filepath = get_config_path()
             logger.debug('To save: {}', settings.dict())
-            filepath.write_text(tomlkit.dumps(settings.dict()))
+            # Saving calls check_detection_setting, which starts warming up the new engine
+            self.config.save(settings)
+            break
         dlg_settings.destroy()
 
+    def show_dialog_error(self, parent: Gtk.Window, title: str, message: str):
+        dialog = Gtk.MessageDialog(transient_for=parent, modal=True, message_type=Gtk.MessageType.ERROR,
+                                   buttons=Gtk.ButtonsType.CLOSE, text=title)
+        dialog.format_secondary_text(message)
+        dialog.run()
+        dialog.destroy()
+
     def play_webcam_video(self, widget: Optional[Gtk.Widget] = None):
         if not self.gst_pipeline:
             return
         to_pause = (isinstance(widget, Gtk.RadioToolButton) and not widget.get_active())
-        app_sink = self.gst_pipeline.get_by_name(self.APPSINK_NAME)
         source = self.gst_pipeline.get_by_name(self.GST_SOURCE_NAME)
         if to_pause:
             # Tell appsink to stop emitting signals
             logger.debug('Stop appsink from emitting signals')
-            app_sink.set_emit_signals(False)
+            self.set_appsinks_emit_signals(False)
             # FIXME: Change source state to Paused when the pipeline
             # has not finished setting up other elements will cause
             # pipeline being broken
@@ -576,77 +563,77 @@ class TumTumApplication(Gtk.Application):
             r = source.set_state(Gst.State.PLAYING)
             logger.debug('Change {} state to playing: {}', source.get_name(), r)
             # Delay set_emit_signals call to prevent scanning old frame
-            GLib.timeout_add_seconds(1, app_sink.set_emit_signals, True)
+            GLib.timeout_add_seconds(1, self.set_appsinks_emit_signals, True)
+
+    def set_appsinks_emit_signals(self, emit: bool):
+        for name in (ChallengeSession.APPSINK_NAME, ChallengeSession.UPLOAD_SINK_NAME):
+            app_sink: GstApp.AppSink = self.gst_pipeline.get_by_name(name)
+            app_sink.set_emit_signals(emit)
+        # This function may be passed to GLib.timeout_add_seconds, so it needs to return False to avoid repetition
+        return False
+
+    def check_detection_setting(self):
+        if not self.session:
+            return
+        new, old = self.config.get().detection, self.session.detection_pool.setting
+        # Engine and its model files are switched to by warming up a new pool
+        self.session.switch_engine(new)
+        # Number of workers and detection branch are set up with the settings at startup
+        changed = [k for k in ('workers', 'pool', 'max_in_flight') if getattr(new, k) != getattr(old, k)]
+        if changed:
+            logger.warning('Changes of detection settings {} take effect after restarting the app', changed)
+
+    def on_detection_pool_ready(self, pool: DetectionPool):
+        logger.debug('Face detection pool: {}', pool.health())
+        if pool.errors:
+            self.show_error(_('Face detection engine failed to load: {}').format(pool.errors[0]))
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def show_detection_error(self, message: str):
+        self.show_error(_('Face detection failed: {}').format(message))
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
 
     def start_pipeline_and_challenge(self, future: Optional[Future] = None):
+        pool = self.session.detection_pool
+        if not pool.ready.is_set():
+            # Challenge can go on, the first frames will just wait for the workers
+            logger.info('Face detection workers are still warming up: {}', pool.health())
         self.gst_pipeline.set_state(Gst.State.PLAYING)
-        app_sink = self.gst_pipeline.get_by_name(self.APPSINK_NAME)
-        app_sink.set_emit_signals(True)
+        self.set_appsinks_emit_signals(True)
         self.get_challenge()
         # This function may be passed to GLib.timeout_add_seconds, so it needs to return False to avoid repetition
         return False
 
-    def pass_face_detection_result(self, future: Future):
-        self.detection_tasks.pop(future, None)
-        result = future.result()
-        logger.debug('Image processing: {}', result)
-        if result:
-            self.overlay_queue.append(result)
-
-    def submit_frame(self, image: Image.Image):
-        floating_file = BytesIO()
-        image.save(floating_file, 'JPEG')
-        backend = self.get_active_backend()
-        url = backend.get_submit_frame_url(str(self.challenge_info.id))
-        # Backend accepts timestamp to microsecond
-        params = FrameSubmitRequest(
-            frame_base64=b64encode(floating_file.getvalue()),
-            token=self.challenge_info.token
-        )
-        if isinstance(backend, SSTBackend):
-            auth = (backend.username, backend.password)
-            post_data = params.request_for_sst()
-            method = 'POST'
-        else:
-            auth = ()
-            post_data = params.request_for_aws()
-            method = 'PUT'
-        logger.debug('Submit frame with fields: {}', post_data.keys())
-        self.request_http(method, url, post_data, self.cb_frame_submission_done, backend, auth)
+    def on_challenge_state_changed(self, state: Optional[State]):
+        # Called from asyncio thread. The session posts the verification itself, we just stop the webcam.
+        if state == State.verifying:
+            GLib.idle_add(self.pause_for_verification)
 
-    def cb_frame_submission_done(self, session: Soup.Session, msg: Soup.Message, backend: Backend):
-        raw_body = msg.get_property('response-body-data').get_data()
-        logger.debug('Frame submission response: {}', raw_body)
+    def update_stats_hud(self):
+        # Prepare text for the overlay here, so that draw callback doesn't have to format it
+        snapshot = self.stats.snapshot()
+        self.stats_hud = [f'{stage[:24]:<24} p50 {s["p50"]:7.1f} p95 {s["p95"]:7.1f} ms'
+                          for stage, s in snapshot.items()]
+        return True
+
+    def dump_stats(self):
+        controller = self.session.framerate_controller
+        data = {
+            'time': time.time(),
+            'stages': self.stats.snapshot(),
+            'detection_fps': controller.fps if controller else FPS,
+        }
+        data.update(self.session.component_stats())
+        sys.stdout.buffer.write(orjson.dumps(data) + b'\n')
+        sys.stdout.flush()
+        return True
 
-    def verify_challenge(self):
+    def pause_for_verification(self):
         self.btn_pause.set_active(True)
-        backend = self.get_active_backend()
-        url = backend.get_verify_url(str(self.challenge_info.id))
-        params = ChallengeVerifyRequest(token=self.challenge_info.token, debug=True)
-        logger.debug('To post to {}', url)
-        if isinstance(backend, SSTBackend):
-            auth = (backend.username, backend.password)
-            post_data = params.request_for_sst()
-        else:
-            auth = ()
-            post_data = params.request_for_aws()
-        self.request_http('POST', url, post_data,
-                          self.cb_challenge_verification_done, backend, auth)
-
-    def cb_challenge_verification_done(self, session: Soup.Session, msg: Soup.Message, backend: Backend):
-        logger.debug('Challenge verify response: {}', msg)
-        raw_body = msg.get_property('response-body-data').get_data()
-        logger.debug('Challenge verify response content: {}', raw_body)
-        err_message = ''
-        try:
-            rsp = json.loads(raw_body)
-            if rsp.get('success'):
-                self.run_await(self.state_machine.finish_success)
-                return
-            err_message = rsp.get('message')
-        except ValueError:
-            pass
-        self.run_await(self.state_machine.finish_failed, err_message)
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
 
     def show_about_dialog(self, action: Gio.SimpleAction, param: Optional[GLib.Variant] = None):
         if self.gst_pipeline:
@@ -680,12 +667,12 @@ class TumTumApplication(Gtk.Application):
         if self.gst_pipeline:
             self.gst_pipeline.set_state(Gst.State.NULL)
         # Cancel all pending face detection tasks
-        for future in self.detection_tasks:
-            future.cancel()
+        scheduler = self.session.detection_scheduler
+        scheduler.cancel_all()
         for i in range(3):
-            concurrent.futures.wait(self.detection_tasks.keys(), timeout=1)
+            concurrent.futures.wait(tuple(scheduler.in_flight), timeout=1)
             Gtk.main_iteration()
-        self.executor.shutdown(True)
+        self.session.close()
         self.loop.stop()
         super().quit()
 
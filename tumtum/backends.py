@@ -1,5 +1,7 @@
 import dataclasses
 from abc import ABCMeta, abstractmethod
+from functools import cached_property
+from typing import Optional, NamedTuple
 
 import yarl
 from logbook import Logger
@@ -9,10 +11,23 @@ from .models import AWSSetting, SSTSetting
 logger = Logger(__name__)
 
 
+class ChallengeEndpoints(NamedTuple):
+    # URLs for one challenge, resolved once when the challenge is retrieved
+    frames: str
+    verify: str
+    # WebSocket URL to stream frames to, if backend supports it
+    stream: Optional[str] = None
+
+
 class Backend(metaclass=ABCMeta):
     _start_url = 'start'
     _submit_frame_url = 'frames'
     _verify_url = 'verify'
+    # Whether frames endpoint takes raw JPEG body (with metadata in headers), instead of base64 in JSON
+    binary_frames = False
+    # Whether frames are streamed over WebSocket, see get_stream_url()
+    stream_frames = False
+    _stream_url = 'stream'
 
     @property
     @abstractmethod
@@ -27,6 +42,14 @@ class Backend(metaclass=ABCMeta):
     def get_verify_url(self, challenge_id: str) -> str:
         pass
 
+    def get_stream_url(self, challenge_id: str) -> Optional[str]:
+        return None
+
+    def get_endpoints(self, challenge_id: str) -> ChallengeEndpoints:
+        return ChallengeEndpoints(frames=self.get_submit_frame_url(challenge_id),
+                                  verify=self.get_verify_url(challenge_id),
+                                  stream=self.get_stream_url(challenge_id) if self.stream_frames else None)
+
 
 @dataclasses.dataclass
 class AWSBackend(Backend):
@@ -37,16 +60,19 @@ class AWSBackend(Backend):
     _verify_url = 'verify'
     _settings: AWSSetting = dataclasses.field(init=False)
 
-    @property
+    @cached_property
+    def base_url(self) -> yarl.URL:
+        return yarl.URL(self._base_url).with_host(self.domain)
+
+    @cached_property
     def start_url(self) -> str:
-        return str(yarl.URL(self._base_url).with_host(self.domain).join(yarl.URL(self._start_url)))
+        return str(self.base_url.join(yarl.URL(self._start_url)))
 
     def get_submit_frame_url(self, challenge_id: str) -> str:
-        url = yarl.URL(self._base_url).with_host(self.domain).join(yarl.URL(f'{challenge_id}/{self._submit_frame_url}'))
-        return str(url)
+        return str(self.base_url.join(yarl.URL(f'{challenge_id}/{self._submit_frame_url}')))
 
     def get_verify_url(self, challenge_id: str):
-        return str(yarl.URL(self._base_url).with_host(self.domain).join(yarl.URL(f'{challenge_id}/{self._verify_url}')))
+        return str(self.base_url.join(yarl.URL(f'{challenge_id}/{self._verify_url}')))
 
     @classmethod
     def from_settings(cls, settings: AWSSetting):
@@ -61,21 +87,32 @@ class SSTBackend(Backend):
     _settings: SSTSetting = dataclasses.field(init=False)
     username: str
     password: str
+    binary_frames: bool = False
+    stream_frames: bool = False
 
-    @property
+    @cached_property
+    def base_url(self) -> yarl.URL:
+        return yarl.URL(self._base_url)
+
+    @cached_property
     def start_url(self):
         logger.debug('Base URL: {}', self._base_url)
-        return str(yarl.URL(self._base_url).join(yarl.URL(self._start_url)))
+        return str(self.base_url.join(yarl.URL(self._start_url)))
 
     def get_submit_frame_url(self, challenge_id: str) -> str:
-        return str(yarl.URL(self._base_url).join(yarl.URL(f'{challenge_id}/{self._submit_frame_url}')))
+        return str(self.base_url.join(yarl.URL(f'{challenge_id}/{self._submit_frame_url}')))
 
     def get_verify_url(self, challenge_id: str) -> str:
-        return str(yarl.URL(self._base_url).join(yarl.URL(f'{challenge_id}/{self._verify_url}')))
+        return str(self.base_url.join(yarl.URL(f'{challenge_id}/{self._verify_url}')))
+
+    def get_stream_url(self, challenge_id: str) -> str:
+        url = self.base_url.join(yarl.URL(f'{challenge_id}/{self._stream_url}'))
+        return str(url.with_scheme('wss' if url.scheme == 'https' else 'ws'))
 
     @classmethod
     def from_settings(cls, settings: SSTSetting):
-        obj = cls(username=settings.username, password=settings.password)
+        obj = cls(username=settings.username, password=settings.password, binary_frames=settings.binary_frames,
+                  stream_frames=settings.stream_frames)
         obj._base_url = settings.base_url
         obj._settings = settings
         return obj
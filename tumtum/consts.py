@@ -2,6 +2,27 @@ APP_ID = 'vn.hoabinh.quan.TumTum'
 BRAND_NAME = APP_ID.split('.')[-1]
 SHORT_NAME = BRAND_NAME.lower()
 FPS = 4
+# Cap of concurrent connections to a backend host, which are kept alive and reused
+HTTP_MAX_CONNS_PER_HOST = 4
+# Seconds to keep idle connection in pool
+HTTP_IDLE_TIMEOUT = 60
+# Frames sent over WebSocket and not acknowledged yet, more are dropped
+STREAM_MAX_UNACKED = 4
+# Seconds to wait for the ack of a streamed frame, before giving it up as lost
+STREAM_ACK_TIMEOUT = 2
+# Seconds between dumps of latency stats, when enabled with --stats
+STATS_INTERVAL = 5
+# Seconds before a challenge state transition can be requested again by frame handlers
+STATE_DEBOUNCE = 0.5
+# Log records waiting to be written, more are dropped
+LOG_QUEUE_SIZE = 1000
+# Debug messages from one call site are limited to LOG_RATE_BURST in each LOG_RATE_INTERVAL seconds
+LOG_RATE_INTERVAL = 1
+LOG_RATE_BURST = 2
+# Seconds between adjustments of face detection frame rate, when detection.adaptive_fps is on
+FPS_ADJUST_INTERVAL = 2
+# Fraction of estimated detection capacity to use as frame rate
+FPS_HEADROOM = 0.8
 BACKENDS = {
     'aws_demo': {
         'base_url': 'https://69hes0gg2k.execute-api.ap-southeast-1.amazonaws.com/Prod/challenge/',
@@ -0,0 +1,86 @@
+from typing import Optional, Tuple
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+from logbook import Logger
+
+from .models import Rectangle, ChallengeInfo, UploadSetting
+from .geometry import expand_box, align_crop, fit_dimension
+from .ptsmap import PtsMap
+
+
+logger = Logger(__name__)
+
+
+class UploadCropper:
+    '''
+    Crop and scale down frames to upload, by videocrop and videoscale elements in the upload branch.
+
+    Frame handlers set the region to crop. It is applied to the elements in a pad probe before videocrop,
+    in the streaming thread of the upload branch, so the region which each frame is cropped with is known
+    and can be sent along with it.
+    '''
+
+    def __init__(self, setting: UploadSetting):
+        self.setting = setting
+        self.frame_size: Optional[Tuple[int, int]] = None
+        # Region to crop from now on. None for whole frame.
+        self.target: Optional[Rectangle] = None
+        self.applied: Optional[Rectangle] = None
+        self.videocrop: Optional[Gst.Element] = None
+        self.capsfilter: Optional[Gst.Element] = None
+        # Region which frames are cropped with, by PTS
+        self.crops: PtsMap[Rectangle] = PtsMap()
+
+    @property
+    def active(self) -> bool:
+        return self.setting.mode != 'full' or bool(self.setting.max_dimension)
+
+    def attach(self, videocrop: Optional[Gst.Element], capsfilter: Optional[Gst.Element]):
+        self.videocrop = videocrop
+        self.capsfilter = capsfilter
+        self.applied = None
+        self.crops.clear()
+
+    def reset(self, info: Optional[ChallengeInfo] = None):
+        # In "face" mode, challenge area is used until a face is found
+        self.target = None
+        if info and self.frame_size and self.setting.mode in ('face', 'area'):
+            area = Rectangle(info.area_left, info.area_top, info.area_width, info.area_height)
+            self.target = align_crop(area, self.frame_size)
+
+    def set_face(self, box: Optional[Rectangle]):
+        if self.setting.mode != 'face' or not box or not self.frame_size:
+            return
+        self.target = align_crop(expand_box(box, self.setting.face_margin), self.frame_size)
+
+    def on_buffer_probe(self, pad: Gst.Pad, info: Gst.PadProbeInfo):
+        if not self.frame_size:
+            return Gst.PadProbeReturn.OK
+        width, height = self.frame_size
+        rect = self.target or Rectangle(0, 0, width, height)
+        if rect != self.applied:
+            self.apply(rect)
+        buffer: Gst.Buffer = info.get_buffer()
+        self.crops.put(buffer.pts, rect)
+        return Gst.PadProbeReturn.OK
+
+    def apply(self, rect: Rectangle):
+        width, height = self.frame_size
+        x, y, w, h = rect
+        if self.videocrop:
+            self.videocrop.set_property('left', x)
+            self.videocrop.set_property('top', y)
+            self.videocrop.set_property('right', width - x - w)
+            self.videocrop.set_property('bottom', height - y - h)
+        if self.capsfilter:
+            out_w, out_h = fit_dimension((w, h), self.setting.max_dimension)
+            caps = Gst.Caps.from_string(f'video/x-raw,width={out_w},height={out_h},pixel-aspect-ratio=1/1')
+            self.capsfilter.set_property('caps', caps)
+        logger.debug('Crop frames to upload: {}', rect)
+        self.applied = rect
+
+    def pop_crop(self, pts: int) -> Optional[Rectangle]:
+        return self.crops.pop(pts)
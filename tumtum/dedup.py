@@ -0,0 +1,98 @@
+import time
+from threading import Lock
+from collections import deque
+from typing import Optional, Tuple, Deque, Dict, NamedTuple, Any
+
+from logbook import Logger
+
+from .models import CompactDrawData
+
+
+logger = Logger(__name__)
+# Signature is sampled on a grid of this many columns and rows
+SIGNATURE_GRID = (32, 24)
+
+
+def frame_signature(data: memoryview, shape: Tuple[int, ...], stride: int = 0,
+                    grid: Tuple[int, int] = SIGNATURE_GRID) -> bytes:
+    # Downsample the frame, by picking pixels on a coarse grid, straight from the mapped buffer.
+    # Only the first channel is taken, which is enough to tell if the scene changes.
+    # Stride is bytes per row, if rows are padded.
+    height, width = shape[:2]
+    channels = shape[2] if len(shape) > 2 else 1
+    data = memoryview(data).cast('B')
+    column_count, row_count = grid
+    step_x = max(width // column_count, 1) * channels
+    step_y = max(height // row_count, 1)
+    row_size = width * channels
+    stride = max(stride, row_size)
+    ys = range(step_y // 2, height, step_y)
+    return b''.join(data[y * stride:y * stride + row_size:step_x].tobytes() for y in ys)
+
+
+def signature_distance(a: bytes, b: bytes) -> float:
+    # Mean absolute difference of sampled pixels, 0-255
+    if len(a) != len(b):
+        return 255
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a) if a else 0
+
+
+class CachedDetection(NamedTuple):
+    signature: bytes
+    # What inspect_frame() returned for the frame
+    result: Optional[CompactDrawData]
+    quality: Any
+    created_at: float
+
+
+class DetectionCache:
+    '''
+    Keep detection results of recent frames, to reuse for frames which are nearly the same,
+    like when the user holds still, instead of sending them to detection workers.
+
+    It holds at most ``size`` entries, each of them is dropped after ``max_age`` seconds,
+    so that a slowly changing scene still gets detected again.
+    '''
+
+    def __init__(self, threshold: float, max_age: float, size: int):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.entries: Deque[CachedDetection] = deque(maxlen=size)
+        self.lookups = 0
+        self.hits = 0
+        self.expired = 0
+        self._lock = Lock()
+
+    def lookup(self, signature: bytes, with_quality: bool = False) -> Optional[CachedDetection]:
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            while self.entries and now - self.entries[0].created_at > self.max_age:
+                self.entries.popleft()
+                self.expired += 1
+            # Newest first
+            for entry in reversed(self.entries):
+                if with_quality and entry.quality is None:
+                    continue
+                if signature_distance(signature, entry.signature) <= self.threshold:
+                    self.hits += 1
+                    return entry
+        return None
+
+    def add(self, signature: bytes, result: Optional[CompactDrawData], quality: Any = None):
+        with self._lock:
+            self.entries.append(CachedDetection(signature, result, quality, time.monotonic()))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0,
+                'expired': self.expired,
+                'size': len(self.entries),
+            }
@@ -0,0 +1,305 @@
+import threading
+from abc import ABCMeta, abstractmethod
+from importlib import import_module
+from typing import Optional, Dict, Tuple, List, Sequence, Type, Callable, Any
+
+import numpy as np
+from logbook import Logger
+
+from .models import CompactDrawData, DetectionSetting
+
+
+logger = Logger(__name__)
+# (left, top, right, bottom), in frame coordinates
+Box = Tuple[int, int, int, int]
+# (x, y, width, height)
+Window = Tuple[int, int, int, int]
+Points = Tuple[Tuple[int, int], ...]
+# Nose points in the 68-point landmark model, as face_recognition.face_landmarks() picks
+NOSE_BRIDGE = range(27, 31)
+NOSE_TIP = range(31, 36)
+# Confidence under which OpenCV DNN detections are ignored
+DNN_MIN_CONFIDENCE = 0.5
+# Shared by all engines in this process, see get_shape_predictor()
+_shape_predictor = None
+_shape_predictor_lock = threading.Lock()
+
+
+def import_optional(module: str, package: str) -> Any:
+    try:
+        return import_module(module)
+    except ImportError as e:
+        raise ImportError(f'This face detection engine needs {package} to be installed') from e
+
+
+def largest(boxes: Sequence[Box]) -> Box:
+    return max(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+
+
+class Detector(metaclass=ABCMeta):
+    '''
+    Face detection engine. It finds the largest face and its nose points in a frame,
+    which is a grayscale (height, width) or RGB (height, width, 3) array.
+
+    One instance is shared by all detection threads of a process. Models which are safe to call concurrently
+    are loaded once, the others are created for each thread with get_thread_local().
+    '''
+
+    def __init__(self, setting: DetectionSetting):
+        self.setting = setting
+        self._local = threading.local()
+
+    def get_thread_local(self, factory: Callable[[], Any]) -> Any:
+        try:
+            return self._local.model
+        except AttributeError:
+            pass
+        model = factory()
+        self._local.model = model
+        return model
+
+    def warm_up(self):
+        # Load all models now, not when the first frame, or the first face, comes.
+        # Models which are created for each thread are only loaded for the calling thread.
+        self.load_landmarks()
+        self.load_thread_model()
+
+    def load_landmarks(self):
+        # Load the model which locate_nose() uses, if it is not loaded in __init__
+        pass
+
+    def load_thread_model(self) -> Any:
+        # Return the model of the calling thread, see get_thread_local()
+        pass
+
+    @abstractmethod
+    def find_faces(self, nimp: np.ndarray) -> List[Tuple[Box, float]]:
+        # Return face boxes with their confidence scores
+        pass
+
+    @abstractmethod
+    def locate_nose(self, nimp: np.ndarray, box: Box) -> Tuple[Points, Points]:
+        # Return nose bridge and nose tip points
+        pass
+
+    def find_face(self, nimp: np.ndarray, window: Optional[Window] = None, min_score: float = 0) -> Optional[Box]:
+        # If window is given, search for face in it first, and only fall back to full frame
+        # when the face is not found there with enough confidence.
+        if window:
+            x, y, w, h = window
+            crop = np.ascontiguousarray(nimp[y:y + h, x:x + w])
+            candidates = [b for b, s in self.find_faces(crop) if s >= min_score]
+            if candidates:
+                le, t, r, b = largest(candidates)
+                return (le + x, t + y, r + x, b + y)
+            logger.debug('Lost track of face in {}', window)
+        faces = self.find_faces(nimp)
+        if not faces:
+            return None
+        return largest([b for b, _s in faces])
+
+    def detect(self, nimp: np.ndarray, window: Optional[Window] = None,
+               min_score: float = 0) -> Optional[CompactDrawData]:
+        box = self.find_face(nimp, window, min_score)
+        logger.debug('Face: {}', box)
+        if box is None:
+            return None
+        nose_bridge, nose_tip = self.locate_nose(nimp, box)
+        # Detected box may exceed the image bounds
+        height, width = nimp.shape[:2]
+        left, top = max(box[0], 0), max(box[1], 0)
+        right, bottom = min(box[2], width), min(box[3], height)
+        return (left, top, right - left, bottom - top), nose_bridge, nose_tip
+
+
+def get_shape_predictor():
+    # dlib 68-point shape predictor, from the model file shipped by face_recognition_models.
+    # It is the biggest model we have, the same for all engines, and is safe to be called from many threads,
+    # so the process has only one, created by the first thread which asks for it.
+    global _shape_predictor
+    if _shape_predictor is not None:
+        return _shape_predictor
+    with _shape_predictor_lock:
+        if _shape_predictor is None:
+            import dlib
+            import face_recognition_models
+            _shape_predictor = dlib.shape_predictor(face_recognition_models.pose_predictor_model_location())
+    return _shape_predictor
+
+
+class DlibLandmarksMixin:
+    # Locate nose with dlib shape predictor. We load only this model, not all of those
+    # which face_recognition loads on import. The predictor is fed with the detected face, so no detector runs again.
+
+    def load_landmarks(self):
+        get_shape_predictor()
+
+    def locate_nose(self, nimp: np.ndarray, box: Box) -> Tuple[Points, Points]:
+        import dlib
+        shape = get_shape_predictor()(nimp, dlib.rectangle(*(int(v) for v in box)))
+        nose_bridge = tuple((shape.part(i).x, shape.part(i).y) for i in NOSE_BRIDGE)
+        nose_tip = tuple((shape.part(i).x, shape.part(i).y) for i in NOSE_TIP)
+        return nose_bridge, nose_tip
+
+
+class DlibHogDetector(DlibLandmarksMixin, Detector):
+    def __init__(self, setting: DetectionSetting, upsample: int = 1):
+        super().__init__(setting)
+        import dlib
+        # Same model as face_recognition's face_detector. It is built-in and small, but its scanner
+        # is not safe for concurrent use, so each thread has its own.
+        self.create_face_detector = dlib.get_frontal_face_detector
+        self.upsample = upsample
+
+    def load_thread_model(self):
+        return self.get_thread_local(self.create_face_detector)
+
+    def find_faces(self, nimp: np.ndarray) -> List[Tuple[Box, float]]:
+        face_detector = self.load_thread_model()
+        rects, scores, _idx = face_detector.run(nimp, self.upsample, 0)
+        return [((r.left(), r.top(), r.right(), r.bottom()), s) for r, s in zip(rects, scores)]
+
+
+class OpenCVHaarDetector(DlibLandmarksMixin, Detector):
+    def __init__(self, setting: DetectionSetting):
+        super().__init__(setting)
+        self.cv2 = import_optional('cv2', 'opencv-python')
+        # Make sure the cascade can be loaded, before any frame comes
+        self.load_thread_model()
+
+    def load_classifier(self):
+        cv2 = self.cv2
+        return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def load_thread_model(self):
+        return self.get_thread_local(self.load_classifier)
+
+    def find_faces(self, nimp: np.ndarray) -> List[Tuple[Box, float]]:
+        cv2 = self.cv2
+        gray = nimp if nimp.ndim == 2 else cv2.cvtColor(nimp, cv2.COLOR_RGB2GRAY)
+        classifier = self.load_thread_model()
+        rects, _levels, weights = classifier.detectMultiScale3(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40), outputRejectLevels=True
+        )
+        return [((int(x), int(y), int(x + w), int(y + h)), float(s))
+                for (x, y, w, h), s in zip(rects, np.ravel(weights))]
+
+
+class OpenCVDNNDetector(DlibLandmarksMixin, Detector):
+    # OpenCV's ResNet-10 SSD face detector, from Caffe model files given in settings:
+    # res10_300x300_ssd_iter_140000.caffemodel and deploy.prototxt
+    def __init__(self, setting: DetectionSetting):
+        super().__init__(setting)
+        if not setting.dnn_model or not setting.dnn_config:
+            raise ValueError('opencv_dnn engine needs dnn_model and dnn_config in detection settings')
+        self.cv2 = import_optional('cv2', 'opencv-python')
+        self.load_thread_model()
+
+    def load_net(self):
+        # cv2.dnn.Net keeps its input and buffers, so it cannot be shared between threads
+        return self.cv2.dnn.readNetFromCaffe(self.setting.dnn_config, self.setting.dnn_model)
+
+    def load_thread_model(self):
+        return self.get_thread_local(self.load_net)
+
+    def find_faces(self, nimp: np.ndarray) -> List[Tuple[Box, float]]:
+        cv2 = self.cv2
+        height, width = nimp.shape[:2]
+        bgr = cv2.cvtColor(nimp, cv2.COLOR_GRAY2BGR if nimp.ndim == 2 else cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        net = self.load_thread_model()
+        net.setInput(blob)
+        # Output shape is (1, 1, N, 7), each detection is (_, _, confidence, left, top, right, bottom)
+        detections = net.forward()[0, 0]
+        faces = []
+        for det in detections[detections[:, 2] >= DNN_MIN_CONFIDENCE]:
+            le, t, r, b = (det[3:7] * (width, height, width, height)).astype(int)
+            faces.append(((int(le), int(t), int(r), int(b)), float(det[2])))
+        return faces
+
+
+class OnnxLandmarksDetector(OpenCVHaarDetector):
+    # Faces are found by Haar cascade, nose by a 68-point landmark ONNX model (PFLD-like),
+    # which takes a square RGB face crop, NCHW float in 0..1, and outputs 68 normalized (x, y) pairs.
+    def __init__(self, setting: DetectionSetting):
+        super().__init__(setting)
+        if not setting.onnx_model:
+            raise ValueError('onnx_landmarks engine needs onnx_model in detection settings')
+        ort = import_optional('onnxruntime', 'onnxruntime')
+        # InferenceSession.run() is safe to call concurrently
+        self.session = ort.InferenceSession(setting.onnx_model, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        size = model_input.shape[-1]
+        self.input_size = size if isinstance(size, int) else 112
+
+    def load_landmarks(self):
+        # The ONNX session is loaded in __init__, and dlib shape predictor is not used
+        pass
+
+    def locate_nose(self, nimp: np.ndarray, box: Box) -> Tuple[Points, Points]:
+        cv2 = self.cv2
+        height, width = nimp.shape[:2]
+        le, t, r, b = box
+        # Square crop around the face box
+        side = max(r - le, b - t)
+        cx, cy = (le + r) // 2, (t + b) // 2
+        x0, y0 = max(cx - side // 2, 0), max(cy - side // 2, 0)
+        x1, y1 = min(x0 + side, width), min(y0 + side, height)
+        crop = nimp[y0:y1, x0:x1]
+        if crop.ndim == 2:
+            crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2RGB)
+        crop = cv2.resize(crop, (self.input_size, self.input_size))
+        blob = (crop.astype(np.float32) / 255).transpose(2, 0, 1)[np.newaxis]
+        output = self.session.run(None, {self.input_name: blob})[0]
+        points = output.reshape(-1, 2) * (x1 - x0, y1 - y0) + (x0, y0)
+        nose_bridge = tuple((int(points[i, 0]), int(points[i, 1])) for i in NOSE_BRIDGE)
+        nose_tip = tuple((int(points[i, 0]), int(points[i, 1])) for i in NOSE_TIP)
+        return nose_bridge, nose_tip
+
+
+DETECTORS: Dict[str, Type[Detector]] = {
+    'dlib_hog': DlibHogDetector,
+    'opencv_haar': OpenCVHaarDetector,
+    'opencv_dnn': OpenCVDNNDetector,
+    'onnx_landmarks': OnnxLandmarksDetector,
+}
+# Engines which have been created in this process, by name and the settings they are created with
+_detectors: Dict[Tuple[str, ...], Detector] = {}
+_detectors_lock = threading.Lock()
+# Settings which workers of this process are started with
+_default_setting: Optional[DetectionSetting] = None
+
+
+def set_default_setting(setting: Optional[DetectionSetting]):
+    global _default_setting
+    _default_setting = setting
+
+
+def detector_key(name: str, setting: DetectionSetting) -> Tuple[str, ...]:
+    # Only model files change what an engine loads
+    return (name, setting.dnn_model, setting.dnn_config, setting.onnx_model)
+
+
+def get_detector(name: Optional[str] = None, setting: Optional[DetectionSetting] = None) -> Detector:
+    # Without name, the engine of the settings is used
+    if setting is None:
+        setting = _default_setting
+    if setting is None:
+        from .resources import load_config
+        setting = load_config().detection
+        set_default_setting(setting)
+    name = name or setting.engine
+    key = detector_key(name, setting)
+    try:
+        return _detectors[key]
+    except KeyError:
+        pass
+    # Detection threads may ask for the engine at the same time, it should only be created once
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is None:
+            logger.debug('Create face detection engine {}', key)
+            detector = DETECTORS[name](setting)
+            _detectors[key] = detector
+    return detector
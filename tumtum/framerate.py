@@ -0,0 +1,75 @@
+import time
+import statistics
+from threading import Lock
+from typing import Optional, List, Dict, Any
+
+from logbook import Logger
+
+from .consts import FPS_ADJUST_INTERVAL, FPS_HEADROOM
+
+
+logger = Logger(__name__)
+
+
+class FrameRateController:
+    '''
+    Adapt frame rate of face detection branch to how fast this machine runs detection.
+
+    Every interval, it estimates how many frames per second the workers can take, from median detection latency,
+    and moves the frame rate toward that, with some headroom. Frame rate goes up one step at a time,
+    and goes down right away when workers are saturated (frames are dropped because all of them are busy).
+    '''
+
+    def __init__(self, fps: int, min_fps: int, max_fps: int, workers: int,
+                 interval: float = FPS_ADJUST_INTERVAL, headroom: float = FPS_HEADROOM):
+        self.min_fps = min_fps
+        self.max_fps = max(max_fps, min_fps)
+        self.fps = self.clamp(fps)
+        self.workers = workers
+        self.interval = interval
+        self.headroom = headroom
+        # Detection latencies in current window, in milliseconds
+        self.latencies: List[float] = []
+        self.in_flight_sum = 0
+        self.last_dropped_busy = 0
+        self.started_at = self.window_started_at = time.monotonic()
+        self.changes: List[Dict[str, Any]] = []
+        self._lock = Lock()
+
+    def clamp(self, fps: int) -> int:
+        return min(max(fps, self.min_fps), self.max_fps)
+
+    def record(self, latency_ms: float, in_flight: int):
+        with self._lock:
+            self.latencies.append(latency_ms)
+            self.in_flight_sum += in_flight
+
+    def update(self, dropped_busy: int) -> Optional[int]:
+        # Call with the scheduler's count of frames dropped because workers are busy.
+        # Return new frame rate if it should change.
+        now = time.monotonic()
+        with self._lock:
+            if now - self.window_started_at < self.interval or not self.latencies:
+                return None
+            latency = statistics.median(self.latencies)
+            queue_depth = self.in_flight_sum / len(self.latencies)
+            saturated = dropped_busy > self.last_dropped_busy
+            self.latencies = []
+            self.in_flight_sum = 0
+            self.last_dropped_busy = dropped_busy
+            self.window_started_at = now
+            capacity = self.workers * 1000 / latency if latency else self.max_fps
+            target = int(capacity * self.headroom)
+            if saturated:
+                target = min(target, self.fps - 1)
+            else:
+                target = min(target, self.fps + 1)
+            target = self.clamp(target)
+            if target == self.fps:
+                return None
+            old_fps, self.fps = self.fps, target
+            self.changes.append({'seconds': now - self.started_at, 'fps': target,
+                                 'latency_ms': latency, 'queue_depth': queue_depth})
+        logger.info('Detection frame rate {} -> {} fps (median latency {:.1f} ms, queue depth {:.2f}, saturated: {})',
+                    old_fps, target, latency, queue_depth, saturated)
+        return target
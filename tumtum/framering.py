@@ -0,0 +1,116 @@
+from collections import deque
+from threading import Lock
+from typing import Optional, Tuple, NamedTuple, Deque, Union
+from multiprocessing.shared_memory import SharedMemory
+
+from logbook import Logger
+
+
+logger = Logger(__name__)
+
+
+class FrameRef(NamedTuple):
+    # Name of the shared memory block
+    ring: str
+    slot: int
+    slot_size: int
+    # Numpy-style shape, (height, width, channels)
+    shape: Tuple[int, ...]
+    # Bytes per row, if rows are padded. 0 for packed rows.
+    stride: int = 0
+
+    @property
+    def offset(self) -> int:
+        return self.slot * self.slot_size
+
+    @property
+    def row_size(self) -> int:
+        size = 1
+        for d in self.shape[1:]:
+            size *= d
+        return size
+
+    @property
+    def padded(self) -> bool:
+        return self.stride > self.row_size
+
+    @property
+    def nbytes(self) -> int:
+        return (self.stride if self.padded else self.row_size) * self.shape[0]
+
+
+class FrameRing:
+    '''
+    Fixed number of preallocated frame slots in shared memory.
+
+    A video frame is copied into a free slot once, then only a light FrameRef
+    is sent to face detection workers, instead of pickling the whole image.
+    The slot must be released when the worker is done with it.
+
+    A ring which is replaced (frame size is changed) is retired: it is closed and unlinked
+    only when the last slot in use is released, because workers may not have attached to it yet.
+    '''
+
+    def __init__(self, slot_count: int, slot_size: int):
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.shm = SharedMemory(create=True, size=slot_count * slot_size)
+        self._free: Deque[int] = deque(range(slot_count))
+        self.retired = False
+        self.closed = False
+        self._lock = Lock()
+        logger.debug('Created frame ring {} with {} slots of {} bytes', self.name, slot_count, slot_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def idle(self) -> bool:
+        return len(self._free) == self.slot_count
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.slot_size
+
+    def write(self, data: Union[bytes, memoryview], shape: Tuple[int, ...], stride: int = 0) -> Optional[FrameRef]:
+        view = memoryview(data).cast('B')
+        nbytes = view.nbytes
+        if nbytes > self.slot_size:
+            raise ValueError(f'Frame of {nbytes} bytes does not fit slot of {self.slot_size} bytes')
+        with self._lock:
+            if not self._free:
+                return None
+            slot = self._free.popleft()
+        offset = slot * self.slot_size
+        self.shm.buf[offset:offset + nbytes] = view
+        return FrameRef(self.name, slot, self.slot_size, shape, stride)
+
+    def view(self, ref: FrameRef) -> memoryview:
+        return self.shm.buf[ref.offset:ref.offset + ref.nbytes]
+
+    def release(self, ref: FrameRef):
+        if ref.ring != self.name:
+            # The frame was from a ring which has been replaced
+            return
+        with self._lock:
+            self._free.append(ref.slot)
+            to_close = self.retired and self.idle
+        if to_close:
+            self.close()
+
+    def retire(self):
+        # No more frames are written, close when in-flight frames are released
+        with self._lock:
+            self.retired = True
+            to_close = self.idle
+        if to_close:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.shm.close()
+        self.shm.unlink()
+        logger.debug('Closed frame ring {}', self.name)
@@ -0,0 +1,74 @@
+from typing import Tuple, Sequence, NamedTuple
+
+from .models import Rectangle, ChallengeInfo, OverlayDrawData
+
+
+# Crop region is snapped to this grid, so that it doesn't change, and renegotiate caps, for every little move
+CROP_ALIGN = 16
+
+
+def expand_box(box: Rectangle, margin: float) -> Rectangle:
+    x, y, w, h = box
+    mx, my = round(w * margin), round(h * margin)
+    return Rectangle(x - mx, y - my, w + 2 * mx, h + 2 * my)
+
+
+def align_crop(rect: Rectangle, frame_size: Tuple[int, int], align: int = CROP_ALIGN) -> Rectangle:
+    # Grow the region outward to the grid, then clamp it inside the frame
+    width, height = frame_size
+    x, y, w, h = rect
+    left = max(x // align * align, 0)
+    top = max(y // align * align, 0)
+    right = min(-(-(x + w) // align) * align, width)
+    bottom = min(-(-(y + h) // align) * align, height)
+    # Keep even size for JPEG chroma subsampling
+    return Rectangle(left, top, max((right - left) // 2 * 2, 2), max((bottom - top) // 2 * 2, 2))
+
+
+def fit_dimension(size: Tuple[int, int], max_dimension: int) -> Tuple[int, int]:
+    w, h = size
+    if not max_dimension or max(w, h) <= max_dimension:
+        return size
+    ratio = max_dimension / max(w, h)
+    return max(round(w * ratio) // 2 * 2, 2), max(round(h * ratio) // 2 * 2, 2)
+
+
+class OverlayFrame(NamedTuple):
+    # Detection result, with the checks against challenge areas done beforehand
+    nose_tip: Tuple[Tuple[int, int], ...]
+    face_inside: bool
+    nose_positioned: bool
+
+
+class ChallengeGeometry:
+    '''
+    Challenge areas, taken from ChallengeInfo once, as plain bounds to check detection results against.
+    '''
+    __slots__ = ('face_area', 'nose_area', '_face_bounds', '_nose_bounds')
+
+    def __init__(self, face_area: Rectangle, nose_area: Rectangle):
+        self.face_area = face_area
+        self.nose_area = nose_area
+        x, y, w, h = face_area
+        self._face_bounds = (x, y, x + w, y + h)
+        x, y, w, h = nose_area
+        self._nose_bounds = (x, y, x + w, y + h)
+
+    @classmethod
+    def from_info(cls, info: ChallengeInfo) -> 'ChallengeGeometry':
+        return cls(Rectangle(info.area_left, info.area_top, info.area_width, info.area_height),
+                   Rectangle(info.nose_left, info.nose_top, info.nose_width, info.nose_height))
+
+    def is_face_inside(self, box: Rectangle) -> bool:
+        left, top, right, bottom = self._face_bounds
+        fx, fy, fw, fh = box
+        return fx >= left and fy >= top and fx + fw <= right and fy + fh <= bottom
+
+    def is_nose_positioned(self, nose_tip: Sequence[Tuple[int, int]]) -> bool:
+        left, top, right, bottom = self._nose_bounds
+        return all((left <= nx <= right and top <= ny <= bottom) for nx, ny in nose_tip)
+
+    def judge(self, data: OverlayDrawData) -> OverlayFrame:
+        nose_tip = tuple(data.nose_tip)
+        face_inside = data.face_box is not None and self.is_face_inside(data.face_box)
+        return OverlayFrame(nose_tip, face_inside, bool(nose_tip) and self.is_nose_positioned(nose_tip))
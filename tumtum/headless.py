@@ -0,0 +1,244 @@
+# Copyright © 2020, Nguyễn Hồng Quân <ng.hong.quan@gmail.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Run a full liveness challenge without webcam and display, by replaying a recorded video.
+It is for benchmarking face detection and frame submission on CI machines.
+
+Examples:
+
+    tumtum-replay recorded.webm
+    tumtum-replay "frames/%04d.jpg" --backend aws_demo
+    tumtum-replay videotestsrc:ball --timeout 10
+'''
+
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, Any
+
+import gi
+import orjson
+import logbook
+from logbook import Logger, StderrHandler
+
+gi.require_version('GLib', '2.0')
+gi.require_version('Gst', '1.0')
+
+from gi.repository import GLib, Gst
+
+from .consts import FPS
+from .resources import load_config
+from .prep import get_replay_source, build_replay_source
+from .states import ChallengeLifeCycle, Pigeon
+from .transitions import ChallengeStateManager
+from .models import ChallengeInfo, AppSettings
+from .backends import Backend, AWSBackend, SSTBackend
+from .metrics import StageStats
+from .session import ChallengeSession
+
+
+logger = Logger(__name__)
+
+# Stages recorded by ChallengeSession, by the name used in report
+REPORT_STAGES = {
+    'detection': 'detect_face',
+    'start': 'challenge_start',
+    'frames': 'cb_frame_submission_done',
+    'verify': 'challenge_verify',
+}
+
+
+class ReplayRunner:
+    '''
+    Drive ChallengeLifeCycle like TumTumApplication does, but from a replayed video and without GTK widgets.
+    '''
+    SOURCE_NAME = 'replay_source'
+    TEE_NAME = 't'
+    gst_pipeline: Optional[Gst.Pipeline] = None
+    challenge_started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result = 'incomplete'
+
+    def __init__(self, location: str, backend: Backend, settings: AppSettings,
+                 fps: int = FPS, source_fps: int = 30, timeout: int = 0):
+        self.location = location
+        self.backend = backend
+        self.settings = settings
+        self.fps = fps
+        self.source_fps = source_fps
+        self.timeout = timeout
+        self.main_loop = GLib.MainLoop()
+        self.loop = asyncio.new_event_loop()
+        self.state_machine = ChallengeLifeCycle()
+        self.state_manager = ChallengeStateManager(self.state_machine, self.loop)
+        self.pigeon = Pigeon()
+        self.pigeon.connect('user-message', self.on_state_message)
+        self.session = ChallengeSession(self.state_manager, settings.detection)
+        # Latencies are what we report
+        self.session.stats = StageStats()
+        self.session.challenge_listeners.append(self.on_challenge_retrieved)
+        self.session.verification_listeners.append(self.on_challenge_verified)
+        self.started_at = time.monotonic()
+
+    def build_pipeline(self) -> Optional[Gst.Pipeline]:
+        path, src_type = get_replay_source(self.location)
+        source = build_replay_source(src_type, path, self.SOURCE_NAME, self.source_fps)
+        detection_branch, upload_branch = self.session.build_branches(self.settings, self.fps)
+        command = (f'{source} ! tee name={self.TEE_NAME} '
+                   f'{self.TEE_NAME}. ! {detection_branch} '
+                   f'{self.TEE_NAME}. ! {upload_branch}')
+        logger.debug('To build pipeline: {}', command)
+        try:
+            pipeline = Gst.parse_launch(command)
+        except GLib.Error as e:
+            logger.error('Failed to create Gst Pipeline. Error: {}', e)
+            return None
+        self.session.attach_pipeline(pipeline)
+        for name in (ChallengeSession.APPSINK_NAME, ChallengeSession.UPLOAD_SINK_NAME):
+            pipeline.get_by_name(name).set_emit_signals(True)
+        # Frames entering the tee have the original size, which challenge is based on
+        tee_pad: Gst.Pad = pipeline.get_by_name(self.TEE_NAME).get_static_pad('sink')
+        tee_pad.connect('notify::caps', self.on_source_caps_changed)
+        bus: Gst.Bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message', self.on_bus_message)
+        self.gst_pipeline = pipeline
+        return pipeline
+
+    def run(self) -> Optional[Dict[str, Any]]:
+        pipeline = self.build_pipeline()
+        if not pipeline:
+            return None
+        # Model loading is not part of what we measure
+        pool = self.session.detection_pool
+        pool.warm_up()
+        if not pool.wait_ready():
+            logger.error('Face detection workers are not healthy: {}', pool.errors)
+            pool.shutdown(True)
+            return None
+        th_loop = threading.Thread(target=self.loop.run_forever, daemon=True)
+        th_loop.start()
+        self.state_manager.trigger('start', self.pigeon)
+        if self.timeout:
+            GLib.timeout_add_seconds(self.timeout, self.on_timeout)
+        self.started_at = time.monotonic()
+        pipeline.set_state(Gst.State.PLAYING)
+        self.main_loop.run()
+        pipeline.set_state(Gst.State.NULL)
+        self.session.detection_scheduler.cancel_all()
+        self.session.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        return self.report()
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+        self.main_loop.quit()
+        # This function may be passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def on_timeout(self):
+        logger.warning('Challenge is not finished after {} seconds', self.timeout)
+        return self.finish()
+
+    def on_bus_message(self, bus: Gst.Bus, message: Gst.Message):
+        if message.type == Gst.MessageType.EOS:
+            logger.info('End of replayed video')
+            self.finish()
+        elif message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            logger.error('Pipeline error: {} ({})', err, debug)
+            self.finish()
+
+    def on_state_message(self, instance: Pigeon, message: str, mtype):
+        logger.info('[{}] {}', self.state_manager.state, message)
+
+    def on_source_caps_changed(self, pad: Gst.Pad, _pspec):
+        caps: Optional[Gst.Caps] = pad.get_current_caps()
+        if not caps or self.session.frame_size:
+            return
+        struct: Gst.Structure = caps[0]
+        self.session.set_frame_size((struct['width'], struct['height']))
+        GLib.idle_add(self.session.get_challenge, self.backend)
+
+    def on_challenge_retrieved(self, info: Optional[ChallengeInfo]):
+        if not info:
+            self.result = 'error'
+            self.finish()
+            return
+        self.challenge_started_at = time.monotonic()
+
+    def on_challenge_verified(self, success: bool, err_message: str, future: Future):
+        self.result = 'success' if success else 'failed'
+        future.add_done_callback(lambda f: GLib.idle_add(self.finish))
+
+    def report(self) -> Dict[str, Any]:
+        finished_at = self.finished_at or time.monotonic()
+        elapsed = finished_at - self.started_at
+        session = self.session
+        components = session.component_stats()
+        stages = session.stats.snapshot()
+        controller = session.framerate_controller
+        return {
+            'source': self.location,
+            'backend': type(self.backend).__name__,
+            'result': self.result,
+            'elapsed_seconds': elapsed,
+            'challenge_seconds': (finished_at - self.challenge_started_at) if self.challenge_started_at else None,
+            'frames_received': session.frames_received,
+            'frames_submitted': session.frames_submitted,
+            'jpeg_bytes_per_frame': (session.bytes_submitted / session.frames_submitted
+                                     if session.frames_submitted else 0),
+            'detection_pool': session.detection_pool.health(),
+            'detection_fps': components['detection']['accepted'] / elapsed if elapsed else 0,
+            **components,
+            'framerate_changes': controller.changes if controller else [],
+            'latency_ms': {k: stages.get(stage, {'count': 0}) for k, stage in REPORT_STAGES.items()},
+            'stages': stages,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tumtum-replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Video file, image sequence pattern (with %%d), or videotestsrc[:pattern]')
+    parser.add_argument('-b', '--backend', choices=('sst', 'aws_demo'), default='sst')
+    parser.add_argument('--fps', type=int, default=FPS,
+                        help='Frame rate for upload, and initial one for face detection')
+    parser.add_argument('--source-fps', type=int, default=30, help='Frame rate of image sequence and test video')
+    parser.add_argument('-t', '--timeout', type=int, default=60, help='Seconds to give up, 0 for no limit')
+    parser.add_argument('-v', '--verbose', action='store_true', help='More detailed log')
+    args = parser.parse_args()
+    Gst.init(None)
+    settings = load_config()
+    if args.backend == 'aws_demo':
+        backend = AWSBackend.from_settings(settings.aws_demo)
+    else:
+        backend = SSTBackend.from_settings(settings.sst)
+    level = logbook.DEBUG if args.verbose else logbook.INFO
+    with StderrHandler(level=level).applicationbound():
+        runner = ReplayRunner(args.source, backend, settings, args.fps, args.source_fps, args.timeout)
+        report = runner.run()
+    if report is None:
+        return 2
+    sys.stdout.buffer.write(orjson.dumps(report, option=orjson.OPT_INDENT_2) + b'\n')
+    return 0 if report['result'] == 'success' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
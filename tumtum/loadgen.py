@@ -0,0 +1,216 @@
+'''
+Load generator for SST liveness backend. It runs many synthetic challenge sessions concurrently,
+each does: start, submit frames, verify, then reports throughput and latency of each endpoint.
+
+    python3 -m tumtum.mockserver --latency 30 &
+    python3 -m tumtum.loadgen --url http://localhost:8000 --sessions 500 --concurrency 200
+
+It has its own minimal HTTP/1.1 client, to keep the overhead on the generating side low.
+It only speaks plain HTTP, and only reads responses with Content-Length (not chunked).
+'''
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from base64 import b64encode
+from typing import Optional, Dict, List, Any, Tuple, Union
+
+import yarl
+import orjson
+from kiss_headers import BasicAuthorization
+
+from .models import ChallengeStartRequest, FrameSubmitRequest, ChallengeVerifyRequest, SSTSetting
+from .backends import SSTBackend
+from .metrics import summarize
+from .mockserver import read_http_message, build_http_message
+
+
+ENDPOINTS = ('start', 'frames', 'verify')
+
+
+class Connection:
+    '''
+    Keep-alive HTTP/1.1 connection, with just enough features to talk to a JSON API.
+    No TLS, and responses must have Content-Length, not chunked transfer encoding.
+    '''
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+
+    def __init__(self, host: str, port: int, auth_header: str = ''):
+        self.host = host
+        self.port = port
+        self.auth_header = auth_header
+
+    async def post(self, url: yarl.URL, data: Union[Dict[str, Any], bytes]) -> Tuple[int, bytes]:
+        # Bytes are sent as JPEG body, others as JSON
+        if not self.writer:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        is_binary = isinstance(data, bytes)
+        headers = {'Host': f'{self.host}:{self.port}',
+                   'Content-Type': 'image/jpeg' if is_binary else 'application/json'}
+        if self.auth_header:
+            headers['Authorization'] = self.auth_header
+        body = data if is_binary else orjson.dumps(data)
+        self.writer.write(build_http_message(f'POST {url.raw_path_qs} HTTP/1.1', headers, body))
+        await self.writer.drain()
+        response = await read_http_message(self.reader)
+        if not response:
+            await self.close()
+            raise ConnectionError('Server closed connection')
+        if 'chunked' in response.headers.get('transfer-encoding', '').lower():
+            await self.close()
+            raise ValueError(f'Server at {self.host}:{self.port} sent a chunked response, which is not supported')
+        if not response.keep_alive:
+            await self.close()
+        status = int(response.start_line.split(' ', 2)[1])
+        return status, response.body
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadGenerator:
+    def __init__(self, backend: SSTBackend, sessions: int, concurrency: int, frames: int,
+                 frame_data: bytes, frame_interval: float = 0):
+        self.backend = backend
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.frames = frames
+        self.frame_data = frame_data
+        self.frame_base64 = b64encode(frame_data).decode()
+        # Seconds to wait between frames, to imitate webcam frame rate
+        self.frame_interval = frame_interval
+        # Latencies of successful requests, in milliseconds. Failed ones are only counted in errors.
+        self.latencies: Dict[str, List[float]] = {e: [] for e in ENDPOINTS}
+        self.errors: Dict[str, int] = {e: 0 for e in ENDPOINTS}
+        self.completed = 0
+        self.verified = 0
+        url = yarl.URL(backend.start_url)
+        if url.scheme != 'http':
+            raise ValueError(f'Only http:// URLs are supported, not {url.scheme}://')
+        self.host = url.host
+        self.port = url.port
+        self.auth_header = str(BasicAuthorization(backend.username, backend.password)) if backend.username else ''
+
+    async def timed_post(self, conn: Connection, endpoint: str, url: str,
+                         data: Union[Dict[str, Any], bytes]) -> Optional[Dict[str, Any]]:
+        started_at = time.perf_counter()
+        try:
+            status, body = await conn.post(yarl.URL(url), data)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            self.errors[endpoint] += 1
+            return None
+        latency = (time.perf_counter() - started_at) * 1000
+        if status < 200 or status >= 300:
+            self.errors[endpoint] += 1
+            return None
+        try:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(latency)
+        return data
+
+    async def run_session(self, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            conn = Connection(self.host, self.port, self.auth_header)
+            try:
+                await self.run_challenge(conn)
+            finally:
+                await conn.close()
+
+    async def run_challenge(self, conn: Connection):
+        params = ChallengeStartRequest(image_width=640, image_height=480)
+        info = await self.timed_post(conn, 'start', self.backend.start_url, params.request_for_sst())
+        if not info:
+            return
+        endpoints = self.backend.get_endpoints(info['id'])
+        for _i in range(self.frames):
+            if self.backend.binary_frames:
+                await self.timed_post(conn, 'frames', endpoints.frames, self.frame_data)
+            else:
+                frame = FrameSubmitRequest(frame_base64=self.frame_base64)
+                await self.timed_post(conn, 'frames', endpoints.frames, frame.request_for_sst())
+            if self.frame_interval:
+                await asyncio.sleep(self.frame_interval)
+        result = await self.timed_post(conn, 'verify', endpoints.verify,
+                                       ChallengeVerifyRequest(debug=True).request_for_sst())
+        self.completed += 1
+        if result and result.get('success'):
+            self.verified += 1
+
+    async def run(self) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started_at = time.perf_counter()
+        await asyncio.gather(*(self.run_session(semaphore) for _i in range(self.sessions)))
+        elapsed = time.perf_counter() - started_at
+        requests = sum(len(v) for v in self.latencies.values()) + sum(self.errors.values())
+        return {
+            'sessions': self.sessions,
+            'concurrency': self.concurrency,
+            'completed': self.completed,
+            'verified': self.verified,
+            'elapsed_seconds': elapsed,
+            'sessions_per_second': self.completed / elapsed,
+            'requests_per_second': requests / elapsed,
+            'errors': self.errors,
+            'latency_ms': {e: summarize(v) for e, v in self.latencies.items()},
+        }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['completed']}/{report['sessions']} sessions completed ({report['verified']} verified) "
+          f"in {report['elapsed_seconds']:.2f}s, concurrency {report['concurrency']}")
+    print(f"Throughput: {report['sessions_per_second']:.1f} sessions/s, "
+          f"{report['requests_per_second']:.1f} requests/s")
+    print(f"{'endpoint':>8} {'count':>7} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for endpoint, s in report['latency_ms'].items():
+        if not s['count']:
+            print(f"{endpoint:>8} {0:>7} {report['errors'][endpoint]:>7}")
+            continue
+        print(f"{endpoint:>8} {s['count']:>7} {report['errors'][endpoint]:>7} "
+              f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f} {s['max']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tumtum-loadgen', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000', help='Base URL of SST backend')
+    parser.add_argument('--username', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('-n', '--sessions', type=int, default=100, help='Number of challenge sessions')
+    parser.add_argument('-c', '--concurrency', type=int, default=100, help='Sessions running at the same time')
+    parser.add_argument('-f', '--frames', type=int, default=10, help='Frames to submit in each session')
+    parser.add_argument('--frame', help='JPEG file to submit. Random bytes are used if not given')
+    parser.add_argument('--frame-size', type=int, default=30000, help='Size of random frame, in bytes')
+    parser.add_argument('--frame-interval', type=float, default=0, help='Seconds between frames of a session')
+    parser.add_argument('--binary', action='store_true', help='Send frames as JPEG body, not as base64 in JSON')
+    parser.add_argument('--json', action='store_true', help='Print report as JSON')
+    args = parser.parse_args()
+    settings = SSTSetting(username=args.username, password=args.password, base_url=args.url,
+                          binary_frames=args.binary)
+    backend = SSTBackend.from_settings(settings)
+    if args.frame:
+        with open(args.frame, 'rb') as f:
+            frame_data = f.read()
+    else:
+        frame_data = os.urandom(args.frame_size)
+    try:
+        generator = LoadGenerator(backend, args.sessions, args.concurrency, args.frames, frame_data,
+                                  args.frame_interval)
+        report = asyncio.run(generator.run())
+    except ValueError as e:
+        parser.exit(2, f'{parser.prog}: error: {e}\n')
+    if args.json:
+        sys.stdout.buffer.write(orjson.dumps(report, option=orjson.OPT_INDENT_2) + b'\n')
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,15 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import queue
+from threading import Thread, Lock
+from typing import Optional, Tuple
+
 import gi
 import logbook
+from logbook import LogRecord
 from logbook.handlers import Handler, StringFormatterHandlerMixin
 
 gi.require_version('GLib', '2.0')
 
 from gi.repository import GLib
 
-from .consts import SHORT_NAME
+from .consts import SHORT_NAME, LOG_QUEUE_SIZE
+from .ratelimit import CallSiteRateLimiter
 
 
 LOGBOOK_LEVEL_TO_GLIB = {
@@ -47,3 +54,75 @@ class GLibLogHandler(Handler, StringFormatterHandlerMixin):
         message = self.format(record)
         level = LOGBOOK_LEVEL_TO_GLIB[record.level]
         _log(level, message)
+
+
+class QueuedGLibLogHandler(GLibLogHandler):
+    '''
+    GLib log handler which does not block the logging thread, like GStreamer streaming thread or draw callback:
+
+    - Level is checked before the record is initialized. Debug messages cost nothing when not enabled.
+    - Debug messages are rate-limited for each call site, so per-frame messages don't flood.
+    - Formatting and passing to GLib happen in a background thread. Message arguments are formatted there,
+      so they should not be mutated after logging.
+    - Forked processes (like detection workers) get a new queue and writer thread, because the thread
+      is not copied by fork, and locks may have been taken by other threads at that time.
+    '''
+
+    def __init__(self, level=logbook.INFO, maxsize: int = LOG_QUEUE_SIZE,
+                 limiter: Optional[CallSiteRateLimiter] = None, **kwargs):
+        super().__init__(level=level, **kwargs)
+        self.queue: 'queue.Queue[Optional[Tuple[LogRecord, int]]]' = queue.Queue(maxsize)
+        self.limiter = limiter or CallSiteRateLimiter()
+        # Messages dropped because the queue is full. Logging threads count, the writer thread resets.
+        self.dropped = 0
+        self._dropped_lock = Lock()
+        self.thread = Thread(target=self.write_records, name='log-writer', daemon=True)
+        self.thread.start()
+        os.register_at_fork(after_in_child=self.restart_after_fork)
+
+    def restart_after_fork(self):
+        # Records still in the queue are the parent's to write
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.dropped = 0
+        self._dropped_lock = Lock()
+        self.limiter.reset_after_fork()
+        self.thread = Thread(target=self.write_records, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def should_handle(self, record: LogRecord) -> bool:
+        if record.level < self.level:
+            return False
+        return record.level > logbook.DEBUG or self.limiter.allow(record)
+
+    def emit(self, record: LogRecord):
+        if record.exc_info:
+            # Traceback is only available until the record is closed
+            record.pull_information()
+        suppressed = self.limiter.pop_suppressed(record) if record.level == logbook.DEBUG else 0
+        try:
+            self.queue.put_nowait((record, suppressed))
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def write_records(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            record, suppressed = item
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                _log(GLib.LogLevelFlags.LEVEL_WARNING, f'{dropped} log messages are dropped')
+            message = self.format(record)
+            if suppressed:
+                message = f'{message} ({suppressed} similar messages suppressed)'
+            _log(LOGBOOK_LEVEL_TO_GLIB.get(record.level, GLib.LogLevelFlags.LEVEL_CRITICAL), message)
+
+    def close(self):
+        # Write the remaining records and stop the writer thread
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
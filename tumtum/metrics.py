@@ -0,0 +1,86 @@
+import math
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from typing import Sequence, Dict, Deque, Any
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    # Nearest-rank percentile, q is from 0 to 100
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, float]:
+    # Summary of latencies, in the same unit as input
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'max': ordered[-1],
+    }
+
+
+class Histogram:
+    # Upper bounds of buckets, in milliseconds. The last bucket is for anything bigger.
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    # Number of recent samples to compute percentiles from
+    RECENT = 512
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=self.RECENT)
+
+    def add(self, value: float):
+        self.buckets[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.recent.append(value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+        labels = [f'<={b}' for b in self.BOUNDS] + [f'>{self.BOUNDS[-1]}']
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else math.nan,
+            'max': self.max,
+            'p50': percentile(recent, 50),
+            'p95': percentile(recent, 95),
+            'p99': percentile(recent, 99),
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class StageStats:
+    '''
+    Latency histograms of processing stages, in milliseconds. Stages are recorded from different threads.
+    '''
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = Lock()
+
+    def record(self, stage: str, value: float):
+        with self._lock:
+            try:
+                histogram = self.histograms[stage]
+            except KeyError:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.add(value)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: h.to_dict() for stage, h in self.histograms.items()}
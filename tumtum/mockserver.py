@@ -0,0 +1,367 @@
+'''
+Local stand-in for SST liveness backend, to test and load-test TumTum without a real server.
+
+It implements the start, frames and verify endpoints which SSTBackend calls,
+under any path prefix, with configurable latency and error injection.
+Frames are accepted as base64 in JSON, as raw JPEG body with --binary, and over WebSocket at <challenge id>/stream,
+where each frame is acknowledged with a JSON text message:
+
+    python3 -m tumtum.mockserver --port 8000 --latency 50 --jitter 20 --error-rate 0.01 --binary
+'''
+
+import struct
+import random
+import hashlib
+import asyncio
+import argparse
+import binascii
+from base64 import b64decode, b64encode
+from uuid import uuid4
+from asyncio import StreamReader, StreamWriter
+from typing import Optional, Dict, Tuple, Any
+
+import orjson
+import logbook
+from logbook import Logger, StderrHandler
+from kiss_headers import BasicAuthorization
+
+from .models import CROP_HEADERS, unpack_stream_frame
+
+
+logger = Logger(__name__)
+REASONS = {
+    101: 'Switching Protocols',
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    415: 'Unsupported Media Type',
+    500: 'Internal Server Error',
+}
+
+
+class HttpMessage:
+    def __init__(self, start_line: str, headers: Dict[str, str], body: bytes):
+        self.start_line = start_line
+        # Header names are lower-cased
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get('connection', '').lower() != 'close'
+
+
+async def read_http_message(reader: StreamReader) -> Optional[HttpMessage]:
+    # Read one HTTP/1.1 request or response, with body of Content-Length. Return None when connection is closed.
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _sep, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return HttpMessage(lines[0], headers, body)
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT = 0x1
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+
+def unmask(payload: bytes, mask: bytes) -> bytes:
+    # XOR as big integers, much faster than byte by byte for frames of tens of kB
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+
+async def read_ws_message(reader: StreamReader) -> Tuple[int, bytes]:
+    # Read one WebSocket message from client, joining fragments. Control frames are returned as they come.
+    opcode = 0
+    chunks = []
+    while True:
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await reader.readexactly(8))
+        mask = await reader.readexactly(4) if second & 0x80 else b''
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = unmask(payload, mask)
+        frame_opcode = first & 0x0F
+        if frame_opcode >= WS_CLOSE:
+            return frame_opcode, payload
+        # Continuation frames have opcode 0
+        opcode = opcode or frame_opcode
+        chunks.append(payload)
+        if first & 0x80:
+            return opcode, b''.join(chunks)
+
+
+def build_ws_frame(opcode: int, payload: bytes) -> bytes:
+    # Server frames are not masked
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return head + payload
+
+
+def build_http_message(start_line: str, headers: Dict[str, str], body: bytes = b'') -> bytes:
+    lines = [start_line]
+    lines.extend(f'{k}: {v}' for k, v in headers.items())
+    lines.append(f'Content-Length: {len(body)}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class ChallengeRecord:
+    def __init__(self, image_width: int, image_height: int):
+        self.frames = 0
+        self.binary_frames = 0
+        self.bytes_received = 0
+        self.image_width = image_width
+        self.image_height = image_height
+
+
+class MockLivenessServer:
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0,
+                 username: str = '', password: str = '', binary_frames: bool = False):
+        # Latency and jitter are in milliseconds
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.username = username
+        self.password = password
+        # Take frames as raw JPEG body, like a server which SSTSetting.binary_frames is turned on for
+        self.binary_frames = binary_frames
+        self.challenges: Dict[str, ChallengeRecord] = {}
+        self.request_count = 0
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info('Mock liveness server listens on {}:{}', host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader: StreamReader, writer: StreamWriter):
+        try:
+            while True:
+                request = await read_http_message(reader)
+                if not request:
+                    break
+                if request.headers.get('upgrade', '').lower() == 'websocket':
+                    await self.handle_websocket(request, reader, writer)
+                    break
+                status, data = await self.handle_request(request)
+                body = orjson.dumps(data)
+                writer.write(build_http_message(f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+                                                {'Content-Type': 'application/json'}, body))
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_websocket(self, request: HttpMessage, reader: StreamReader, writer: StreamWriter):
+        _method, path, _version = request.start_line.split(' ', 2)
+        parts = path.split('?')[0].strip('/').split('/')
+        status, message = 101, ''
+        if self.username and not self.is_authorized(request):
+            status, message = 401, 'Unauthorized'
+        elif len(parts) < 2 or parts[-1] != 'stream' or parts[-2] not in self.challenges:
+            status, message = 404, f'No stream at {path}'
+        elif 'sec-websocket-key' not in request.headers:
+            status, message = 400, 'Sec-WebSocket-Key is missing'
+        if status != 101:
+            body = orjson.dumps({'message': message})
+            writer.write(build_http_message(f'HTTP/1.1 {status} {REASONS[status]}',
+                                            {'Content-Type': 'application/json', 'Connection': 'close'}, body))
+            await writer.drain()
+            return
+        key = request.headers['sec-websocket-key'] + WEBSOCKET_GUID
+        accept = b64encode(hashlib.sha1(key.encode()).digest()).decode()
+        # No Content-Length for 101 response
+        head = (f'HTTP/1.1 101 {REASONS[101]}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                f'Sec-WebSocket-Accept: {accept}\r\n\r\n')
+        writer.write(head.encode('latin-1'))
+        await writer.drain()
+        challenge_id = parts[-2]
+        logger.debug('Frame stream of challenge {} is open', challenge_id)
+        try:
+            while True:
+                opcode, payload = await read_ws_message(reader)
+                if opcode == WS_CLOSE:
+                    writer.write(build_ws_frame(WS_CLOSE, payload[:2]))
+                    await writer.drain()
+                    break
+                if opcode == WS_PING:
+                    writer.write(build_ws_frame(WS_PONG, payload))
+                elif opcode == WS_BINARY:
+                    reply = await self.receive_streamed_frame(challenge_id, payload)
+                    writer.write(build_ws_frame(WS_TEXT, orjson.dumps(reply)))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        logger.debug('Frame stream of challenge {} is closed', challenge_id)
+
+    async def receive_streamed_frame(self, challenge_id: str, payload: bytes) -> Dict[str, Any]:
+        self.request_count += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        try:
+            seq, _crop, frame = unpack_stream_frame(payload)
+        except struct.error:
+            return {'type': 'error', 'message': 'Message is too short'}
+        record = self.challenges.get(challenge_id)
+        if not record:
+            return {'type': 'error', 'seq': seq, 'message': 'Challenge not found'}
+        if self.error_rate and random.random() < self.error_rate:
+            return {'type': 'error', 'seq': seq, 'message': 'Injected error'}
+        record.frames += 1
+        record.bytes_received += len(frame)
+        # Verification progress, as frames taken so far
+        return {'type': 'ack', 'seq': seq, 'frames': record.frames}
+
+    async def handle_request(self, request: HttpMessage) -> Tuple[int, Any]:
+        self.request_count += 1
+        method, path, _version = request.start_line.split(' ', 2)
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {'message': 'Injected error'}
+        if self.username and not self.is_authorized(request):
+            return 401, {'message': 'Unauthorized'}
+        if method != 'POST':
+            return 405, {'message': f'{method} is not allowed'}
+        parts = path.split('?')[0].strip('/').split('/')
+        if request.headers.get('content-type', '').startswith('image/jpeg'):
+            if not self.binary_frames:
+                return 415, {'message': 'Frames must be base64 in JSON, unless --binary is given'}
+            if len(parts) >= 2 and parts[-1] == 'frames':
+                return self.receive_binary_frame(parts[-2], request)
+            return 400, {'message': 'Only frames endpoint takes image body'}
+        try:
+            data = orjson.loads(request.body) if request.body else {}
+        except orjson.JSONDecodeError:
+            return 400, {'message': 'Invalid JSON'}
+        if parts[-1] == 'start':
+            return self.start_challenge(data)
+        if len(parts) >= 2 and parts[-1] == 'frames':
+            return self.receive_frame(parts[-2], data)
+        if len(parts) >= 2 and parts[-1] == 'verify':
+            return self.verify_challenge(parts[-2])
+        return 404, {'message': f'No endpoint at {path}'}
+
+    def is_authorized(self, request: HttpMessage) -> bool:
+        expected = str(BasicAuthorization(self.username, self.password))
+        return request.headers.get('authorization') == expected
+
+    def start_challenge(self, data: Dict[str, Any]) -> Tuple[int, Any]:
+        try:
+            width = int(data['image_width'])
+            height = int(data['image_height'])
+        except (KeyError, TypeError, ValueError):
+            return 400, {'message': 'image_width and image_height are required'}
+        challenge_id = str(uuid4())
+        self.challenges[challenge_id] = ChallengeRecord(width, height)
+        # Face area in the middle, nose area somewhere inside it
+        area_width, area_height = width * 6 // 10, height * 8 // 10
+        area_left, area_top = (width - area_width) // 2, (height - area_height) // 2
+        nose_width, nose_height = width // 10, height // 10
+        nose_left = random.randint(area_left, area_left + area_width - nose_width)
+        nose_top = random.randint(area_top, area_top + area_height - nose_height)
+        return 200, {
+            'id': challenge_id,
+            'external_person_id': data.get('external_person_id') or str(uuid4()),
+            'image_width': width,
+            'image_height': height,
+            'area_left': area_left,
+            'area_top': area_top,
+            'area_width': area_width,
+            'area_height': area_height,
+            'min_face_area_percent': 50,
+            'nose_left': nose_left,
+            'nose_top': nose_top,
+            'nose_width': nose_width,
+            'nose_height': nose_height,
+        }
+
+    def receive_frame(self, challenge_id: str, data: Dict[str, Any]) -> Tuple[int, Any]:
+        record = self.challenges.get(challenge_id)
+        if not record:
+            return 404, {'message': 'Challenge not found'}
+        try:
+            frame = b64decode(data['content'], validate=True)
+        except (KeyError, TypeError, binascii.Error):
+            return 400, {'message': 'Frame content is missing or not base64'}
+        record.frames += 1
+        record.bytes_received += len(frame)
+        return 200, {}
+
+    def receive_binary_frame(self, challenge_id: str, request: HttpMessage) -> Tuple[int, Any]:
+        record = self.challenges.get(challenge_id)
+        if not record:
+            return 404, {'message': 'Challenge not found'}
+        if not request.body:
+            return 400, {'message': 'Frame content is missing'}
+        crop = [request.headers.get(name.lower()) for name in CROP_HEADERS]
+        if any(crop) and not all(v and v.isdigit() for v in crop):
+            return 400, {'message': f'Crop headers must be all given, as integers: {", ".join(CROP_HEADERS)}'}
+        record.frames += 1
+        record.binary_frames += 1
+        record.bytes_received += len(request.body)
+        return 200, {}
+
+    def verify_challenge(self, challenge_id: str) -> Tuple[int, Any]:
+        record = self.challenges.pop(challenge_id, None)
+        if not record:
+            return 404, {'message': 'Challenge not found'}
+        if not record.frames:
+            return 200, {'success': False, 'message': 'No frame is received'}
+        return 200, {'success': True, 'frames': record.frames}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tumtum-mockserver', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Added latency for each request, in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='Random variation of latency, in ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='Ratio of requests to fail with 500, 0..1')
+    parser.add_argument('--username', default='', help='Require Basic authentication')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--binary', action='store_true', help='Also take frames as raw JPEG body')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    server = MockLivenessServer(args.latency, args.jitter, args.error_rate, args.username, args.password,
+                                args.binary)
+    with StderrHandler(level=logbook.DEBUG if args.verbose else logbook.INFO).applicationbound():
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
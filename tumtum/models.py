@@ -1,7 +1,8 @@
+import struct
 from datetime import datetime
 from uuid import uuid4, UUID
 from dataclasses import field
-from typing import Optional, NamedTuple, List, Tuple, Dict, Any
+from typing import Optional, NamedTuple, List, Tuple, Dict, Any, Literal
 
 from pydantic import BaseModel, Field, AnyHttpUrl
 from pydantic.dataclasses import dataclass
@@ -20,6 +21,25 @@ class OverlayDrawData:
     nose_bridge: List[Tuple[int, int]] = field(default_factory=list)
     nose_tip: List[Tuple[int, int]] = field(default_factory=list)
 
+    @classmethod
+    def from_compact(cls, data: 'CompactDrawData', scale: Tuple[float, float] = (1, 1)) -> 'OverlayDrawData':
+        # Scale is to map coordinates from detection frame to overlay frame
+        box, nose_bridge, nose_tip = data
+        sx, sy = scale
+        if sx == 1 and sy == 1:
+            return cls(face_box=Rectangle(*box), nose_bridge=list(nose_bridge), nose_tip=list(nose_tip))
+        x, y, w, h = box
+        return cls(
+            face_box=Rectangle(round(x * sx), round(y * sy), round(w * sx), round(h * sy)),
+            nose_bridge=[(round(px * sx), round(py * sy)) for px, py in nose_bridge],
+            nose_tip=[(round(px * sx), round(py * sy)) for px, py in nose_tip],
+        )
+
+
+# Plain-tuple form of OverlayDrawData, which is cheap to pickle when passed back from detection workers:
+# ((x, y, width, height), nose_bridge, nose_tip)
+CompactDrawData = Tuple[Tuple[int, int, int, int], Tuple[Tuple[int, int], ...], Tuple[Tuple[int, int], ...]]
+
 
 def to_camel(string: str) -> str:
     parts = string.split('_')
@@ -81,18 +101,52 @@ class FrameSubmitRequest(APIRequestMixin, BaseModel):
     frame_base64: str
     timestamp: int = Field(default_factory=timestamp_ms_now)
     token: Optional[str] = None
+    # Region of camera frame which the image is cropped from, only sent when upload is cropped or scaled.
+    # Image may be smaller than the region, if it is scaled down to UploadSetting.max_dimension.
+    crop_left: Optional[int] = None
+    crop_top: Optional[int] = None
+    crop_width: Optional[int] = None
+    crop_height: Optional[int] = None
 
     class Config:
         alias_generator = to_camel
         allow_population_by_field_name = True
 
+    def set_crop(self, crop: Optional[Rectangle]):
+        if crop:
+            self.crop_left, self.crop_top, self.crop_width, self.crop_height = crop
+
     def request_for_sst(self) -> Dict[str, Any]:
-        data = self.dict()
+        data = self.dict(exclude={'timestamp', 'token'}, exclude_none=True)
         data['content'] = data.pop('frame_base64')
-        del data['timestamp']
-        del data['token']
         return data
 
+    def request_for_aws(self) -> Dict[str, Any]:
+        crop_fields = {'crop_left', 'crop_top', 'crop_width', 'crop_height'}
+        return self.dict(by_alias=True, exclude=crop_fields if self.crop_left is None else None)
+
+
+# For backends which take raw JPEG body, crop region (see FrameSubmitRequest) is sent in these headers
+CROP_HEADERS = ('X-Crop-Left', 'X-Crop-Top', 'X-Crop-Width', 'X-Crop-Height')
+
+
+def build_frame_headers(crop: Optional[Rectangle]) -> Dict[str, str]:
+    return dict(zip(CROP_HEADERS, map(str, crop))) if crop else {}
+
+
+# Binary WebSocket message of frame streaming: sequence number, crop region (all 0 if not cropped), then JPEG data
+STREAM_FRAME_HEADER = struct.Struct('!I4I')
+
+
+def pack_stream_frame(seq: int, jpeg_data: bytes, crop: Optional[Rectangle] = None) -> bytes:
+    return STREAM_FRAME_HEADER.pack(seq, *(crop or (0, 0, 0, 0))) + jpeg_data
+
+
+def unpack_stream_frame(data: bytes) -> Tuple[int, Optional[Rectangle], bytes]:
+    # Raise struct.error if the message is too short
+    seq, *crop = STREAM_FRAME_HEADER.unpack_from(data)
+    return seq, Rectangle(*crop) if any(crop) else None, data[STREAM_FRAME_HEADER.size:]
+
 
 class ChallengeVerifyRequest(APIRequestMixin, BaseModel):
     token: Optional[str] = None
@@ -103,12 +157,84 @@ class SSTSetting(BaseModel):
     username: str
     password: str
     base_url: AnyHttpUrl = 'http://localhost:8000'
+    # Send frames as raw JPEG body, instead of base64 in JSON. Only for servers which take it.
+    binary_frames: bool = False
+    # Push frames over one WebSocket per challenge, instead of one HTTP request for each frame
+    stream_frames: bool = False
 
 
 class AWSSetting(BaseModel):
     domain: str
 
 
+class DetectionSetting(BaseModel):
+    # Width of frames fed to face detection, height is scaled to keep aspect ratio. 0 to keep webcam size.
+    width: int = Field(320, ge=0)
+    grayscale: bool = True
+    # Maximum number of frames being processed at the same time. Newer frames are dropped when reached.
+    max_in_flight: int = Field(2, ge=1)
+    # Number of detection workers. 0 to have one for each frame in flight.
+    workers: int = Field(0, ge=0)
+    # Run workers as processes, or as threads which share one copy of the models
+    pool: Literal['process', 'thread'] = 'process'
+    # Search for face around the last found one, before scanning full frame
+    tracking: bool = True
+    # How much to expand the last face box, on each side, relative to its size
+    tracking_margin: float = Field(0.5, ge=0)
+    # Detection score under which the face is considered lost
+    tracking_min_score: float = 0.3
+    # Face detection engine, see detectors.DETECTORS
+    engine: Literal['dlib_hog', 'opencv_haar', 'opencv_dnn', 'onnx_landmarks'] = 'dlib_hog'
+    # Model files for opencv_dnn engine: Caffe weights (.caffemodel) and network definition (.prototxt)
+    dnn_model: str = ''
+    dnn_config: str = ''
+    # 68-point landmark model for onnx_landmarks engine
+    onnx_model: str = ''
+    # Follow how fast this machine runs detection, by changing frame rate of detection branch
+    # between min_fps and max_fps. Otherwise, it is fixed.
+    adaptive_fps: bool = True
+    min_fps: int = Field(2, ge=1)
+    max_fps: int = Field(10, ge=1)
+    # Reuse detection result of a recent frame, if a new frame is nearly the same (when the user holds still)
+    dedup: bool = True
+    # Mean absolute difference of downsampled frames, 0-255, under which they are considered the same
+    dedup_threshold: float = Field(2.5, ge=0)
+    # Seconds to keep a result
+    dedup_max_age: float = Field(1, ge=0)
+    dedup_size: int = Field(4, ge=1)
+
+
+class QualitySetting(BaseModel):
+    # Skip uploading frames whose quality is under these thresholds.
+    # They are measured over the face, on frames fed to face detection (see DetectionSetting.width).
+    # Off by default, the thresholds may need tuning for the camera and lighting.
+    enabled: bool = False
+    # After this many rejections in a row, let one frame through anyway, so that uploading never stops for good.
+    # 0 for no limit.
+    max_rejections: int = Field(8, ge=0)
+    # Variance of Laplacian
+    min_sharpness: float = Field(30, ge=0)
+    min_brightness: float = Field(50, ge=0, le=255)
+    max_brightness: float = Field(210, ge=0, le=255)
+    # Fraction of pixels which are nearly black or white
+    max_clipped: float = Field(0.25, ge=0, le=1)
+    # Face area, relative to frame area
+    min_face_ratio: float = Field(0.04, ge=0, le=1)
+
+
+class UploadSetting(BaseModel):
+    jpeg_quality: int = Field(75, ge=0, le=100)
+    # What to upload: whole frame, detected face with margin, or the area where challenge expects face
+    mode: Literal['full', 'face', 'area'] = 'full'
+    # How much to expand face box, on each side, relative to its size, in "face" mode
+    face_margin: float = Field(0.3, ge=0)
+    # Scale uploaded images down so that their width and height don't exceed this. 0 for no limit.
+    max_dimension: int = Field(0, ge=0)
+    quality_gate: QualitySetting = Field(default_factory=QualitySetting)
+
+
 class AppSettings(BaseModel):
     sst: SSTSetting
     aws_demo: AWSSetting
+    detection: DetectionSetting = Field(default_factory=DetectionSetting)
+    upload: UploadSetting = Field(default_factory=UploadSetting)
@@ -0,0 +1,199 @@
+import time
+from typing import Dict, Any, Callable, Optional, Tuple, List
+
+import gi
+import orjson
+import yarl
+from logbook import Logger
+from kiss_headers import BasicAuthorization
+
+gi.require_version('GLib', '2.0')
+gi.require_version('Gio', '2.0')
+gi.require_version('Soup', '2.4')
+
+from gi.repository import GLib, Gio, Soup
+
+from .consts import HTTP_MAX_CONNS_PER_HOST, HTTP_IDLE_TIMEOUT, STREAM_MAX_UNACKED, STREAM_ACK_TIMEOUT
+from .backends import Backend
+from .models import Rectangle, pack_stream_frame
+from .metrics import summarize
+
+
+logger = Logger(__name__)
+
+
+class BackendClient:
+    '''
+    Long-lived HTTP session for one backend, so that the TCP/TLS connection
+    is kept alive and reused across challenge start, frame submissions and verification.
+    '''
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.session = Soup.Session(max_conns_per_host=HTTP_MAX_CONNS_PER_HOST,
+                                    idle_timeout=HTTP_IDLE_TIMEOUT)
+
+    def request(self, method: str, url: str, data: Dict[str, Any], callback: Callable,
+                basic_auth: Tuple[str, str] = ()):
+        self.send(method, url, 'application/json', orjson.dumps(data), callback, basic_auth)
+
+    def send(self, method: str, url: str, content_type: str, body: bytes, callback: Callable,
+             basic_auth: Tuple[str, str] = (), headers: Optional[Dict[str, str]] = None):
+        message = Soup.Message.new(method, url)
+        request_headers = message.get_property('request-headers')
+        if basic_auth:
+            logger.debug('Set auth')
+            auth = BasicAuthorization(*basic_auth)
+            request_headers.append('Authorization', str(auth))
+        for name, value in (headers or {}).items():
+            request_headers.append(name, value)
+        message.set_request(content_type, Soup.MemoryUse.COPY, body)
+        self.queue_message(message, callback)
+
+    def queue_message(self, message: Soup.Message, callback: Optional[Callable]):
+        # SoupSession is not thread-safe, and we are called from GStreamer streaming thread sometimes.
+        if GLib.MainContext.default().is_owner():
+            self._queue_message(message, callback)
+            return
+        GLib.idle_add(self._queue_message, message, callback)
+
+    def _queue_message(self, message: Soup.Message, callback: Optional[Callable]):
+        self.session.queue_message(message, callback, self.backend)
+        # This function may be passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def warm_up(self):
+        # Resolve DNS and open connection (including TLS handshake) before we need it.
+        # The connection is then kept in session pool, for the next requests.
+        origin = yarl.URL(self.backend.start_url).origin()
+        logger.debug('Warm up connection to {}', origin)
+        self.session.prefetch_dns(origin.host, None, None)
+        message = Soup.Message.new('HEAD', str(origin))
+        self.queue_message(message, self.cb_warmed_up)
+
+    def cb_warmed_up(self, session: Soup.Session, msg: Soup.Message, backend: Backend):
+        logger.debug('Connection to {} is ready: {}', msg.get_uri().to_string(False), msg.get_property('status-code'))
+
+    def close(self):
+        self.session.abort()
+
+
+class FrameStream:
+    '''
+    One WebSocket per challenge, to push frames as binary messages (see models.pack_stream_frame),
+    instead of making an HTTP request for each of them.
+
+    Server replies with JSON text messages: "ack" for each frame, which may carry verification progress.
+    Frames not acknowledged yet are bounded, newer frames are dropped when the server falls behind.
+    Acks which don't come in STREAM_ACK_TIMEOUT are given up, so that lost ones don't block the stream forever.
+    It must be used from the main thread, like Soup.Session.
+    '''
+
+    def __init__(self, client: BackendClient, url: str, basic_auth: Tuple[str, str] = (),
+                 on_message: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.client = client
+        self.url = url
+        self.basic_auth = basic_auth
+        self.on_message = on_message
+        self.connection: Optional[Soup.WebsocketConnection] = None
+        self.closed = False
+        self.seq = 0
+        # Monotonic time when frames are sent, by sequence number, until they are acknowledged
+        self.unacked: Dict[int, float] = {}
+        self.sent = 0
+        self.acked = 0
+        self.dropped = 0
+        self.expired = 0
+        # Milliseconds from sending a frame to receiving its ack
+        self.ack_latencies: List[float] = []
+
+    @property
+    def is_open(self) -> bool:
+        return bool(self.connection) and self.connection.get_state() == Soup.WebsocketState.OPEN
+
+    def connect(self):
+        message = Soup.Message.new('GET', self.url)
+        if self.basic_auth:
+            headers = message.get_property('request-headers')
+            headers.append('Authorization', str(BasicAuthorization(*self.basic_auth)))
+        logger.debug('Open WebSocket to {}', self.url)
+        self.client.session.websocket_connect_async(message, None, None, None, self.cb_connected)
+
+    def cb_connected(self, session: Soup.Session, result: Gio.AsyncResult):
+        try:
+            connection: Soup.WebsocketConnection = session.websocket_connect_finish(result)
+        except GLib.Error as e:
+            logger.error('Failed to open WebSocket to {}: {}', self.url, e)
+            self.closed = True
+            return
+        if self.closed:
+            # Challenge is over before the connection is ready
+            connection.close(Soup.WebsocketCloseCode.NORMAL, None)
+            return
+        connection.connect('message', self.on_ws_message)
+        connection.connect('closed', self.on_ws_closed)
+        self.connection = connection
+        logger.debug('WebSocket to {} is open', self.url)
+
+    def send(self, jpeg_data: bytes, crop: Optional[Rectangle] = None) -> bool:
+        # Return False if the stream cannot take frames (not open yet, or closed),
+        # for caller to fall back to HTTP. Frames dropped because of backpressure count as taken.
+        if not self.is_open:
+            return False
+        now = time.monotonic()
+        if len(self.unacked) >= STREAM_MAX_UNACKED:
+            self.expire_unacked(now)
+        if len(self.unacked) >= STREAM_MAX_UNACKED:
+            self.dropped += 1
+            return True
+        seq = self.seq
+        self.seq += 1
+        self.unacked[seq] = now
+        self.connection.send_binary(pack_stream_frame(seq, jpeg_data, crop))
+        self.sent += 1
+        return True
+
+    def expire_unacked(self, now: float):
+        # Frames are sent in order, so the oldest ones are first
+        while self.unacked:
+            seq, sent_at = next(iter(self.unacked.items()))
+            if now - sent_at < STREAM_ACK_TIMEOUT:
+                break
+            del self.unacked[seq]
+            self.expired += 1
+
+    def on_ws_message(self, connection: Soup.WebsocketConnection, data_type: int, message: GLib.Bytes):
+        if data_type != Soup.WebsocketDataType.TEXT:
+            return
+        try:
+            data = orjson.loads(message.get_data())
+        except orjson.JSONDecodeError:
+            logger.warning('Invalid message from WebSocket: {}', message.get_data())
+            return
+        if data.get('type') == 'ack':
+            sent_at = self.unacked.pop(data.get('seq'), None)
+            if sent_at is not None:
+                self.acked += 1
+                self.ack_latencies.append((time.monotonic() - sent_at) * 1000)
+        if self.on_message:
+            self.on_message(data)
+
+    def on_ws_closed(self, connection: Soup.WebsocketConnection):
+        logger.debug('WebSocket to {} is closed: {}', self.url, connection.get_close_code())
+        self.closed = True
+        self.connection = None
+
+    def close(self):
+        self.closed = True
+        if self.is_open:
+            self.connection.close(Soup.WebsocketCloseCode.NORMAL, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sent': self.sent,
+            'acked': self.acked,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'unacked': len(self.unacked),
+            'ack_ms': summarize(self.ack_latencies),
+        }
@@ -0,0 +1,60 @@
+from typing import Optional
+
+import cairo
+
+from .models import Rectangle, ChallengeInfo
+from .geometry import ChallengeGeometry, OverlayFrame
+
+
+FACE_AREA_COLOR = (0.9, 0, 0, 0.6)
+FACE_INSIDE_COLOR = (0, 0.9, 0, 0.6)
+NOSE_AREA_COLOR = (0.8, 0.8, 0, 0.6)
+NOSE_TIP_COLOR = (1, 0.6, 0, 0.6)
+GUIDE_LINE_WIDTH = 4
+NOSE_TIP_LINE_WIDTH = 2
+
+
+def build_rectangle_path(rect: Rectangle) -> cairo.Path:
+    # Path is independent of the surface it is built on, so a tiny scratch surface is enough
+    context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_A8, 1, 1))
+    context.rectangle(*rect)
+    return context.copy_path()
+
+
+class OverlayPainter:
+    '''
+    Draw challenge guides and detected nose onto video frames.
+
+    Everything derived from ChallengeInfo is prepared when the challenge arrives,
+    so that painting, which runs for every rendered frame, only replays cached paths.
+    '''
+
+    def __init__(self, geometry: ChallengeGeometry):
+        self.geometry = geometry
+        self.face_area_path = build_rectangle_path(geometry.face_area)
+        self.nose_area_path = build_rectangle_path(geometry.nose_area)
+
+    @classmethod
+    def from_info(cls, info: ChallengeInfo) -> 'OverlayPainter':
+        return cls(ChallengeGeometry.from_info(info))
+
+    def paint(self, context: cairo.Context, frame: Optional[OverlayFrame], show_nose: bool):
+        context.new_path()
+        context.append_path(self.face_area_path)
+        context.set_source_rgba(*(FACE_INSIDE_COLOR if frame and frame.face_inside else FACE_AREA_COLOR))
+        context.set_line_width(GUIDE_LINE_WIDTH)
+        context.stroke()
+        if not show_nose:
+            return
+        context.append_path(self.nose_area_path)
+        context.set_source_rgba(*NOSE_AREA_COLOR)
+        context.stroke()
+        if not frame or not frame.nose_tip:
+            return
+        nose_tip = frame.nose_tip
+        context.move_to(*nose_tip[0])
+        for point in nose_tip[1:]:
+            context.line_to(*point)
+        context.set_source_rgba(*NOSE_TIP_COLOR)
+        context.set_line_width(NOSE_TIP_LINE_WIDTH)
+        context.stroke()
@@ -1,4 +1,5 @@
 from fractions import Fraction
+from typing import Tuple
 
 import gi
 
@@ -6,7 +7,8 @@ gi.require_version('Gio', '2.0')
 gi.require_version('GdkPixbuf', '2.0')
 gi.require_version('Rsvg', '2.0')
 gi.require_version('Gst', '1.0')
-from gi.repository import GdkPixbuf, Gst
+gi.require_version('GstVideo', '1.0')
+from gi.repository import GdkPixbuf, Gst, GstVideo
 
 
 def get_device_path(device: Gst.Device):
@@ -23,6 +25,90 @@ def get_device_path(device: Gst.Device):
     return device.get_property('device_path'), 'v4l2src'
 
 
+def get_replay_source(location: str) -> Tuple[str, str]:
+    # Like get_device_path(), return path and source type, but for a recorded video to replay:
+    # - "videotestsrc" or "videotestsrc:<pattern>" for GStreamer test video
+    # - A path containing printf-style index, like "frames/%04d.jpg", for image sequence
+    # - Other paths are video files
+    if location == 'videotestsrc' or location.startswith('videotestsrc:'):
+        return location.partition(':')[2], 'videotestsrc'
+    if '%' in location:
+        return location, 'multifilesrc'
+    return location, 'filesrc'
+
+
+def build_replay_source(src_type: str, path: str, name: str, framerate: int = 30) -> str:
+    # Pipeline part which outputs raw video from a source returned by get_replay_source()
+    if src_type == 'videotestsrc':
+        pattern = f' pattern={path}' if path else ''
+        return (f'videotestsrc name={name} is-live=true{pattern} ! '
+                f'video/x-raw,width=640,height=480,framerate={framerate}/1 ! videoconvert')
+    if src_type == 'multifilesrc':
+        mime = 'image/png' if path.lower().endswith('.png') else 'image/jpeg'
+        return (f'multifilesrc name={name} location="{path}" index=0 caps="{mime},framerate={framerate}/1" ! '
+                'decodebin ! videoconvert')
+    return f'filesrc name={name} location="{path}" ! decodebin ! videoconvert'
+
+
+def build_framerate_caps(fps: int) -> Gst.Caps:
+    return Gst.Caps.from_string(f'video/x-raw,framerate={fps}/1')
+
+
+def build_appsink_branch(sink_name: str, fps: int, width: int = 0, grayscale: bool = False,
+                         rate_filter_name: str = '') -> str:
+    # Drop frames by videorate first, so that scaling and converting only run on frames which reach the appsink.
+    # If rate_filter_name is given, the frame rate caps are put in a named capsfilter,
+    # so that they can be changed later, with build_framerate_caps().
+    pixel_format = 'GRAY8' if grayscale else 'RGB'
+    caps = f'video/x-raw,format={pixel_format}'
+    if width:
+        # GStreamer pads each row to multiple of 4 bytes, keep the width aligned
+        # so that the frame can be viewed as a contiguous array, without copying in workers.
+        # With source width, rows may be padded, so use get_frame_stride().
+        # Height is picked by videoscale, to keep aspect ratio.
+        caps += f',width={width // 4 * 4},pixel-aspect-ratio=1/1'
+    rate_caps = f'video/x-raw,framerate={fps}/1'
+    if rate_filter_name:
+        rate_caps = f'capsfilter name={rate_filter_name} caps={rate_caps}'
+    return (f'queue leaky=2 max-size-buffers=2 ! videorate ! {rate_caps} ! '
+            f'videoscale ! videoconvert ! {caps} ! appsink name={sink_name} max-buffers=1 drop=true')
+
+
+def build_upload_branch(sink_name: str, valve_name: str, fps: int, jpeg_quality: int,
+                        crop_name: str = '', scale_name: str = '') -> str:
+    # Frames are encoded to JPEG by GStreamer, not in appsink callback.
+    # The valve is placed after videorate, so that videorate doesn't fill the time when the valve is closed
+    # with duplicate frames.
+    # If crop_name or scale_name is given, a named videocrop, or videoscale and capsfilter, are placed after the valve,
+    # to be set by crop.UploadCropper.
+    # The appsink doesn't wait for preroll, because the valve is closed at start. Otherwise, pipelines
+    # from non-live sources (files) never get to PLAYING, and the valve is never opened.
+    resize = f'videocrop name={crop_name} ! ' if crop_name else ''
+    if scale_name:
+        resize += f'videoscale ! capsfilter name={scale_name} ! '
+    return (f'queue leaky=2 max-size-buffers=2 ! videorate ! video/x-raw,framerate={fps}/1 ! '
+            f'valve name={valve_name} drop=true ! {resize}videoconvert ! jpegenc quality={jpeg_quality} ! '
+            f'appsink name={sink_name} max-buffers=1 drop=true async=false')
+
+
+def get_frame_shape(caps: Gst.Caps) -> Tuple[int, ...]:
+    # Shape of frame data, as numpy array
+    struct: Gst.Structure = caps[0]
+    width = struct['width']
+    height = struct['height']
+    if struct['format'] == 'GRAY8':
+        return (height, width)
+    return (height, width, 3)
+
+
+def get_frame_stride(caps: Gst.Caps) -> int:
+    # Bytes per row, which GStreamer pads to multiple of 4
+    info = GstVideo.VideoInfo()
+    if not info.from_caps(caps):
+        return 0
+    return info.stride[0]
+
+
 def scale_pixbuf(pixbuf: GdkPixbuf.Pixbuf, outer_width: int, outer_height):
     # Get original size
     ow = pixbuf.get_width()
@@ -0,0 +1,36 @@
+from threading import Lock
+from collections import OrderedDict
+from typing import Optional, Generic, TypeVar
+
+
+T = TypeVar('T')
+
+
+class PtsMap(Generic[T]):
+    '''
+    What is noted about frames in one place of the pipeline, by buffer PTS, to be picked up further down.
+
+    Frames may be dropped in between, so their entries are never popped. Only the latest ``maxlen`` are kept.
+    '''
+
+    def __init__(self, maxlen: int = 8):
+        self.maxlen = maxlen
+        self._items: 'OrderedDict[int, T]' = OrderedDict()
+        self._lock = Lock()
+
+    def put(self, pts: int, value: T):
+        with self._lock:
+            self._items[pts] = value
+            while len(self._items) > self.maxlen:
+                self._items.popitem(last=False)
+
+    def pop(self, pts: int) -> Optional[T]:
+        with self._lock:
+            return self._items.pop(pts, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
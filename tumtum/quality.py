@@ -0,0 +1,120 @@
+from threading import Lock
+from typing import Optional, Dict, Tuple, NamedTuple, TYPE_CHECKING
+
+from logbook import Logger
+
+from .models import QualitySetting
+
+# Quality is measured in detection workers. The main process only judges the numbers,
+# so NumPy is imported when a worker runs measure_quality().
+if TYPE_CHECKING:
+    import numpy as np
+
+
+logger = Logger(__name__)
+# Pixels darker or brighter than these are considered clipped
+CLIP_LOW = 5
+CLIP_HIGH = 250
+REJECT_REASONS = ('no_face', 'small_face', 'blurry', 'dark', 'bright', 'clipped')
+
+
+class FrameQuality(NamedTuple):
+    # Variance of Laplacian over the face, higher is sharper
+    sharpness: float
+    # Mean brightness over the face, 0-255
+    brightness: float
+    # Fraction of face pixels which are too dark or too bright
+    clipped: float
+    # Face area, relative to frame area. 0 if no face is found.
+    face_ratio: float
+
+
+def measure_quality(nimp: 'np.ndarray', box: Optional[Tuple[int, int, int, int]]) -> FrameQuality:
+    # Measure on detection frame, which is already in shared memory, over the face box if there is one
+    import numpy as np
+    height, width = nimp.shape[:2]
+    face_ratio = 0
+    roi = nimp
+    if box:
+        x, y, w, h = box
+        roi = nimp[y:y + h, x:x + w]
+        face_ratio = w * h / (width * height)
+    if roi.ndim == 3:
+        roi = roi @ np.array((0.299, 0.587, 0.114), np.float32)
+    else:
+        roi = roi.astype(np.float32)
+    if roi.shape[0] < 3 or roi.shape[1] < 3:
+        return FrameQuality(0, 0, 1, face_ratio)
+    # 4-neighbour Laplacian, by shifted views instead of convolution
+    center = roi[1:-1, 1:-1]
+    laplacian = roi[:-2, 1:-1] + roi[2:, 1:-1] + roi[1:-1, :-2] + roi[1:-1, 2:] - 4 * center
+    clipped = np.count_nonzero((roi <= CLIP_LOW) | (roi >= CLIP_HIGH)) / roi.size
+    return FrameQuality(float(laplacian.var()), float(roi.mean()), float(clipped), face_ratio)
+
+
+class QualityGate:
+    '''
+    Decide if frames are good enough to upload, from quality measured by face detection workers.
+
+    The verdict of the latest detected frame is kept in ``passing``, to open or close the upload valve,
+    so that rejected frames are not encoded to JPEG.
+    After ``max_rejections`` frames in a row are rejected, the next one passes anyway,
+    so that the server still gets some frames in poor conditions.
+    '''
+
+    def __init__(self, setting: QualitySetting):
+        self.setting = setting
+        self.passing = False
+        self.accepted = 0
+        # Frames let through because too many before them were rejected
+        self.forced = 0
+        self.rejected: Dict[str, int] = dict.fromkeys(REJECT_REASONS, 0)
+        self._rejected_in_row = 0
+        self._lock = Lock()
+
+    def judge(self, quality: FrameQuality) -> Optional[str]:
+        # Return reason to reject, or None if the frame is good
+        setting = self.setting
+        if not quality.face_ratio:
+            return 'no_face'
+        if quality.face_ratio < setting.min_face_ratio:
+            return 'small_face'
+        if quality.sharpness < setting.min_sharpness:
+            return 'blurry'
+        if quality.brightness < setting.min_brightness:
+            return 'dark'
+        if quality.brightness > setting.max_brightness:
+            return 'bright'
+        if quality.clipped > setting.max_clipped:
+            return 'clipped'
+        return None
+
+    def check(self, quality: FrameQuality) -> bool:
+        reason = self.judge(quality)
+        limit = self.setting.max_rejections
+        with self._lock:
+            if reason and limit and self._rejected_in_row >= limit:
+                self.forced += 1
+                reason = None
+            elif reason:
+                self.rejected[reason] += 1
+            else:
+                self.accepted += 1
+            self._rejected_in_row = self._rejected_in_row + 1 if reason else 0
+            self.passing = reason is None
+        if reason:
+            logger.debug('Frame is rejected for upload, {}: {}', reason, quality)
+        return reason is None
+
+    def reset(self):
+        self.passing = False
+        self._rejected_in_row = 0
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'forced': self.forced,
+                'rejected': sum(self.rejected.values()),
+                'rejected_by': dict(self.rejected),
+            }
@@ -0,0 +1,53 @@
+import time
+from threading import Lock
+from typing import Dict, Tuple, List
+
+from logbook import LogRecord
+
+from .consts import LOG_RATE_INTERVAL, LOG_RATE_BURST
+
+
+class CallSiteRateLimiter:
+    '''
+    Let at most `burst` messages from each call site through, in each `interval` seconds.
+    Call site is identified by logger name and message template, which is cheap to get and
+    is the same for all messages from one logging call.
+    '''
+
+    def __init__(self, interval: float = LOG_RATE_INTERVAL, burst: int = LOG_RATE_BURST):
+        self.interval = interval
+        self.burst = burst
+        # Start of current window, messages let through in it, and messages suppressed, by call site
+        self._sites: Dict[Tuple[str, str], List] = {}
+        self._lock = Lock()
+
+    def allow(self, record: LogRecord) -> bool:
+        key = (record.channel, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                self._sites[key] = [now, 1, 0]
+                return True
+            if now - site[0] >= self.interval:
+                site[0] = now
+                site[1] = 0
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+    def reset_after_fork(self):
+        # The lock may have been held by another thread of the parent process, which is not in the child
+        self._lock = Lock()
+        self._sites = {}
+
+    def pop_suppressed(self, record: LogRecord) -> int:
+        key = (record.channel, record.msg)
+        with self._lock:
+            site = self._sites.get(key)
+            if not site or not site[2]:
+                return 0
+            count, site[2] = site[2], 0
+            return count
@@ -1,11 +1,15 @@
 from pathlib import Path
+from typing import Optional, List, Callable
 
 import gi
 import tomlkit
+from logbook import Logger
 from pydantic import ValidationError
 
 gi.require_version('Gio', '2.0')
 
+from gi.repository import Gio
+
 from .consts import SHORT_NAME, DEFAULT_SETTINGS
 from .models import AppSettings
 
@@ -17,6 +21,7 @@ from .models import AppSettings
 # - If this app is run from source, look in the source folder
 
 DOT_LOCAL = Path('~/.local').expanduser()
+logger = Logger(__name__)
 
 
 def get_location_prefix() -> Path:
@@ -79,3 +84,50 @@ def load_config() -> AppSettings:
     if not data:
         data = DEFAULT_SETTINGS
     return AppSettings.parse_obj(data)
+
+
+def save_config(settings: AppSettings):
+    filepath = get_config_path()
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    filepath.write_text(tomlkit.dumps(settings.dict()))
+
+
+class ConfigCache:
+    '''
+    Keep parsed settings in memory, so that hot paths don't read and parse the config file.
+    The cache is dropped when the file is changed, by us or by other program.
+    '''
+    settings: Optional[AppSettings] = None
+    monitor: Optional[Gio.FileMonitor] = None
+
+    def __init__(self):
+        # Functions to call when the cached settings are dropped
+        self.listeners: List[Callable[[], None]] = []
+
+    def get(self) -> AppSettings:
+        settings = self.settings
+        if settings is None:
+            settings = load_config()
+            self.settings = settings
+        return settings
+
+    def save(self, settings: AppSettings):
+        save_config(settings)
+        self.invalidate()
+
+    def invalidate(self):
+        self.settings = None
+        for callback in self.listeners:
+            callback()
+
+    def watch(self):
+        gfile = Gio.File.new_for_path(str(get_config_path()))
+        self.monitor = gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect('changed', self.on_config_file_changed)
+
+    def on_config_file_changed(self, monitor: Gio.FileMonitor, gfile: Gio.File, other_file: Optional[Gio.File],
+                               event_type: Gio.FileMonitorEvent):
+        if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED,
+                          Gio.FileMonitorEvent.DELETED):
+            logger.debug('Config file is changed ({}), reload it next time', event_type.value_nick)
+            self.invalidate()
@@ -0,0 +1,127 @@
+import time
+import itertools
+from threading import Lock
+from concurrent.futures import Executor, Future
+from typing import Optional, Dict, Callable, NamedTuple, Any
+
+from logbook import Logger
+
+from .framering import FrameRef
+
+
+logger = Logger(__name__)
+
+
+class FrameStamp(NamedTuple):
+    # Gst.Buffer PTS, in nanoseconds
+    pts: int
+    # Monotonic time when the frame reaches the appsink
+    arrived_at: float
+
+
+class DetectionJob(NamedTuple):
+    seq: int
+    frame: FrameRef
+    # Monotonic time when the job is submitted
+    submitted_at: float
+    stamp: Optional[FrameStamp] = None
+    # Downsampled frame, to cache the result by
+    signature: Optional[bytes] = None
+
+
+# Called with the job, its future, and whether the result is newer than all accepted ones.
+ResultCallback = Callable[[DetectionJob, Future, bool], Any]
+
+
+class DetectionScheduler:
+    '''
+    Dispatch face detection jobs to executor, with latest-frame-wins policy:
+
+    - No more than max_in_flight jobs are running. New frames are dropped when all are busy.
+    - Frames are numbered with increasing sequence numbers.
+    - A result which comes after the result of a newer frame is dropped as stale.
+    - Frames answered from cache take a sequence number too, so older results in flight don't overwrite theirs.
+    '''
+
+    def __init__(self, executor: Executor, callback: ResultCallback, max_in_flight: int = 2):
+        self.executor = executor
+        self.callback = callback
+        self.max_in_flight = max_in_flight
+        self.in_flight: Dict[Future, DetectionJob] = {}
+        self.last_accepted_seq = -1
+        self.submitted = 0
+        self.accepted = 0
+        self.cached = 0
+        self.dropped_busy = 0
+        self.dropped_stale = 0
+        self._seq = itertools.count()
+        self._lock = Lock()
+
+    def has_capacity(self) -> bool:
+        if len(self.in_flight) < self.max_in_flight:
+            return True
+        with self._lock:
+            self.dropped_busy += 1
+        return False
+
+    def submit(self, func: Callable, frame: FrameRef, *args,
+               stamp: Optional[FrameStamp] = None, signature: Optional[bytes] = None) -> Optional[DetectionJob]:
+        # The frame is always passed as first argument of func.
+        # Raise RuntimeError if the executor has been shut down.
+        with self._lock:
+            job = DetectionJob(next(self._seq), frame, time.monotonic(), stamp, signature)
+            future = self.executor.submit(func, frame, *args)
+            self.in_flight[future] = job
+            self.submitted += 1
+        future.add_done_callback(self._on_done)
+        return job
+
+    def set_executor(self, executor: Executor):
+        # Jobs in flight finish on the old executor, and their results are handled as usual
+        with self._lock:
+            self.executor = executor
+
+    def accept_cached(self) -> bool:
+        # For a frame whose result is taken from cache, instead of submitting a job.
+        # Return whether the result should be applied, like "fresh" of ResultCallback.
+        with self._lock:
+            fresh = self._accept(next(self._seq))
+            if fresh:
+                self.cached += 1
+        return fresh
+
+    def _accept(self, seq: int) -> bool:
+        # Must be called with the lock held
+        if seq <= self.last_accepted_seq:
+            return False
+        self.last_accepted_seq = seq
+        return True
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            job = self.in_flight.pop(future)
+            fresh = False
+            if future.cancelled():
+                pass
+            elif self._accept(job.seq):
+                self.accepted += 1
+                fresh = True
+            else:
+                self.dropped_stale += 1
+        if not fresh and not future.cancelled():
+            logger.debug('Drop result of frame {}, older than frame {}', job.seq, self.last_accepted_seq)
+        self.callback(job, future, fresh)
+
+    def cancel_all(self):
+        for future in tuple(self.in_flight):
+            future.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'submitted': self.submitted,
+            'accepted': self.accepted,
+            'cached': self.cached,
+            'dropped_busy': self.dropped_busy,
+            'dropped_stale': self.dropped_stale,
+            'in_flight': len(self.in_flight),
+        }
@@ -0,0 +1,603 @@
+import json
+import time
+from base64 import b64encode
+from functools import partial
+from concurrent.futures import Future
+from typing import Optional, Dict, Tuple, List, Callable, Any
+
+import gi
+import orjson
+from logbook import Logger
+
+gi.require_version('GLib', '2.0')
+gi.require_version('Gst', '1.0')
+gi.require_version('GstApp', '1.0')
+gi.require_version('Soup', '2.4')
+
+from gi.repository import GLib, Gst, GstApp, Soup
+
+from .consts import FPS
+from .prep import build_appsink_branch, build_upload_branch, build_framerate_caps, get_frame_shape, get_frame_stride
+from .states import State
+from .transitions import ChallengeStateManager
+from .models import (
+    CompactDrawData, OverlayDrawData, Rectangle, ChallengeStartRequest, ChallengeInfo,
+    FrameSubmitRequest, ChallengeVerifyRequest, AppSettings, DetectionSetting, build_frame_headers,
+)
+from .backends import Backend, SSTBackend, ChallengeEndpoints
+from .net import BackendClient, FrameStream
+from .framering import FrameRing, FrameRef
+from .tracking import FaceTracker
+from .scheduler import DetectionScheduler, DetectionJob, FrameStamp
+from .metrics import StageStats
+from .geometry import ChallengeGeometry, OverlayFrame
+from .tasks import inspect_frame
+from .workers import DetectionPool, check_engine, engine_changed
+from .framerate import FrameRateController
+from .quality import QualityGate, FrameQuality
+from .dedup import DetectionCache, frame_signature
+from .ptsmap import PtsMap
+from .crop import UploadCropper
+
+
+logger = Logger(__name__)
+
+
+class ChallengeSession:
+    '''
+    Frame and challenge path, shared by TumTumApplication and ReplayRunner, without any GTK widget:
+    feeding frames from the appsinks to face detection and backend, judging detection results
+    against challenge areas, and driving the challenge state with them.
+
+    The owner builds a pipeline with the branches from build_branches(), passes it to attach_pipeline(),
+    and follows the challenge with the listeners.
+    '''
+    APPSINK_NAME = 'app_sink'
+    UPLOAD_SINK_NAME = 'upload_sink'
+    UPLOAD_VALVE_NAME = 'upload_valve'
+    UPLOAD_CROP_NAME = 'upload_crop'
+    UPLOAD_SCALE_NAME = 'upload_scale'
+    DETECTION_RATE_FILTER_NAME = 'detection_rate'
+
+    def __init__(self, state_manager: ChallengeStateManager, detection: DetectionSetting):
+        self.state_manager = state_manager
+        self.state_manager.listeners.append(self.on_challenge_state_changed)
+        self.detection_setting = detection
+        # Face detection workers, spawned with models loaded at startup
+        self.detection_pool = DetectionPool(detection.workers or detection.max_in_flight, detection.engine,
+                                            detection.pool, detection)
+        # Keep track of face detection tasks (which will run in multiprocessing basis),
+        # so that we can bound them, drop stale results, and cancel them when quitting.
+        self.detection_scheduler = DetectionScheduler(self.detection_pool.executor, self.pass_face_detection_result,
+                                                      detection.max_in_flight)
+        self.gst_pipeline: Optional[Gst.Pipeline] = None
+        # Size of frames entering the tee, which the challenge is based on
+        self.frame_size: Optional[Tuple[int, int]] = None
+        # Shared memory slots to pass frames to face detection workers
+        self.frame_ring: Optional[FrameRing] = None
+        # Rings replaced after frame size changes, closed when their frames are all released
+        self.retired_rings: List[FrameRing] = []
+        self.face_tracker: Optional[FaceTracker] = None
+        # Changes frame rate of detection branch, when detection.adaptive_fps is on
+        self.framerate_controller: Optional[FrameRateController] = None
+        # Skips uploading blurry or badly exposed frames, when upload.quality_gate is enabled
+        self.quality_gate: Optional[QualityGate] = None
+        # Results of recent frames, for nearly identical ones to reuse
+        self.detection_cache: Optional[DetectionCache] = None
+        # Crops frames to upload, when upload.mode is not "full" or upload.max_dimension is set
+        self.upload_cropper: Optional[UploadCropper] = None
+        self.upload_valve_open = False
+        self.backend: Optional[Backend] = None
+        self.challenge_info: Optional[ChallengeInfo] = None
+        # URLs and guide areas are the same for the whole challenge, resolved once
+        self.challenge_endpoints: Optional[ChallengeEndpoints] = None
+        self.geometry: Optional[ChallengeGeometry] = None
+        # WebSocket to push frames of current challenge, when backend streams frames
+        self.frame_stream: Optional[FrameStream] = None
+        # HTTP clients, which keep connections alive, one for each backend type
+        self.http_clients: Dict[str, BackendClient] = {}
+        # Per-stage latency stats, only collected if set
+        self.stats: Optional[StageStats] = None
+        # Monotonic time when a frame to upload leaves the valve, by PTS
+        self.upload_frame_times: PtsMap[float] = PtsMap()
+        self.frames_received = 0
+        self.frames_submitted = 0
+        self.bytes_submitted = 0
+        # Called with challenge info when a challenge starts, or None if backend fails to start it
+        self.challenge_listeners: List[Callable[[Optional[ChallengeInfo]], Any]] = []
+        # Called with the judged detection result (None if no face) and the stamp of its frame
+        self.result_listeners: List[Callable[[Optional[OverlayFrame], Optional[FrameStamp]], Any]] = []
+        # Called with verification result, error message and the future of the final transition
+        self.verification_listeners: List[Callable[[bool, str, Future], Any]] = []
+        # Called with message when face detection starts failing, or the engine cannot be switched to
+        self.error_listeners: List[Callable[[str], Any]] = []
+        self.detection_error = ''
+        # Pool with new engine settings, warming up to take over detection_pool
+        self.pending_pool: Optional[DetectionPool] = None
+
+    def build_branches(self, settings: AppSettings, fps: int = FPS) -> Tuple[str, str]:
+        # Face detection runs on downscaled frames, while full-size frames are encoded to JPEG for uploading.
+        # Return the detection and upload branches, to be linked to a tee.
+        detection = settings.detection
+        self.detection_setting = detection
+        self.face_tracker = FaceTracker(detection.tracking_margin) if detection.tracking else None
+        self.detection_cache = (DetectionCache(detection.dedup_threshold, detection.dedup_max_age, detection.dedup_size)
+                                if detection.dedup else None)
+        detection_fps = fps
+        self.framerate_controller = None
+        if detection.adaptive_fps:
+            # Only max_in_flight frames are detected at the same time, even if there are more workers
+            parallel = min(detection.workers or detection.max_in_flight, detection.max_in_flight)
+            self.framerate_controller = FrameRateController(fps, detection.min_fps, detection.max_fps, parallel)
+            detection_fps = self.framerate_controller.fps
+        detection_branch = build_appsink_branch(self.APPSINK_NAME, detection_fps, detection.width,
+                                                detection.grayscale, self.DETECTION_RATE_FILTER_NAME)
+        upload = settings.upload
+        gate_setting = upload.quality_gate
+        self.quality_gate = QualityGate(gate_setting) if gate_setting.enabled else None
+        self.upload_cropper = UploadCropper(upload) if upload.mode != 'full' or upload.max_dimension else None
+        upload_branch = build_upload_branch(self.UPLOAD_SINK_NAME, self.UPLOAD_VALVE_NAME, fps, upload.jpeg_quality,
+                                            self.UPLOAD_CROP_NAME if upload.mode != 'full' else '',
+                                            self.UPLOAD_SCALE_NAME if upload.max_dimension else '')
+        return detection_branch, upload_branch
+
+    def attach_pipeline(self, pipeline: Gst.Pipeline):
+        appsink: GstApp.AppSink = pipeline.get_by_name(self.APPSINK_NAME)
+        appsink.connect('new-sample', self.on_new_detection_sample)
+        upload_sink: GstApp.AppSink = pipeline.get_by_name(self.UPLOAD_SINK_NAME)
+        upload_sink.connect('new-sample', self.on_new_upload_sample)
+        valve = pipeline.get_by_name(self.UPLOAD_VALVE_NAME)
+        if self.stats:
+            valve.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.on_upload_frame_probe)
+        cropper = self.upload_cropper
+        if cropper:
+            cropper.attach(pipeline.get_by_name(self.UPLOAD_CROP_NAME), pipeline.get_by_name(self.UPLOAD_SCALE_NAME))
+            cropper.frame_size = self.frame_size
+            valve.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, cropper.on_buffer_probe)
+        self.gst_pipeline = pipeline
+        self.upload_valve_open = False
+
+    def report_detection_error(self, message: str):
+        if message == self.detection_error:
+            return
+        self.detection_error = message
+        logger.error('Face detection: {}', message)
+        for listener in self.error_listeners:
+            listener(message)
+
+    def switch_engine(self, detection: DetectionSetting) -> bool:
+        # Engine and its model files can be changed while running. Workers of a new pool load them,
+        # and the pool takes over when they are ready, so frames are still detected in the meantime.
+        # Return False if the engine is not changed, or cannot be used.
+        current = self.pending_pool.setting if self.pending_pool else self.detection_pool.setting
+        if not engine_changed(detection, current):
+            return False
+        problems = check_engine(detection)
+        if problems:
+            self.report_detection_error(f'Cannot use {detection.engine} engine: {", ".join(problems)}')
+            return False
+        if self.pending_pool:
+            self.pending_pool.shutdown(False)
+        old = self.detection_pool
+        pool = DetectionPool(old.size, detection.engine, old.mode, detection)
+        pool.listeners.append(self.on_pending_pool_ready)
+        self.pending_pool = pool
+        logger.info('Warm up {} engine', detection.engine)
+        pool.warm_up()
+        return True
+
+    def on_pending_pool_ready(self, pool: DetectionPool):
+        # Called from a thread of the new pool
+        if pool is not self.pending_pool:
+            # Replaced by a newer one
+            return
+        self.pending_pool = None
+        if not pool.healthy:
+            pool.shutdown(False)
+            self.report_detection_error(f'Cannot use {pool.engine} engine: {pool.errors[0]}')
+            return
+        old, self.detection_pool = self.detection_pool, pool
+        self.detection_setting = pool.setting
+        self.detection_scheduler.set_executor(pool.executor)
+        old.shutdown(False)
+        logger.info('Face detection engine is switched to {}', pool.engine)
+
+    def set_frame_size(self, frame_size: Tuple[int, int]):
+        self.frame_size = frame_size
+        if self.upload_cropper:
+            self.upload_cropper.frame_size = frame_size
+        logger.debug('Frame size: {}', frame_size)
+
+    def record(self, stage: str, started_at: float):
+        if self.stats:
+            self.stats.record(stage, (time.monotonic() - started_at) * 1000)
+
+    def get_http_client(self, backend: Backend) -> BackendClient:
+        key = type(backend).__name__
+        client = self.http_clients.get(key)
+        if client and client.backend == backend:
+            return client
+        if client:
+            # Settings of this backend are changed, its connections are of no use anymore
+            logger.debug('Close HTTP client for {}', client.backend.start_url)
+            client.close()
+        client = BackendClient(backend)
+        self.http_clients[key] = client
+        return client
+
+    def request_http(self, method: str, url: str, data: Dict[str, Any], callback: Callable,
+                     backend: Backend, basic_auth=()):
+        self.get_http_client(backend).request(method, url, data, callback, basic_auth)
+
+    def get_challenge(self, backend: Backend):
+        if self.face_tracker:
+            self.face_tracker.reset()
+        self.backend = backend
+        url = backend.start_url
+        w, h = self.frame_size
+        params = ChallengeStartRequest(image_width=w, image_height=h)
+        if isinstance(backend, SSTBackend):
+            auth = (backend.username, backend.password)
+            post_data = params.request_for_sst()
+        else:
+            auth = ()
+            post_data = params.request_for_aws()
+        logger.debug('To get challenge data from {}, with {}', url, params)
+        callback = partial(self.cb_challenge_retrieved, time.monotonic())
+        self.request_http('POST', url, post_data, callback, backend, auth)
+        # This function may be passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def cb_challenge_retrieved(self, sent_at: float, session: Soup.Session, msg: Soup.Message, backend: Backend):
+        self.record('challenge_start', sent_at)
+        status = msg.get_property('status-code')
+        raw_body = msg.get_property('response-body-data').get_data()
+        if status < 200 or status >= 300 or not raw_body:
+            logger.error('Server responded error: {} {}', status, raw_body)
+            for listener in self.challenge_listeners:
+                listener(None)
+            return
+        logger.debug('Response: {}', raw_body)
+        body = orjson.loads(raw_body)
+        if isinstance(backend, SSTBackend):
+            body['user_id'] = body.pop('external_person_id')
+        self.challenge_info = ChallengeInfo.parse_obj(body)
+        self.challenge_endpoints = backend.get_endpoints(str(self.challenge_info.id))
+        self.geometry = ChallengeGeometry.from_info(self.challenge_info)
+        self.open_frame_stream(backend)
+        if self.quality_gate:
+            self.quality_gate.reset()
+        if self.detection_cache:
+            self.detection_cache.clear()
+        if self.upload_cropper:
+            self.upload_cropper.reset(self.challenge_info)
+        logger.debug('Challenge info: {}', self.challenge_info)
+        for listener in self.challenge_listeners:
+            listener(self.challenge_info)
+        self.state_manager.trigger('center_face')
+
+    def open_frame_stream(self, backend: Backend):
+        self.close_frame_stream()
+        self.frame_stream = None
+        url = self.challenge_endpoints.stream
+        if not url:
+            return
+        auth = (backend.username, backend.password) if isinstance(backend, SSTBackend) else ()
+        self.frame_stream = FrameStream(self.get_http_client(backend), url, auth, self.on_frame_stream_message)
+        self.frame_stream.connect()
+
+    def close_frame_stream(self):
+        if not self.frame_stream:
+            return
+        logger.debug('Frame stream: {}', self.frame_stream.stats())
+        self.frame_stream.close()
+
+    def on_frame_stream_message(self, data: Dict[str, Any]):
+        # Acks carry how many frames the server has taken for verification
+        logger.debug('Frame stream message: {}', data)
+        if self.stats and data.get('type') == 'ack' and self.frame_stream and self.frame_stream.ack_latencies:
+            self.stats.record('frame_ack', self.frame_stream.ack_latencies[-1])
+
+    def get_frame_ring(self, nbytes: int) -> FrameRing:
+        if self.frame_ring and self.frame_ring.fits(nbytes):
+            return self.frame_ring
+        if self.frame_ring:
+            # Frame size is changed (new webcam). Jobs still queued or running hold slots of the old ring,
+            # and their workers may not have attached to it yet, so it is unlinked only after they finish.
+            self.frame_ring.retire()
+            if not self.frame_ring.closed:
+                self.retired_rings.append(self.frame_ring)
+        # One slot for each job in flight, plus one for the frame being written
+        # while the slot of a finished job is not released yet.
+        slot_count = self.detection_scheduler.max_in_flight + 1
+        self.frame_ring = FrameRing(slot_count, nbytes)
+        return self.frame_ring
+
+    def release_frame(self, frame: FrameRef):
+        if self.frame_ring and frame.ring == self.frame_ring.name:
+            self.frame_ring.release(frame)
+            return
+        for ring in self.retired_rings:
+            if ring.name == frame.ring:
+                ring.release(frame)
+        self.retired_rings = [r for r in self.retired_rings if not r.closed]
+
+    def set_upload_valve_open(self, to_open: bool):
+        if to_open == self.upload_valve_open:
+            return
+        valve = self.gst_pipeline.get_by_name(self.UPLOAD_VALVE_NAME)
+        valve.set_property('drop', not to_open)
+        self.upload_valve_open = to_open
+
+    def on_new_detection_sample(self, appsink: GstApp.AppSink) -> Gst.FlowReturn:
+        if appsink.is_eos():
+            return Gst.FlowReturn.OK
+        state = self.state_manager.state
+        # Only encode frames for uploading when we need to submit them, and they are good enough
+        gate = self.quality_gate
+        self.set_upload_valve_open(state == State.positioning_nose and (not gate or gate.passing))
+        if state not in (State.centering_face, State.positioning_nose):
+            return Gst.FlowReturn.OK
+        sample: Optional[Gst.Sample] = appsink.try_pull_sample(0.5)
+        if not sample:
+            return Gst.FlowReturn.OK
+        self.frames_received += 1
+        buffer: Gst.Buffer = sample.get_buffer()
+        stamp = self.stamp_frame(buffer) if self.stats else None
+        caps = sample.get_caps()
+        shape = get_frame_shape(caps)
+        stride = get_frame_stride(caps)
+        with_quality = gate is not None and state == State.positioning_nose
+        success: bool
+        mapinfo: Gst.MapInfo
+        success, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            logger.error('Failed to get mapinfo.')
+            return Gst.FlowReturn.ERROR
+        signature = None
+        if self.detection_cache:
+            signature = frame_signature(mapinfo.data, shape, stride)
+            cached = self.detection_cache.lookup(signature, with_quality)
+            if cached:
+                buffer.unmap(mapinfo)
+                # Nearly the same as a recently detected frame, no need to detect again
+                if self.detection_scheduler.accept_cached():
+                    self.apply_detection_result(cached.result, cached.quality, shape, stamp)
+                return Gst.FlowReturn.OK
+        if not self.detection_scheduler.has_capacity():
+            buffer.unmap(mapinfo)
+            logger.debug('Face detection is busy. Drop this frame.')
+            return Gst.FlowReturn.OK
+        # Copy the frame to shared memory, which is the only copy we make.
+        # In Gstreamer 1.18, Gst.MapInfo.data is memoryview instead of bytes, both are accepted.
+        ring = self.get_frame_ring(mapinfo.size)
+        frame = ring.write(mapinfo.data, shape, stride)
+        buffer.unmap(mapinfo)
+        if not frame:
+            logger.debug('All frame slots are busy. Drop this frame.')
+            return Gst.FlowReturn.OK
+        window = self.face_tracker.get_search_window(shape) if self.face_tracker else None
+        try:
+            # Engine is not passed, each worker uses the one of its pool, so jobs stay right while switching pools
+            self.detection_scheduler.submit(inspect_frame, frame, window, self.detection_setting.tracking_min_score,
+                                            None, with_quality,
+                                            stamp=stamp, signature=signature)
+        except RuntimeError:
+            logger.warning('Executor is already shutdown')
+            ring.release(frame)
+        return Gst.FlowReturn.OK
+
+    def stamp_frame(self, buffer: Gst.Buffer) -> FrameStamp:
+        stamp = FrameStamp(buffer.pts, time.monotonic())
+        clock: Optional[Gst.Clock] = self.gst_pipeline.get_clock()
+        if clock and buffer.pts != Gst.CLOCK_TIME_NONE:
+            # How long since the frame is captured, according to pipeline running time
+            running_time = clock.get_time() - self.gst_pipeline.get_base_time()
+            self.stats.record('pts_to_appsink', (running_time - buffer.pts) / Gst.MSECOND)
+        return stamp
+
+    def on_upload_frame_probe(self, pad: Gst.Pad, info: Gst.PadProbeInfo):
+        buffer: Gst.Buffer = info.get_buffer()
+        self.upload_frame_times.put(buffer.pts, time.monotonic())
+        return Gst.PadProbeReturn.OK
+
+    def pass_face_detection_result(self, job: DetectionJob, future: Future, fresh: bool):
+        frame = job.frame
+        self.release_frame(frame)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error:
+            # Like when the engine cannot be created in workers. Every job fails the same way, report it once.
+            self.report_detection_error(f'{type(error).__name__}: {error}')
+            return
+        self.detection_error = ''
+        self.record('detect_face', job.submitted_at)
+        if job.stamp:
+            self.record('appsink_to_result', job.stamp.arrived_at)
+        controller = self.framerate_controller
+        if controller:
+            controller.record((time.monotonic() - job.submitted_at) * 1000, len(self.detection_scheduler.in_flight))
+            fps = controller.update(self.detection_scheduler.dropped_busy)
+            if fps:
+                GLib.idle_add(self.set_detection_fps, fps)
+        # Result of an older frame must not overwrite the newer one
+        if not fresh:
+            return
+        result, quality = future.result()
+        if self.detection_cache and job.signature is not None:
+            self.detection_cache.add(job.signature, result, quality)
+        self.apply_detection_result(result, quality, frame.shape, job.stamp)
+
+    def apply_detection_result(self, result: Optional[CompactDrawData], quality: Optional[FrameQuality],
+                               shape: Tuple[int, ...], stamp: Optional[FrameStamp] = None):
+        # Shape is of the frame which face detection ran on
+        logger.debug('Image processing: {}', result)
+        if quality and self.quality_gate:
+            self.quality_gate.check(quality)
+        if self.face_tracker:
+            self.face_tracker.update(result)
+        judged = None
+        if result and self.frame_size:
+            # Map coordinates from detection frame back to the original frame
+            width, height = self.frame_size
+            scale = (width / shape[1], height / shape[0])
+            data = OverlayDrawData.from_compact(result, scale)
+            # Check against challenge areas here, not in draw callback
+            geometry = self.geometry
+            judged = geometry.judge(data) if geometry else OverlayFrame(tuple(data.nose_tip), False, False)
+            if self.upload_cropper:
+                self.upload_cropper.set_face(data.face_box)
+        for listener in self.result_listeners:
+            listener(judged, stamp)
+        # Transitions are only requested when the conditions become true
+        state = self.state_manager.state
+        self.state_manager.update('position_nose', state == State.centering_face
+                                  and judged is not None and judged.face_inside)
+        self.state_manager.update('verify', state == State.positioning_nose
+                                  and judged is not None and judged.nose_positioned)
+
+    def set_detection_fps(self, fps: int):
+        capsfilter = self.gst_pipeline.get_by_name(self.DETECTION_RATE_FILTER_NAME) if self.gst_pipeline else None
+        if capsfilter:
+            # videorate is asked to renegotiate, without restarting the pipeline
+            capsfilter.set_property('caps', build_framerate_caps(fps))
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def on_new_upload_sample(self, appsink: GstApp.AppSink) -> Gst.FlowReturn:
+        if appsink.is_eos():
+            return Gst.FlowReturn.OK
+        sample: Optional[Gst.Sample] = appsink.try_pull_sample(0.5)
+        if not sample or self.state_manager.state != State.positioning_nose:
+            return Gst.FlowReturn.OK
+        # Frames which passed the valve before it is closed
+        if self.quality_gate and not self.quality_gate.passing:
+            return Gst.FlowReturn.OK
+        buffer: Gst.Buffer = sample.get_buffer()
+        # Frame is already encoded to JPEG by the pipeline. We just take the bytes
+        # and leave the rest to main thread, to not block this streaming thread.
+        success, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            logger.error('Failed to get mapinfo.')
+            return Gst.FlowReturn.ERROR
+        jpeg_data = bytes(mapinfo.data)
+        buffer.unmap(mapinfo)
+        frame_started_at = None
+        if self.stats:
+            frame_started_at = self.upload_frame_times.pop(buffer.pts)
+            if frame_started_at:
+                self.record('jpeg_encode', frame_started_at)
+        crop = self.upload_cropper.pop_crop(buffer.pts) if self.upload_cropper else None
+        GLib.idle_add(self.submit_frame, jpeg_data, frame_started_at, crop)
+        return Gst.FlowReturn.OK
+
+    def submit_frame(self, jpeg_data: bytes, frame_started_at: Optional[float] = None,
+                     crop: Optional[Rectangle] = None):
+        backend = self.backend
+        url = self.challenge_endpoints.frames
+        is_sst = isinstance(backend, SSTBackend)
+        auth = (backend.username, backend.password) if is_sst else ()
+        method = 'POST' if is_sst else 'PUT'
+        self.frames_submitted += 1
+        self.bytes_submitted += len(jpeg_data)
+        if self.frame_stream and self.frame_stream.send(jpeg_data, crop):
+            # Until the WebSocket is open, or if it fails, frames go by HTTP
+            return False
+        callback = self.cb_frame_submission_done
+        if self.stats:
+            callback = partial(self.cb_timed_frame_submission, time.monotonic(), frame_started_at)
+        if backend.binary_frames:
+            # No base64 and JSON encoding, the JPEG bytes are the body
+            logger.debug('Submit frame of {} bytes', len(jpeg_data))
+            self.get_http_client(backend).send(method, url, 'image/jpeg', jpeg_data, callback, auth,
+                                               build_frame_headers(crop))
+            # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+            return False
+        # Backend accepts timestamp to microsecond
+        params = FrameSubmitRequest(
+            frame_base64=b64encode(jpeg_data),
+            token=self.challenge_info.token
+        )
+        params.set_crop(crop)
+        post_data = params.request_for_sst() if is_sst else params.request_for_aws()
+        logger.debug('Submit frame with fields: {}', post_data.keys())
+        self.request_http(method, url, post_data, callback, backend, auth)
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def cb_frame_submission_done(self, session: Soup.Session, msg: Soup.Message, backend: Backend):
+        raw_body = msg.get_property('response-body-data').get_data()
+        logger.debug('Frame submission response: {} {}', msg.get_property('status-code'), raw_body)
+
+    def cb_timed_frame_submission(self, sent_at: float, frame_started_at: Optional[float],
+                                  session: Soup.Session, msg: Soup.Message, backend: Backend):
+        self.record('cb_frame_submission_done', sent_at)
+        if frame_started_at:
+            self.record('valve_to_uploaded', frame_started_at)
+        self.cb_frame_submission_done(session, msg, backend)
+
+    def on_challenge_state_changed(self, state: Optional[State]):
+        # Called from asyncio thread
+        if state == State.verifying:
+            GLib.idle_add(self.verify_challenge)
+
+    def verify_challenge(self):
+        self.close_frame_stream()
+        backend = self.backend
+        url = self.challenge_endpoints.verify
+        params = ChallengeVerifyRequest(token=self.challenge_info.token, debug=True)
+        logger.debug('To post to {}', url)
+        if isinstance(backend, SSTBackend):
+            auth = (backend.username, backend.password)
+            post_data = params.request_for_sst()
+        else:
+            auth = ()
+            post_data = params.request_for_aws()
+        callback = partial(self.cb_challenge_verification_done, time.monotonic())
+        self.request_http('POST', url, post_data, callback, backend, auth)
+        # This function is passed to GLib.idle_add, so it needs to return False to avoid repetition
+        return False
+
+    def cb_challenge_verification_done(self, sent_at: float, session: Soup.Session, msg: Soup.Message,
+                                       backend: Backend):
+        self.record('challenge_verify', sent_at)
+        raw_body = msg.get_property('response-body-data').get_data()
+        logger.debug('Challenge verify response content: {}', raw_body)
+        err_message = ''
+        try:
+            rsp = json.loads(raw_body)
+            success = bool(rsp.get('success'))
+            err_message = rsp.get('message') or ''
+        except (ValueError, TypeError, AttributeError):
+            success = False
+        if success:
+            future = self.state_manager.trigger('finish_success')
+        else:
+            future = self.state_manager.trigger('finish_failed', err_message)
+        for listener in self.verification_listeners:
+            listener(success, err_message, future)
+
+    def component_stats(self) -> Dict[str, Any]:
+        return {
+            'detection': self.detection_scheduler.stats(),
+            'quality_gate': self.quality_gate.stats() if self.quality_gate else None,
+            'detection_cache': self.detection_cache.stats() if self.detection_cache else None,
+            'frame_stream': self.frame_stream.stats() if self.frame_stream else None,
+        }
+
+    def close(self):
+        # Jobs should have been cancelled, and waited for, by the owner
+        logger.debug('Face detection stats: {}', self.detection_scheduler.stats())
+        if self.pending_pool:
+            self.pending_pool.shutdown(False)
+        self.detection_pool.shutdown(True)
+        self.close_frame_stream()
+        for client in self.http_clients.values():
+            client.close()
+        for ring in self.retired_rings:
+            ring.close()
+        self.retired_rings = []
+        if self.frame_ring:
+            self.frame_ring.close()
+            self.frame_ring = None
@@ -1,28 +1,67 @@
-from typing import Optional
+from threading import Lock
+from typing import Optional, Dict, Tuple, TYPE_CHECKING
+from multiprocessing.shared_memory import SharedMemory
 
-import numpy as np
-import face_recognition
-from PIL import Image
 from logbook import Logger
 
-from .models import Rectangle, OverlayDrawData
+from .models import CompactDrawData
+from .framering import FrameRef
+from .quality import FrameQuality, measure_quality
+
+# The main process imports this module only to pass inspect_frame to executor,
+# so NumPy and detection engines are imported when a worker runs the functions.
+if TYPE_CHECKING:
+    import numpy as np
 
 
 logger = Logger(__name__)
+# Shared memory blocks which this worker process has attached to, by name
+_attached_rings: Dict[str, SharedMemory] = {}
+# In thread pool mode, many threads attach at the same time
+_attach_lock = Lock()
+
+
+def attach_frame(frame: FrameRef) -> 'np.ndarray':
+    import numpy as np
+    shm = _attached_rings.get(frame.ring)
+    if shm is None:
+        with _attach_lock:
+            shm = _attached_rings.get(frame.ring)
+            if shm is None:
+                shm = _attach_ring(frame.ring)
+    if not frame.padded:
+        return np.ndarray(frame.shape, np.uint8, buffer=shm.buf, offset=frame.offset)
+    # Rows are padded by GStreamer. Detection engines want contiguous arrays, so copy without the padding.
+    strides = (frame.stride, frame.shape[2], 1) if len(frame.shape) > 2 else (frame.stride, 1)
+    return np.ascontiguousarray(np.ndarray(frame.shape, np.uint8, buffer=shm.buf, offset=frame.offset,
+                                           strides=strides))
+
+
+def _attach_ring(name: str) -> SharedMemory:
+    # The main process only keeps one ring at a time, so the old ones are stale
+    for old in _attached_rings.values():
+        try:
+            old.close()
+        except BufferError:
+            pass
+    _attached_rings.clear()
+    shm = SharedMemory(name=name)
+    _attached_rings[name] = shm
+    return shm
 
 
-def detect_face(img: Image.Image) -> Optional[OverlayDrawData]:
-    nimp = np.asarray(img)
-    faces = face_recognition.face_locations(nimp)
-    logger.debug('Faces: {}', faces)
-    if faces:
-        # face_recognition return result as (top, right, bottom, left)
-        t, r, b, le = faces[0]
-        rect = Rectangle(le, t, r - le, b - t)
-        landmarks = face_recognition.face_landmarks(nimp)
-        logger.debug('Landmarks: {}', landmarks)
-        nose_bridge = landmarks[0]['nose_bridge']
-        nose_tip = landmarks[0]['nose_tip']
-        draw_data = OverlayDrawData(face_box=rect, nose_bridge=nose_bridge, nose_tip=nose_tip)
-        return draw_data
-    return None
+def inspect_frame(frame: FrameRef, window: Optional[Tuple[int, int, int, int]] = None,
+                  min_score: float = 0, engine: Optional[str] = None,
+                  with_quality: bool = False) -> Tuple[Optional[CompactDrawData], Optional[FrameQuality]]:
+    # Find face and nose, and measure frame quality if asked, while the frame is at hand.
+    # If engine is not given, the worker uses the one which it is started with.
+    from .detectors import get_detector
+    try:
+        nimp = attach_frame(frame)
+    except FileNotFoundError:
+        logger.debug('Frame ring {} is gone', frame.ring)
+        return None, None
+    result = get_detector(engine).detect(nimp, window, min_score)
+    if not with_quality:
+        return result, None
+    return result, measure_quality(nimp, result[0] if result else None)
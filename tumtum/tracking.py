@@ -0,0 +1,52 @@
+from typing import Optional, Tuple
+
+from logbook import Logger
+
+from .models import CompactDrawData
+
+
+logger = Logger(__name__)
+# (x, y, width, height), in detection frame coordinates
+Window = Tuple[int, int, int, int]
+
+
+class FaceTracker:
+    '''
+    Remember where the face was found, so that the next frames are searched
+    only in a window around it. The face barely moves between frames while
+    the user is following the challenge.
+    '''
+    # Tuple assignment is atomic, so this can be updated from executor thread
+    # and read from GStreamer streaming thread.
+    last_box: Optional[Window] = None
+
+    def __init__(self, margin: float = 0.5):
+        # How much to expand the face box, on each side, relative to the box size
+        self.margin = margin
+
+    def get_search_window(self, shape: Tuple[int, ...]) -> Optional[Window]:
+        box = self.last_box
+        if not box:
+            return None
+        height, width = shape[:2]
+        x, y, w, h = box
+        dx = round(w * self.margin)
+        dy = round(h * self.margin)
+        left = max(x - dx, 0)
+        top = max(y - dy, 0)
+        right = min(x + w + dx, width)
+        bottom = min(y + h + dy, height)
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right - left, bottom - top)
+
+    def update(self, result: Optional[CompactDrawData]):
+        if not result:
+            if self.last_box:
+                logger.debug('Face is lost, back to full-frame detection')
+            self.last_box = None
+            return
+        self.last_box = result[0]
+
+    def reset(self):
+        self.last_box = None
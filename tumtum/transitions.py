@@ -0,0 +1,92 @@
+import time
+import asyncio
+from threading import Lock
+from asyncio import AbstractEventLoop
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Callable, Any, TYPE_CHECKING
+
+from logbook import Logger
+
+from .consts import STATE_DEBOUNCE
+
+# Any machine with a state attribute and coroutine events works, so GTK is not needed here
+if TYPE_CHECKING:
+    from .states import ChallengeLifeCycle, State
+
+
+logger = Logger(__name__)
+
+
+class ChallengeStateManager:
+    '''
+    Thread-safe front of ChallengeLifeCycle, for GStreamer threads and GTK callbacks.
+
+    - Current state is mirrored in a plain attribute, which can be read from any thread without locking.
+    - Transitions still run on the asyncio loop, but frame handlers call update() with a condition,
+      and the transition is only requested when the condition becomes true, not on every frame while it holds.
+    - The same transition is not requested again while it is pending, or within the debounce period.
+    '''
+
+    def __init__(self, machine: 'ChallengeLifeCycle', loop: AbstractEventLoop, debounce: float = STATE_DEBOUNCE):
+        self.machine = machine
+        self.loop = loop
+        self.debounce = debounce
+        self.state: Optional['State'] = machine.state
+        # Called with new state, from the asyncio thread
+        self.listeners: List[Callable[[Optional['State']], Any]] = []
+        # Last value of each condition passed to update(), by event name
+        self._conditions: Dict[str, bool] = {}
+        self._pending: Dict[str, Future] = {}
+        self._fired_at: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def trigger(self, event: str, *args) -> Future:
+        # Request a transition unconditionally, like when a challenge starts or server responds.
+        with self._lock:
+            self._fired_at[event] = time.monotonic()
+            future = self._fire(event, args)
+        self._watch(event, future)
+        return future
+
+    def update(self, event: str, condition: bool, *args) -> bool:
+        # Called for every frame. Return True if the transition is requested.
+        with self._lock:
+            was_true = self._conditions.get(event, False)
+            self._conditions[event] = condition
+            if not condition or was_true or event in self._pending:
+                return False
+            now = time.monotonic()
+            if now - self._fired_at.get(event, -self.debounce) < self.debounce:
+                # Let the condition become true again later
+                self._conditions[event] = False
+                return False
+            self._fired_at[event] = now
+            future = self._fire(event, args)
+        self._watch(event, future)
+        return True
+
+    def _fire(self, event: str, args) -> Future:
+        # Must be called with lock held
+        future = asyncio.run_coroutine_threadsafe(getattr(self.machine, event)(*args), self.loop)
+        self._pending[event] = future
+        return future
+
+    def _watch(self, event: str, future: Future):
+        # Must be called without lock held, because the callback runs right away if the transition is already done
+        future.add_done_callback(lambda f: self._on_transition_done(event, f))
+
+    def _on_transition_done(self, event: str, future: Future):
+        with self._lock:
+            if self._pending.get(event) is future:
+                del self._pending[event]
+            failed = future.cancelled() or future.exception() is not None
+            if failed:
+                # Condition is still true, but give it another chance on a later frame
+                self._conditions[event] = False
+            old_state, self.state = self.state, self.machine.state
+        if failed and not future.cancelled():
+            logger.debug('Transition {} from {} is not done: {}', event, old_state, future.exception())
+        if self.state != old_state:
+            logger.debug('State: {} -> {}', old_state, self.state)
+            for listener in self.listeners:
+                listener(self.state)
@@ -0,0 +1,180 @@
+import os
+import time
+import threading
+from importlib.util import find_spec
+from threading import Event, Lock
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from typing import Optional, Dict, Tuple, List, Callable, NamedTuple, Any
+
+from logbook import Logger
+
+from .models import DetectionSetting
+
+
+logger = Logger(__name__)
+# How long each warm-up probe keeps its worker busy, so that the other probes go to other workers
+PROBE_HOLD = 0.1
+# Detection settings which decide what the engine loads. Workers can switch to new ones without restarting the app.
+ENGINE_FIELDS = ('engine', 'dnn_model', 'dnn_config', 'onnx_model')
+# Packages which each engine imports, see detectors.DETECTORS
+ENGINE_MODULES = {
+    'dlib_hog': ('dlib', 'face_recognition_models'),
+    'opencv_haar': ('cv2', 'dlib', 'face_recognition_models'),
+    'opencv_dnn': ('cv2', 'dlib', 'face_recognition_models'),
+    'onnx_landmarks': ('cv2', 'onnxruntime'),
+}
+# Settings of model files which each engine needs
+ENGINE_MODEL_FILES = {
+    'opencv_dnn': ('dnn_model', 'dnn_config'),
+    'onnx_landmarks': ('onnx_model',),
+}
+
+
+class WorkerStatus(NamedTuple):
+    pid: int
+    thread: str
+    engine: str
+    # Seconds spent on loading models
+    load_seconds: float
+    # Empty if models are loaded successfully
+    error: str = ''
+
+
+def check_engine(setting: DetectionSetting) -> List[str]:
+    # Cheap check, in the main process, of what the engine needs. Return the problems, empty if none.
+    # Models are only really loaded by workers.
+    problems = []
+    for module in ENGINE_MODULES[setting.engine]:
+        if find_spec(module) is None:
+            problems.append(f'{module} is not installed')
+    for field in ENGINE_MODEL_FILES.get(setting.engine, ()):
+        path = getattr(setting, field)
+        if not path:
+            problems.append(f'{field} is not set')
+        elif not os.path.isfile(path):
+            problems.append(f'{field} file {path} does not exist')
+    return problems
+
+
+def engine_changed(new: DetectionSetting, old: DetectionSetting) -> bool:
+    return any(getattr(new, k) != getattr(old, k) for k in ENGINE_FIELDS)
+
+
+# Set by init_worker, in each worker process or thread
+_worker = threading.local()
+
+
+def init_worker(engine: str, setting: Optional[DetectionSetting] = None):
+    # Run in each worker process when it starts, before it takes any job.
+    # Heavy modules are imported here, not in the main process.
+    from .detectors import get_detector, set_default_setting
+    # Jobs only name the engine, its model files are from the settings the pool is created with
+    set_default_setting(setting)
+    started_at = time.monotonic()
+    error = ''
+    try:
+        detector = get_detector(engine)
+        # Shape predictor, and models of this worker thread, are loaded now instead of on the first face
+        detector.warm_up()
+    except Exception as e:
+        # Exception from initializer would break the whole pool, so we only report it
+        logger.exception('Failed to load face detection engine {}', engine)
+        error = f'{type(e).__name__}: {e}'
+    _worker.status = WorkerStatus(os.getpid(), threading.current_thread().name, engine,
+                                  time.monotonic() - started_at, error)
+
+
+def probe_worker(hold: float = 0) -> WorkerStatus:
+    time.sleep(hold)
+    try:
+        return _worker.status
+    except AttributeError:
+        return WorkerStatus(os.getpid(), threading.current_thread().name, '', 0, 'Worker is not initialized')
+
+
+class DetectionPool:
+    '''
+    Pool for face detection, whose workers load the detection models as soon as they start.
+    The workers are spawned and warmed up in background, so that the first frames of a challenge don't wait.
+
+    Workers are processes by default. In "thread" mode, they are threads of the main process,
+    sharing one copy of the models, which uses much less memory. It relies on the engine releasing the GIL.
+
+    Model files are read from the settings given here, so changing them needs a new pool.
+    '''
+
+    def __init__(self, size: int, engine: str, mode: str = 'process', setting: Optional[DetectionSetting] = None):
+        self.size = size
+        self.engine = engine
+        self.mode = mode
+        self.setting = setting
+        if mode == 'thread':
+            self.executor = ThreadPoolExecutor(size, thread_name_prefix='detection',
+                                               initializer=init_worker, initargs=(engine, setting))
+        else:
+            self.executor = ProcessPoolExecutor(size, initializer=init_worker, initargs=(engine, setting))
+        self.ready = Event()
+        # Status reported by workers, by PID and thread name
+        self.workers: Dict[Tuple[int, str], WorkerStatus] = {}
+        self.errors: List[str] = []
+        self.started_at: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        # Called with this pool when warm-up is done, from a thread of the executor
+        self.listeners: List[Callable[['DetectionPool'], Any]] = []
+        self._pending = 0
+        self._lock = Lock()
+
+    def warm_up(self):
+        # Send one probe for each worker, so that all of them are spawned now, not on first frames.
+        # Raise RuntimeError if the executor has been shut down.
+        self.started_at = time.monotonic()
+        self._pending = self.size
+        futures = [self.executor.submit(probe_worker, PROBE_HOLD) for _i in range(self.size)]
+        for f in futures:
+            f.add_done_callback(self._on_probe_done)
+
+    def _on_probe_done(self, future: Future):
+        with self._lock:
+            if future.cancelled():
+                self.errors.append('Warm-up is cancelled')
+            elif future.exception():
+                self.errors.append(repr(future.exception()))
+            else:
+                status: WorkerStatus = future.result()
+                self.workers[(status.pid, status.thread)] = status
+                if status.error:
+                    self.errors.append(status.error)
+            self._pending -= 1
+            if self._pending:
+                return
+            self.warmup_seconds = time.monotonic() - self.started_at
+        if self.errors:
+            logger.error('Face detection workers failed to warm up: {}', self.errors)
+        else:
+            logger.info('{} face detection workers are ready after {:.2f}s', len(self.workers), self.warmup_seconds)
+        self.ready.set()
+        for listener in self.listeners:
+            listener(self)
+
+    @property
+    def healthy(self) -> bool:
+        return self.ready.is_set() and not self.errors
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self.ready.wait(timeout) and not self.errors
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'engine': self.engine,
+            'mode': self.mode,
+            'size': self.size,
+            'ready': self.ready.is_set(),
+            'healthy': self.healthy,
+            'workers': len(self.workers),
+            'warmup_seconds': self.warmup_seconds,
+            'load_seconds': {f'{pid}/{thread}': round(s.load_seconds, 3) for (pid, thread), s in self.workers.items()},
+            'errors': self.errors,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait)